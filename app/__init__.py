@@ -4,11 +4,9 @@ from flask import Flask
 from flask.ext.mail import Mail
 from flask.ext.sqlalchemy import SQLAlchemy
 from flask.ext.login import LoginManager
-from flask.ext.assets import Environment
 from flask.ext.wtf import CsrfProtect
-from flask.ext.compress import Compress
 from config import config
-from assets import app_css, app_js, vendor_css, vendor_js
+from compression import Compress
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -31,25 +29,64 @@ def create_app(config_name):
     # Set up extensions
     mail.init_app(app)
     db.init_app(app)
+
+    # Record request metrics. This comes first, so that its after_request
+    # function runs last and sees the final (compressed) response.
+    from metrics import request_metrics
+    request_metrics.init_app(app)
+
+    # Profile sampled requests and those an administrator asks for
+    from profiler import profiler
+    profiler.init_app(app)
+
     login_manager.init_app(app)
     csrf.init_app(app)
     compress.init_app(app)
 
+    # Time SQL statements and report slow and repeated ones
+    from sql_stats import sql_stats
+    sql_stats.init_app(app)
+
+    # Keep the member search index in sync with the database
+    import search  # noqa
+
+    # Set up the in-memory copies of the lookup tables
+    from models import role_registry, user_type_registry
+    role_registry.init_app(app)
+    user_type_registry.init_app(app)
+
+    # Set up the cache of logged in users' identities
+    from models import identity_cache
+    identity_cache.configure(maxsize=app.config['IDENTITY_CACHE_SIZE'],
+                             ttl=app.config['IDENTITY_CACHE_TTL'])
+
+    # Set up the password hashing pool
+    from passwords import password_hasher
+    password_hasher.init_app(app)
+
+    # Set up delivery of queued emails
+    from .email import outbox
+    outbox.init_app(app)
+
+    # Set up the per-worker tag membership index
+    from tag_index import tag_index
+    tag_index.init_app(app)
+
+    # Set up the per-worker index of tag names used for suggestions
+    from tag_suggestions import tag_suggestions
+    tag_suggestions.init_app(app)
+
+    # Set up the per-worker cache of rendered fragments
+    from fragment_cache import fragment_cache
+    fragment_cache.init_app(app)
+
     # Register Jinja template functions
     from utils import register_template_utils
     register_template_utils(app)
 
     # Set up asset pipeline
-    assets_env = Environment(app)
-    dirs = ['assets/styles', 'assets/scripts']
-    for path in dirs:
-        assets_env.append_path(os.path.join(basedir, path))
-    assets_env.url_expire = True
-
-    assets_env.register('app_css', app_css)
-    assets_env.register('app_js', app_js)
-    assets_env.register('vendor_css', vendor_css)
-    assets_env.register('vendor_js', vendor_js)
+    import assets
+    assets.init_app(app)
 
     # Configure SSL if platform supports it
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
@@ -66,4 +103,7 @@ def create_app(config_name):
     from admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
 
+    from api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
     return app
@@ -5,11 +5,8 @@ from wtforms.fields import (
     PasswordField,
     BooleanField,
     SubmitField,
-    TextAreaField
-)
-from wtforms.ext.sqlalchemy.fields import (
-    QuerySelectMultipleField,
-    QuerySelectField
+    TextAreaField,
+    SelectMultipleField
 )
 from wtforms.fields.html5 import EmailField, URLField
 from wtforms.validators import (
@@ -21,8 +18,9 @@ from wtforms.validators import (
     URL
 )
 from wtforms import ValidationError
-from ..models import User, Tag, UserType
-from .. import db
+from ..fields import LookupSelectField
+from ..memberships import set_tags
+from ..models import User, Tag, user_type_registry
 
 
 class LoginForm(Form):
@@ -55,11 +53,9 @@ class RegistrationForm(Form):
         EqualTo('password2', 'Passwords must match')
     ])
     password2 = PasswordField('Confirm password', validators=[InputRequired()])
-    user_type = QuerySelectField('User Type',
-                                 validators=[InputRequired()],
-                                 get_label='name',
-                                 query_factory=lambda:
-                                 db.session.query(UserType))
+    user_type = LookupSelectField('User Type',
+                                  validators=[InputRequired()],
+                                  registry=user_type_registry)
 
     submit = SubmitField('Register')
 
@@ -133,6 +129,50 @@ class ChangeEmailForm(Form):
             raise ValidationError('Email already registered.')
 
 
+class TagsField(SelectMultipleField):
+    """
+    Choose any number of tags. Only the chosen tags are rendered as options;
+    the others are suggested by `account.suggest_tags` as the user types.
+    Validation loads only the submitted tags, and saving writes only the
+    memberships that changed.
+    """
+
+    def __init__(self, label=None, validators=None, **kwargs):
+        super(TagsField, self).__init__(label, validators, coerce=int,
+                                        **kwargs)
+        self.unknown = []
+
+    def __call__(self, **kwargs):
+        kwargs.setdefault('data-suggest-url', url_for('account.suggest_tags'))
+        return super(TagsField, self).__call__(**kwargs)
+
+    def iter_choices(self):
+        for tag in self.data:
+            yield (tag.id, tag.name, True)
+
+    def process_data(self, value):
+        self.data = list(value or ())
+
+    def process_formdata(self, valuelist):
+        self.data = []
+        try:
+            ids = [int(value) for value in valuelist]
+        except ValueError:
+            raise ValueError(self.gettext('Not a valid choice'))
+        ids = sorted(set(ids), key=ids.index)
+        tags = dict((t.id, t) for t in Tag.query.filter(Tag.id.in_(ids))) \
+            if ids else {}
+        self.data = [tags[i] for i in ids if i in tags]
+        self.unknown = [i for i in ids if i not in tags]
+
+    def pre_validate(self, form):
+        if self.unknown:
+            raise ValueError(self.gettext('Not a valid choice'))
+
+    def populate_obj(self, obj, name):
+        set_tags(obj, self.data)
+
+
 class EditProfileForm(Form):
     first_name = StringField('First name', validators=[
         InputRequired(),
@@ -151,10 +191,6 @@ class EditProfileForm(Form):
         Optional()
     ])
     bio = TextAreaField('Bio', validators=[Optional()])
-    # TODO because of semantic ui, this doesn't actually query
-    tags = QuerySelectMultipleField(
-        'Tags',
-        get_label='name',
-        query_factory=lambda: db.session.query(Tag))
+    tags = TagsField('Tags')
 
     submit = SubmitField('Save')
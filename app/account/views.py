@@ -1,4 +1,14 @@
-from flask import render_template, redirect, request, url_for, flash, abort
+from flask import (
+    render_template,
+    redirect,
+    request,
+    url_for,
+    flash,
+    abort,
+    jsonify,
+    escape,
+    Markup
+)
 from flask.ext.login import (
     login_required,
     login_user,
@@ -7,8 +17,14 @@ from flask.ext.login import (
 )
 from . import account
 from .. import db
+from ..conditional import conditional
 from ..email import send_email
-from ..models import User
+from ..fragment_cache import fragment_cache
+from ..models import User, Tag, user_type_registry
+from ..passwords import password_hasher, PasswordHashTimeout
+from ..search import search_users
+from ..tag_index import tag_index, page_of
+from ..tag_suggestions import tag_suggestions
 from .forms import (
     LoginForm,
     RegistrationForm,
@@ -27,7 +43,23 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user is not None and user.verify_password(form.password.data):
+        try:
+            valid = user is not None and \
+                user.verify_password(form.password.data)
+        except PasswordHashTimeout:
+            flash('Too many people are logging in right now. Please try '
+                  'again in a moment.', 'form-error')
+            return render_template('account/login.html', form=form), 503
+        if valid:
+            if user.password_needs_rehash():
+                # Store the password with the current hashing method. The
+                # login goes ahead even if this cannot be done right now.
+                try:
+                    user.password = form.password.data
+                    db.session.commit()
+                    password_hasher.count_rehash()
+                except PasswordHashTimeout:
+                    pass
             login_user(user, form.remember_me.data)
             flash('You are now logged in. Welcome back!', 'success')
             return redirect(request.args.get('next') or url_for('main.index'))
@@ -47,10 +79,11 @@ def register():
                     password=form.password.data,
                     user_type=form.user_type.data)
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         token = user.generate_confirmation_token()
         send_email(user.email, 'Confirm Your Account',
                    'account/email/confirm', user=user, token=token)
+        db.session.commit()
         flash('A confirmation link has been sent to {}.'.format(user.email),
               'warning')
         return redirect(url_for('main.index'))
@@ -89,6 +122,7 @@ def reset_password_request():
                        user=user,
                        token=token,
                        next=request.args.get('next'))
+            db.session.commit()
         flash('A password reset link has been sent to {}.'
               .format(form.email.data),
               'warning')
@@ -123,9 +157,10 @@ def change_password():
     """Change an existing user's password."""
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if current_user.verify_password(form.old_password.data):
-            current_user.password = form.new_password.data
-            db.session.add(current_user)
+        user = User.query.get(current_user.id)
+        if user.verify_password(form.old_password.data):
+            user.password = form.new_password.data
+            db.session.add(user)
             db.session.commit()
             flash('Your password has been updated.', 'form-success')
             return redirect(url_for('main.index'))
@@ -148,6 +183,7 @@ def change_email_request():
                        'account/email/change_email',
                        user=current_user,
                        token=token)
+            db.session.commit()
             flash('A confirmation link has been sent to {}.'.format(new_email),
                   'warning')
             return redirect(url_for('main.index'))
@@ -174,6 +210,7 @@ def confirm_request():
     token = current_user.generate_confirmation_token()
     send_email(current_user.email, 'Confirm Your Account',
                'account/email/confirm', user=current_user, token=token)
+    db.session.commit()
     flash('A new confirmation link has been sent to {}.'.
           format(current_user.email),
           'warning')
@@ -233,6 +270,7 @@ def join_from_invite(user_id, token):
                    user=new_user,
                    user_id=new_user.id,
                    token=token)
+        db.session.commit()
     return redirect(url_for('main.index'))
 
 
@@ -256,13 +294,101 @@ def edit_profile():
     return render_template('account/edit_profile.html', form=form)
 
 
+def _profile_validators(user_id):
+    """The versions of the user and their tags, which the profile shows."""
+    row = db.session.query(User.version_id, User.updated_at,
+                           User.user_type_id, db.func.max(Tag.updated_at)) \
+        .outerjoin(User.tags).filter(User.id == user_id) \
+        .group_by(User.id, User.version_id, User.updated_at,
+                  User.user_type_id).first()
+    if row is None:
+        return None
+    version_id, updated_at, user_type_id, tags_updated_at = row
+    return ([version_id, updated_at, tags_updated_at,
+             user_type_registry.get(user_type_id)],
+            max(updated_at, tags_updated_at or updated_at))
+
+
 @account.route('/profile/<int:user_id>')
 @login_required
+@conditional(_profile_validators)
 def profile(user_id):
+    content = fragment_cache.cached(('profile', user_id),
+                                    lambda: _render_profile(user_id))
+    return render_template('account/profile.html', content=content)
+
+
+def _render_profile(user_id):
+    """The body of a user's profile page and the entities it shows."""
     user = User.query.get(user_id)
     if user is None:
         abort(404)
-    return render_template('account/profile.html', user=user)
+    tag_counts = Tag.user_counts(t.id for t in user.tags)
+    content = render_template('account/_profile.html', user=user,
+                              tag_counts=tag_counts)
+    depends = [('user', user.id), ('user_type', user.user_type_id)] + \
+        [('tag', t.id) for t in user.tags]
+    return Markup(content), depends
+
+
+@account.route('/tag/<int:tag_id>')
+@account.route('/tags/members')
+@login_required
+def tag_members(tag_id=None):
+    """
+    List the members that have every tag in the `all` query arguments and at
+    least one of the tags in the `any` query arguments. `/tag/<tag_id>` is
+    the result page of a single tag.
+    """
+    all_of = request.args.getlist('all', type=int)
+    any_of = request.args.getlist('any', type=int)
+    if tag_id is not None:
+        all_of.append(tag_id)
+    if not all_of and not any_of:
+        return redirect(url_for('account.my_profile'))
+
+    tags = dict((t.id, t) for t in
+                Tag.query.filter(Tag.id.in_(set(all_of + any_of))))
+    if tag_id is not None and tag_id not in tags:
+        abort(404)
+
+    members = tag_index.query(all_of=all_of, any_of=any_of)
+    ids, has_next = page_of(members, after=request.args.get('after', type=int))
+    users = dict((u.id, u) for u in User.query.filter(User.id.in_(ids))) \
+        if ids else {}
+    return render_template('account/tag_members.html',
+                           tag_choices=Tag.query.order_by(Tag.name).all(),
+                           all_tags=[tags[t] for t in all_of if t in tags],
+                           any_tags=[tags[t] for t in any_of if t in tags],
+                           total=len(members),
+                           users=[users[i] for i in ids if i in users],
+                           next_after=ids[-1] if has_next else None)
+
+
+@account.route('/tags/suggest')
+@login_required
+def suggest_tags():
+    """
+    The most popular tags with a word starting with the `q` argument, in the
+    format of the Semantic UI dropdown's remote API.
+    """
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    suggestions = tag_suggestions.suggest(request.args.get('q', ''), limit)
+    # The dropdown inserts names into the page as HTML
+    return jsonify(success=True, results=[
+        dict(name=unicode(escape(name)), value=tag_id)
+        for tag_id, name in suggestions])
+
+
+@account.route('/search')
+@login_required
+def search():
+    """Search the member directory by name, hometown, bio and tags."""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    users, has_next = search_users(query, page=page) if query else ([], False)
+    return render_template('account/search.html', query=query, users=users,
+                           page=page, has_next=has_next)
 
 
 @account.before_app_request
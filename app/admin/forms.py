@@ -1,20 +1,30 @@
 from flask.ext.wtf import Form
+from flask.ext.wtf.file import FileField, FileAllowed, FileRequired
 from wtforms.fields import (
     StringField,
     PasswordField,
     SubmitField,
     RadioField,
-    TextAreaField
+    TextAreaField,
+    BooleanField,
+    HiddenField
 )
 from wtforms.fields.html5 import EmailField
-from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from wtforms.validators import InputRequired, Length, Email, EqualTo
 from wtforms import ValidationError
-from ..models import User, Role, Tag, UserType
-from .. import db
+from ..fields import LookupSelectField
+from ..models import User, Tag, role_registry, user_type_registry
 
 
-class ChangeUserEmailForm(Form):
+class EditForm(Form):
+    """
+    A form that edits a row, which carries the `version_id` of the row it
+    was rendered from so that concurrent edits are not overwritten.
+    """
+    version = HiddenField()
+
+
+class ChangeUserEmailForm(EditForm):
     email = EmailField('New email', validators=[
         InputRequired(),
         Length(1, 64),
@@ -27,32 +37,28 @@ class ChangeUserEmailForm(Form):
             raise ValidationError('Email already registered.')
 
 
-class ChangeAccountTypeForm(Form):
-    role = QuerySelectField('New account type',
-                            validators=[InputRequired()],
-                            get_label='name',
-                            query_factory=lambda: db.session.query(Role).
-                            order_by('permissions'))
+class ChangeAccountTypeForm(EditForm):
+    role = LookupSelectField('New account type',
+                             validators=[InputRequired()],
+                             registry=role_registry,
+                             order_by='permissions')
     submit = SubmitField('Update role')
 
 
 class InviteUserForm(Form):
-    role = QuerySelectField('Account type',
-                            validators=[InputRequired()],
-                            get_label='name',
-                            query_factory=lambda: db.session.query(Role).
-                            order_by('permissions'))
+    role = LookupSelectField('Account type',
+                             validators=[InputRequired()],
+                             registry=role_registry,
+                             order_by='permissions')
     first_name = StringField('First name', validators=[InputRequired(),
                                                        Length(1, 64)])
     last_name = StringField('Last name', validators=[InputRequired(),
                                                      Length(1, 64)])
     email = EmailField('Email', validators=[InputRequired(), Length(1, 64),
                                             Email()])
-    user_type = QuerySelectField('User Type',
-                                 validators=[InputRequired()],
-                                 get_label='name',
-                                 query_factory=lambda:
-                                 db.session.query(UserType))
+    user_type = LookupSelectField('User Type',
+                                  validators=[InputRequired()],
+                                  registry=user_type_registry)
 
     submit = SubmitField('Invite')
 
@@ -71,7 +77,16 @@ class NewUserForm(InviteUserForm):
     submit = SubmitField('Create')
 
 
-class AdminCheckForm(Form):
+class ImportUsersForm(Form):
+    members_file = FileField('Members file (CSV or TSV)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'tsv', 'txt'], 'Upload a CSV or TSV file.')
+    ])
+    send_invites = BooleanField('Invite new members by email', default=True)
+    submit = SubmitField('Import')
+
+
+class AdminCheckForm(EditForm):
     admin_check = RadioField('User Confirmed',
                              validators=[InputRequired()],
                              choices=[
@@ -80,7 +95,7 @@ class AdminCheckForm(Form):
     submit = SubmitField('Save')
 
 
-class EditTagInfo(Form):
+class EditTagInfo(EditForm):
     name = StringField('Name', validators=[InputRequired()])
     description = TextAreaField('Description')
     submit = SubmitField('Save')
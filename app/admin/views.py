@@ -1,21 +1,62 @@
+from datetime import datetime
+
 from ..decorators import admin_required
 
-from flask import render_template, abort, redirect, flash, url_for
+from flask import (
+    current_app,
+    render_template,
+    abort,
+    redirect,
+    flash,
+    url_for,
+    request,
+    jsonify,
+    Response,
+    send_from_directory,
+    stream_with_context
+)
 from flask.ext.login import login_required, current_user
+from sqlalchemy import or_
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.security import safe_str_cmp
 
 from forms import (
     ChangeUserEmailForm,
     NewUserForm,
     ChangeAccountTypeForm,
     InviteUserForm,
+    ImportUsersForm,
     AdminCheckForm,
     EditTagInfo,
     NewTag
 )
 from . import admin
-from ..models import User, Role, Tag
-from .. import db
-from ..email import send_email
+from ..models import (
+    User,
+    Tag,
+    Permission,
+    identity_cache,
+    role_registry,
+    user_type_registry
+)
+from .. import db, compress
+from ..conditional import conditional
+from ..email import send_email, outbox
+from ..exporter import export_csv
+from ..fragment_cache import fragment_cache
+from ..importer import import_members, MemberImportError
+from ..metrics import request_metrics
+from ..pagination import keyset_paginate, contains_pattern
+from ..passwords import password_hasher
+from ..profiler import profiler, SORT_KEYS
+
+# Columns of the registered users table that can be sorted on. Each of them
+# is paired with `users.id` to form the keyset used for pagination.
+USER_SORT_COLUMNS = {
+    'first_name': User.first_name,
+    'last_name': User.last_name,
+    'email': User.email
+}
 
 
 @admin.route('/')
@@ -26,6 +67,73 @@ def index():
     return render_template('admin/index.html')
 
 
+@admin.route('/stats')
+@login_required
+@admin_required
+def stats():
+    """
+    Counters of this worker's in-memory caches, email delivery, password
+    hashing and response compression.
+    """
+    return jsonify(identity_cache=identity_cache.stats(),
+                   fragment_cache=fragment_cache.stats(),
+                   email=outbox.stats(),
+                   passwords=password_hasher.stats(),
+                   compression=compress.stats())
+
+
+@admin.route('/metrics')
+def metrics():
+    """
+    Request metrics of all workers in the Prometheus text format, for
+    administrators and for scrapers that send the `METRICS_TOKEN`.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if not (token and safe_str_cmp(authorization, 'Bearer ' + token)) and \
+            not current_user.can(Permission.ADMINISTER):
+        abort(403)
+    return Response(request_metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@admin.route('/profiles')
+@login_required
+@admin_required
+def profiles():
+    """Browse the saved profiles of requests."""
+    return render_template('admin/profiles.html',
+                           profiles=profiler.profiles(),
+                           enabled=current_app.config['PROFILER_ENABLED'])
+
+
+@admin.route('/profiles/<name>')
+@login_required
+@admin_required
+def profile_info(name):
+    """View the functions called by a profiled request."""
+    profile = profiler.get(name)
+    if profile is None:
+        abort(404)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        abort(400)
+    return render_template('admin/profile_info.html', profile=profile,
+                           sort=sort, sort_keys=SORT_KEYS,
+                           report=profiler.report(name, sort=sort))
+
+
+@admin.route('/profiles/<name>/download')
+@login_required
+@admin_required
+def download_profile(name):
+    """Download a profile, to be read with pstats or snakeviz."""
+    if profiler.get(name) is None:
+        abort(404)
+    return send_from_directory(profiler.directory, name + '.prof',
+                               as_attachment=True)
+
+
 @admin.route('/new-user', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -59,7 +167,7 @@ def invite_user():
                     email=form.email.data,
                     user_type=form.user_type.data)
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         token = user.generate_confirmation_token()
         send_email(user.email,
                    'You Are Invited To Join',
@@ -67,20 +175,132 @@ def invite_user():
                    user=user,
                    user_id=user.id,
                    token=token)
+        db.session.commit()
         flash('User {} successfully invited'.format(user.full_name()),
               'form-success')
     return render_template('admin/new_user.html', form=form)
 
 
+@admin.route('/import-users', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_users():
+    """Create or invite many users at once from a CSV or TSV file."""
+    form = ImportUsersForm()
+    if form.validate_on_submit():
+        try:
+            result = import_members(form.members_file.data.stream,
+                                    invite=form.send_invites.data)
+        except MemberImportError as e:
+            flash(str(e), 'form-error')
+        else:
+            flash('{} users imported, {} already registered, {} rows '
+                  'skipped.'.format(result.created, result.existing,
+                                    result.invalid), 'form-success')
+            for error in result.errors:
+                flash(error, 'form-error')
+    return render_template('admin/import_users.html', form=form)
+
+
+def _table_validators(model):
+    """The row count and latest change of a table, which its listing shows."""
+    count, updated_at = db.session.query(db.func.count(model.id),
+                                         db.func.max(model.updated_at)).one()
+    return [count, updated_at, role_registry.all(),
+            user_type_registry.all()], updated_at
+
+
+def _row_validators(model, id):
+    """The version of a row, for pages that show only that row."""
+    row = db.session.query(model.version_id, model.updated_at) \
+        .filter(model.id == id).first()
+    if row is None:
+        return None
+    return list(row), row.updated_at
+
+
+def _save_edit(obj, form, apply_changes):
+    """
+    Apply `apply_changes()` to `obj` and commit, unless `obj` was saved by
+    someone else after `form` was rendered from it. Returns whether the
+    changes were saved; if not, the form is updated to the current version
+    so that it can be submitted again.
+    """
+    if form.version.data == str(obj.version_id):
+        apply_changes()
+        db.session.add(obj)
+        try:
+            db.session.commit()
+            return True
+        except StaleDataError:
+            db.session.rollback()
+    flash('This was changed by someone else while you were editing it. '
+          'Review the current information and try again.', 'form-error')
+    form.version.data = obj.version_id
+    return False
+
+
 @admin.route('/users')
 @login_required
 @admin_required
+@conditional(lambda: _table_validators(User))
 def registered_users():
-    """View all registered users."""
-    users = User.query.all()
-    roles = Role.query.all()
-    return render_template('admin/registered_users.html', users=users,
-                           roles=roles)
+    """
+    View registered users one page at a time. Filtering, text matching and
+    sorting are all done in SQL, and pages are fetched with a keyset cursor.
+    """
+    sort = request.args.get('sort', 'last_name')
+    if sort not in USER_SORT_COLUMNS:
+        sort = 'last_name'
+    descending = request.args.get('order') == 'desc'
+    role_id = request.args.get('role', type=int)
+    user_type_id = request.args.get('user_type', type=int)
+    search = request.args.get('q', '').strip()
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+
+    query = User.query.options(db.joinedload(User.role))
+    if role_id is not None:
+        query = query.filter(User.role_id == role_id)
+    if user_type_id is not None:
+        query = query.filter(User.user_type_id == user_type_id)
+    if search:
+        pattern = contains_pattern(search)
+        query = query.filter(or_(User.first_name.ilike(pattern, escape='\\'),
+                                 User.last_name.ilike(pattern, escape='\\'),
+                                 User.email.ilike(pattern, escape='\\')))
+
+    page = keyset_paginate(query, USER_SORT_COLUMNS[sort], User.id,
+                           cursor=request.args.get('after'),
+                           per_page=per_page,
+                           descending=descending)
+
+    # Arguments that are kept when moving between pages or re-sorting
+    filters = dict((k, v) for k, v in [('q', search),
+                                       ('role', role_id),
+                                       ('user_type', user_type_id)]
+                   if v not in (None, ''))
+    roles = sorted(role_registry.all(), key=lambda r: r.permissions)
+    user_types = user_type_registry.all()
+    return render_template('admin/registered_users.html', page=page,
+                           roles=roles, user_types=user_types, sort=sort,
+                           descending=descending, filters=filters)
+
+
+@admin.route('/users/export')
+@login_required
+@admin_required
+def export_users():
+    """
+    Download the member directory as CSV. The file is streamed as it is
+    read from the database, so its size does not matter.
+    """
+    filename = 'members-{:%Y-%m-%d}.csv'.format(datetime.utcnow())
+    return Response(stream_with_context(export_csv()), mimetype='text/csv',
+                    headers={
+                        'Content-Disposition':
+                            'attachment; filename="%s"' % filename,
+                        # Let proxies pass chunks on as they arrive
+                        'X-Accel-Buffering': 'no'})
 
 
 @admin.route('/user/<int:user_id>')
@@ -103,11 +323,10 @@ def change_user_email(user_id):
     user = User.query.filter_by(id=user_id).first()
     if user is None:
         abort(404)
-    form = ChangeUserEmailForm()
-    if form.validate_on_submit():
-        user.email = form.email.data
-        db.session.add(user)
-        db.session.commit()
+    form = ChangeUserEmailForm(version=user.version_id)
+    if form.validate_on_submit() and \
+            _save_edit(user, form,
+                       lambda: setattr(user, 'email', form.email.data)):
         flash('Email for user {} successfully changed to {}.'
               .format(user.full_name(), user.email),
               'form-success')
@@ -128,11 +347,10 @@ def change_account_type(user_id):
     user = User.query.get(user_id)
     if user is None:
         abort(404)
-    form = ChangeAccountTypeForm()
-    if form.validate_on_submit():
-        user.role = form.role.data
-        db.session.add(user)
-        db.session.commit()
+    form = ChangeAccountTypeForm(version=user.version_id)
+    if form.validate_on_submit() and \
+            _save_edit(user, form,
+                       lambda: setattr(user, 'role', form.role.data)):
         flash('Role for user {} successfully changed to {}.'
               .format(user.full_name(), user.role.name),
               'form-success')
@@ -178,11 +396,10 @@ def admin_check(user_id):
         user = User.query.filter_by(id=user_id).first()
         if user is None:
             abort(404)
-        form = AdminCheckForm()
-        if form.validate_on_submit():
-            user.admin_check = form.admin_check.data == 'y'
-            db.session.add(user)
-            db.session.commit()
+        form = AdminCheckForm(version=user.version_id)
+        if form.validate_on_submit() and \
+                _save_edit(user, form, lambda: setattr(
+                    user, 'admin_check', form.admin_check.data == 'y')):
             flash('User {}\'s confirmation status has been updated.'
                   .format(user.full_name()), 'form-success')
         else:
@@ -193,16 +410,19 @@ def admin_check(user_id):
 @admin.route('/tags')
 @login_required
 @admin_required
+@conditional(lambda: _table_validators(Tag))
 def registered_tags():
     """View all registered tags."""
     tags = Tag.query.all()
-    return render_template('admin/registered_tags.html', tags=tags)
+    return render_template('admin/registered_tags.html', tags=tags,
+                           counts=Tag.user_counts())
 
 
 @admin.route('/tag/<int:tag_id>')
 @admin.route('/tag/<int:tag_id>/info')
 @login_required
 @admin_required
+@conditional(lambda tag_id: _row_validators(Tag, tag_id))
 def tag_info(tag_id):
     """View a tag's information."""
     tag = Tag.query.get(tag_id)
@@ -219,9 +439,9 @@ def edit_tag_info(tag_id):
     tag = Tag.query.get(tag_id)
     if tag is None:
         abort(404)
-    form = EditTagInfo(obj=tag)
-    if form.validate_on_submit():
-        form.populate_obj(tag)
+    form = EditTagInfo(obj=tag, version=tag.version_id)
+    if form.validate_on_submit() and \
+            _save_edit(tag, form, lambda: form.populate_obj(tag)):
         return redirect(url_for('admin.tag_info', tag_id=tag.id))
     return render_template('admin/manage_tag.html', tag=tag, form=form)
 
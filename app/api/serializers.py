@@ -0,0 +1,108 @@
+"""
+JSON representations of the models served by the API.
+
+A `Serializer` reads only the columns of the fields that were asked for,
+and looks up fields that live in other tables (a user's tags, a tag's member
+count) for a whole page or batch of rows with one query, rather than one
+query per row. Rows can be ORM objects, rows of a column query or rows of a
+`LookupTable`, as long as their attributes are named after the fields.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import select
+from .. import db
+from ..models import User, Tag, Role, UserType, user_tag_association_table
+
+
+class Serializer(object):
+    def __init__(self, model, columns, related=()):
+        self.model = model
+        # Field name to the column it is read from
+        self.columns = OrderedDict((name, getattr(model, name))
+                                   for name in columns)
+        # Field name to a function mapping a list of ids to a dict of the
+        # field's value by id, and the value of ids missing from the dict
+        self.related = OrderedDict((name, (lookup, default))
+                                   for name, lookup, default in related)
+
+    @property
+    def fields(self):
+        return list(self.columns) + list(self.related)
+
+    def parse_fields(self, value):
+        """
+        The fields named in the comma separated `value`, or all fields if it
+        is empty. Raises ValueError for unknown fields.
+        """
+        if not value:
+            return self.fields
+        fields = [f.strip() for f in value.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in self.fields]
+        if unknown:
+            raise ValueError('Unknown fields: %s. Fields are: %s.' %
+                             (', '.join(unknown), ', '.join(self.fields)))
+        return fields
+
+    def query(self, fields, extra=()):
+        """
+        A query for the columns of `fields`, the id and the `extra` columns
+        (such as the sort column), labelled with their field names.
+        """
+        names = ['id'] + [f for f in fields
+                          if f in self.columns and f != 'id']
+        names += [c.key for c in extra if c.key not in names]
+        return db.session.query(*[self.columns[name].label(name)
+                                  for name in names])
+
+    def dump(self, rows, fields):
+        """Serialize a list of rows into a list of dicts of `fields`."""
+        ids = [row.id for row in rows]
+        related = dict((f, (self.related[f][0](ids), self.related[f][1]))
+                       for f in fields if f in self.related)
+        items = []
+        for row in rows:
+            item = {}
+            for field in fields:
+                if field in related:
+                    values, default = related[field]
+                    item[field] = values.get(row.id, default)
+                else:
+                    item[field] = _json_value(getattr(row, field))
+            items.append(item)
+        return items
+
+    def dump_one(self, row, fields):
+        return self.dump([row], fields)[0]
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + 'Z'
+    return value
+
+
+def user_tag_ids(user_ids):
+    """Map each of `user_ids` to the sorted ids of their tags."""
+    assoc = user_tag_association_table.c
+    tags = {}
+    if user_ids:
+        for user_id, tag_id in db.session.execute(
+                select([assoc.user_id, assoc.tag_id])
+                .where(assoc.user_id.in_(user_ids))
+                .order_by(assoc.user_id, assoc.tag_id)):
+            tags.setdefault(user_id, []).append(tag_id)
+    return tags
+
+
+users = Serializer(User, ['id', 'first_name', 'last_name', 'email',
+                          'hometown', 'bio', 'profile_pic', 'confirmed',
+                          'role_id', 'user_type_id', 'updated_at'],
+                   related=[('tags', user_tag_ids, [])])
+
+tags = Serializer(Tag, ['id', 'name', 'description', 'updated_at'],
+                  related=[('user_count', Tag.user_counts, 0)])
+
+roles = Serializer(Role, ['id', 'name', 'permissions', 'default'])
+
+user_types = Serializer(UserType, ['id', 'name'])
@@ -0,0 +1,186 @@
+import json
+from itertools import islice
+
+from flask import (
+    current_app,
+    request,
+    jsonify,
+    url_for,
+    Response,
+    stream_with_context
+)
+from flask.ext.login import current_user
+from werkzeug.security import safe_str_cmp
+
+from . import api, serializers
+from .. import db
+from ..models import (
+    User,
+    Tag,
+    Permission,
+    role_registry,
+    user_type_registry,
+    user_tag_association_table
+)
+from ..pagination import keyset_paginate
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Columns that listings can be sorted on. Each of them is paired with the id
+# to form the keyset used for pagination.
+USER_SORT_COLUMNS = {
+    'first_name': User.first_name,
+    'last_name': User.last_name,
+    'email': User.email
+}
+TAG_SORT_COLUMNS = {'name': Tag.name}
+
+
+class APIError(Exception):
+    def __init__(self, status_code, message):
+        super(APIError, self).__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+@api.errorhandler(APIError)
+def api_error(error):
+    response = jsonify(error=error.message)
+    response.status_code = error.status_code
+    return response
+
+
+@api.before_request
+def authenticate():
+    """
+    Allow administrators, and clients that send the header
+    `Authorization: Bearer <API_TOKEN>`.
+    """
+    token = current_app.config['API_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if not (token and safe_str_cmp(authorization, 'Bearer ' + token)) and \
+            not current_user.can(Permission.ADMINISTER):
+        raise APIError(403, 'An administrator login or API token is needed.')
+
+
+@api.route('/users')
+def users():
+    """
+    List users, optionally only those with every tag in the `tag` arguments
+    and with the given `role` and `user_type` ids.
+    """
+    fields = _fields(serializers.users)
+    sort_column = _sort_column(USER_SORT_COLUMNS, 'last_name')
+    query = serializers.users.query(fields, extra=[sort_column])
+    assoc = user_tag_association_table.c
+    for tag_id in request.args.getlist('tag', type=int):
+        query = query.filter(db.exists().where(db.and_(
+            assoc.user_id == User.id, assoc.tag_id == tag_id)))
+    for name, column in [('role', User.role_id),
+                         ('user_type', User.user_type_id)]:
+        value = request.args.get(name, type=int)
+        if value is not None:
+            query = query.filter(column == value)
+    return _listing(serializers.users, query, fields, sort_column, User.id)
+
+
+@api.route('/users/<int:user_id>')
+def user(user_id):
+    return _item(serializers.users, User.id == user_id)
+
+
+@api.route('/tags')
+def tags():
+    fields = _fields(serializers.tags)
+    sort_column = _sort_column(TAG_SORT_COLUMNS, 'name')
+    query = serializers.tags.query(fields, extra=[sort_column])
+    return _listing(serializers.tags, query, fields, sort_column, Tag.id)
+
+
+@api.route('/tags/<int:tag_id>')
+def tag(tag_id):
+    return _item(serializers.tags, Tag.id == tag_id)
+
+
+@api.route('/roles')
+def roles():
+    return jsonify(items=serializers.roles.dump(
+        role_registry.all(), _fields(serializers.roles)))
+
+
+@api.route('/user-types')
+def user_types():
+    return jsonify(items=serializers.user_types.dump(
+        user_type_registry.all(), _fields(serializers.user_types)))
+
+
+def _fields(serializer):
+    try:
+        return serializer.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        raise APIError(400, str(e))
+
+
+def _sort_column(columns, default):
+    sort = request.args.get('sort', default)
+    if sort not in columns:
+        raise APIError(400, 'Cannot sort by %s. Sort by one of: %s.' %
+                       (sort, ', '.join(sorted(columns))))
+    return columns[sort]
+
+
+def _wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def _item(serializer, criterion):
+    fields = _fields(serializer)
+    row = serializer.query(fields).filter(criterion).first()
+    if row is None:
+        raise APIError(404, 'Not found.')
+    return jsonify(serializer.dump_one(row, fields))
+
+
+def _listing(serializer, query, fields, sort_column, id_column):
+    """
+    One page of `query` as JSON with a cursor for the next page, or all of
+    it, ordered by id, as newline-delimited JSON when that is asked for.
+    """
+    if _wants_ndjson():
+        return _stream(serializer, query.order_by(id_column), fields)
+
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    page = keyset_paginate(query, sort_column, id_column,
+                           cursor=request.args.get('after'),
+                           per_page=per_page,
+                           descending=request.args.get('order') == 'desc')
+    next_url = None
+    if page.has_next:
+        args = request.args.to_dict(flat=False)
+        args['after'] = page.next_cursor
+        next_url = url_for(request.endpoint, **args)
+    return jsonify(items=serializer.dump(page.items, fields),
+                   next_cursor=page.next_cursor, next=next_url)
+
+
+def _stream(serializer, query, fields):
+    """
+    Stream every row of `query` as a line of JSON. Rows are read from a
+    server-side cursor (where the database supports one) and serialized a
+    batch at a time, so memory use does not grow with the number of rows.
+    """
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+
+    def generate():
+        rows = iter(query.yield_per(batch_size))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            yield ''.join(json.dumps(item, separators=(',', ':')) + '\n'
+                          for item in serializer.dump(batch, fields))
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE)
@@ -1,4 +1,29 @@
-from flask.ext.assets import Bundle
+"""
+Asset bundles.
+
+In development the bundles are compiled when a page that uses them is
+rendered and they have changed. For production, `manage.py build_assets`
+compiles every bundle ahead of time into a file named after its content and
+lists those files in `ASSET_MANIFEST`. Unless `ASSETS_AUTO_BUILD` is set,
+the app then only reads that manifest: the bundles point at the built
+files, which are never checked or compiled at runtime, and those files are
+served with far-future immutable caching headers. The build also
+precompresses the built files (see `app.compression`).
+"""
+import hashlib
+import json
+import os
+from StringIO import StringIO
+
+from flask import request
+from flask.ext.assets import Bundle, Environment
+from .compression import precompress
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+# Built files change name when their content does, so they can be cached
+# forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 app_css = Bundle(
     '*.scss',
@@ -24,3 +49,98 @@ vendor_js = Bundle(
     filters='jsmin',
     output='scripts/vendor.js'
 )
+
+BUNDLES = {
+    'app_css': app_css,
+    'app_js': app_js,
+    'vendor_css': vendor_css,
+    'vendor_js': vendor_js
+}
+
+
+def source_environment(app):
+    """An environment that compiles the bundles from their sources."""
+    assets_env = Environment()
+    assets_env.app = app
+    for path in ['assets/styles', 'assets/scripts']:
+        assets_env.append_path(os.path.join(basedir, path))
+    for name, bundle in BUNDLES.items():
+        assets_env.register(name, bundle)
+    return assets_env
+
+
+def build_assets(app):
+    """
+    Compile every bundle into a file named after a hash of its content,
+    write the manifest of bundle name to file and precompress the built
+    files. Files that are rebuilt in place, such as the bundles compiled at
+    runtime in development, are not precompressed. Files of earlier builds
+    are kept for pages rendered before a deploy. Returns the manifest.
+    """
+    assets_env = source_environment(app)
+    manifest = {}
+    for name, bundle in sorted(BUNDLES.items()):
+        content = StringIO()
+        bundle.build(force=True, output=content)
+        content = content.getvalue()
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        root, extension = os.path.splitext(bundle.output)
+        path = '%s.%s%s' % (root, hashlib.md5(content).hexdigest()[:12],
+                            extension)
+        full_path = os.path.join(assets_env.directory, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, 'wb') as f:
+            f.write(content)
+        manifest[name] = path
+    with open(app.config['ASSET_MANIFEST'], 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    precompress(assets_env.directory, manifest.values())
+    return manifest
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_app(app):
+    """Set up the asset pipeline, from the manifest unless auto building."""
+    manifest = None
+    if not app.config.get('ASSETS_AUTO_BUILD', True):
+        manifest = load_manifest(app.config['ASSET_MANIFEST'])
+        if manifest is None or set(manifest) != set(BUNDLES):
+            app.logger.warning(
+                'The asset manifest %s is missing or out of date, so assets '
+                'are built at runtime. Run `manage.py build_assets`.',
+                app.config['ASSET_MANIFEST'])
+            manifest = None
+
+    if manifest is None:
+        assets_env = source_environment(app)
+        assets_env.auto_build = True
+        assets_env.url_expire = True
+    else:
+        # Bundles without contents or filters, whose only use is the url of
+        # their built file
+        assets_env = Environment()
+        assets_env.app = app
+        for name, path in manifest.items():
+            assets_env.register(name, Bundle(output=path))
+        assets_env.url_expire = False
+        built = frozenset(manifest.values())
+
+        @app.after_request
+        def cache_built_assets(response):
+            if request.endpoint == 'static' and \
+                    response.status_code in (200, 304) and \
+                    request.view_args.get('filename') in built:
+                response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+                response.expires = None
+            return response
+
+    assets_env.init_app(app)
+    return assets_env
@@ -18,9 +18,18 @@ $(document).ready(function () {
     // Enable sortable tables
     $('table.ui.sortable').tablesort();
 
-    // Enable dropdowns
+    // Enable dropdowns. Selects with a suggestion URL list only their
+    // selected options, and look the others up as the user types.
     $('.dropdown').dropdown();
-    $('select').dropdown();
+    $('select').not('[data-suggest-url]').dropdown();
+    $('select[data-suggest-url]').each(function () {
+        $(this).dropdown({
+            apiSettings: {
+                url: $(this).data('suggest-url') + '?q={query}'
+            },
+            saveRemoteData: false
+        });
+    });
 });
 
 
@@ -0,0 +1,215 @@
+"""
+Response compression.
+
+Static files are compressed once, at build time: `precompress` writes a
+`.gz` and (with the brotli package installed) a `.br` copy of the built,
+content-hashed files at the highest level, and the static view serves the
+copy the client prefers as long as it is not older than the file.
+
+Other responses are compressed on the fly with the encoding the client
+prefers, at `COMPRESS_LEVEL`. The level drops to `COMPRESS_BUSY_LEVEL` for
+bodies over `COMPRESS_LARGE_SIZE` bytes and while this worker is handling
+more than `COMPRESS_BUSY_REQUESTS` requests, so compression does not hold up
+other requests. Compressed bodies are cached by ETag (a hash of the body when
+the response has none), so identical responses are only compressed once.
+The ETag also lets clients revalidate with a conditional request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from io import BytesIO
+
+from flask import current_app, request, send_from_directory, safe_join
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Suffix of the precompressed copy of a static file in each encoding
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Static files worth compressing; images and web fonts other than these are
+# compressed already
+COMPRESSIBLE_EXTENSIONS = frozenset([
+    '.css', '.js', '.map', '.json', '.svg', '.html', '.txt', '.xml', '.eot',
+    '.ttf', '.otf', '.ico'])
+
+
+def encodings():
+    """The encodings that can be produced, best first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate(available):
+    """The client's preferred encoding among `available`, or None."""
+    if 'Accept-Encoding' not in request.headers:
+        return None
+    return request.accept_encodings.best_match(available)
+
+
+def add_vary(response):
+    vary = response.headers.get('Vary')
+    if not vary:
+        response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = '{}, Accept-Encoding'.format(vary)
+
+
+def compress(data, encoding, level):
+    """Compress `data` in `encoding` at `level` (1 to 9 for gzip, up to 11
+    for brotli)."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    buffer = BytesIO()
+    # A fixed mtime makes the output depend on the data only
+    with gzip.GzipFile(mode='wb', compresslevel=level, fileobj=buffer,
+                       mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def precompress(directory, paths=None):
+    """
+    Write a `.gz` and `.br` copy, at the highest level, of the compressible
+    files `paths` (relative to `directory`, by default every file under it)
+    whose copies are missing or older than the file. Copies that would not
+    be smaller than the file are not written. Returns the number of copies
+    written.
+    """
+    if paths is None:
+        paths = [os.path.relpath(os.path.join(root, name), directory)
+                 for root, _, files in os.walk(directory) for name in files]
+    written = 0
+    for path in paths:
+        if os.path.splitext(path)[1] not in COMPRESSIBLE_EXTENSIONS:
+            continue
+        path = os.path.join(directory, path)
+        data = None
+        for encoding in encodings():
+            target = path + SUFFIXES[encoding]
+            if is_fresh(target, path):
+                continue
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            compressed = compress(data, encoding,
+                                  11 if encoding == 'br' else 9)
+            if len(compressed) < len(data):
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+def is_fresh(copy, source):
+    """Whether the file `copy` exists and is not older than `source`."""
+    try:
+        return os.path.getmtime(copy) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+class Compress(object):
+    """Compresses responses, serving precompressed static files."""
+
+    def __init__(self):
+        self.cache = LRUCache()
+        self.compressed = self.cached = 0
+        self._in_flight = lambda: 0
+
+    def init_app(self, app):
+        from .metrics import request_metrics
+        self.cache.configure(maxsize=app.config['COMPRESS_CACHE_SIZE'])
+        self.compressed = self.cached = 0
+        self._in_flight = lambda: request_metrics.in_flight
+        app.view_functions['static'] = self.send_static_file
+        app.after_request(self.after_request)
+
+    def send_static_file(self, filename):
+        """The static view, serving the precompressed copy of a file."""
+        app = current_app._get_current_object()
+        encoding = negotiate(encodings())
+        if encoding is not None:
+            path = filename + SUFFIXES[encoding]
+            # A copy older than its file was written before the file changed
+            if is_fresh(safe_join(app.static_folder, path),
+                        safe_join(app.static_folder, filename)):
+                response = send_from_directory(
+                    app.static_folder, path,
+                    mimetype=mimetypes.guess_type(filename)[0],
+                    cache_timeout=app.get_send_file_max_age(filename))
+                response.headers['Content-Encoding'] = encoding
+                add_vary(response)
+                return response
+        return app.send_static_file(filename)
+
+    def level(self, encoding, size):
+        config = current_app.config
+        busy = size > config['COMPRESS_LARGE_SIZE'] or \
+            self._in_flight() > config['COMPRESS_BUSY_REQUESTS']
+        if encoding == 'br':
+            return config['COMPRESS_BR_BUSY_LEVEL' if busy else
+                          'COMPRESS_BR_LEVEL']
+        return config['COMPRESS_BUSY_LEVEL' if busy else 'COMPRESS_LEVEL']
+
+    def after_request(self, response):
+        config = current_app.config
+        # Generated bodies are left alone, unlike files sent by send_file
+        if response.mimetype not in config['COMPRESS_MIMETYPES'] or \
+                response.is_streamed and not response.direct_passthrough or \
+                not 200 <= response.status_code < 300 or \
+                'Content-Encoding' in response.headers:
+            return response
+        add_vary(response)
+        size = response.content_length
+        if size is not None and size < config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = negotiate(encodings())
+        if encoding is None:
+            return response
+
+        etag, _ = response.get_etag()
+        data = None
+        if etag is None:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            etag = hashlib.md5(data).hexdigest()
+        # The compressed body is a different representation, with its own
+        # ETag
+        response.set_etag('{}-{}'.format(etag, encoding))
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+        # An ETag only identifies a body among those of one URL, and the
+        # pages of a listing can share one
+        key = (request.full_path, etag, encoding)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            if data is None:
+                response.direct_passthrough = False
+                data = response.get_data()
+            compressed = compress(data, encoding,
+                                  self.level(encoding, len(data)))
+            self.compressed += 1
+            if len(data) <= config['COMPRESS_CACHE_MAX_BODY']:
+                self.cache.set(key, compressed)
+        else:
+            self.cached += 1
+            # The body of a static file is never read
+            close = getattr(response.response, 'close', None)
+            if close is not None:
+                response.call_on_close(close)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update(compressed=self.compressed, cached=self.cached)
+        return stats
@@ -0,0 +1,84 @@
+"""
+Conditional GET for pages rendered from a few rows.
+
+A view decorated with `conditional(validators)` first calls `validators`
+with the view's arguments. It returns the values the page is rendered from,
+typically the `version_id` and `updated_at` of its rows and the count of a
+listing, read with a single cheap query, and the time they last changed. If
+the request's If-None-Match (or, without it, If-Modified-Since) shows that
+the client already has that version of the page, a 304 is returned without
+calling the view.
+
+The ETag also covers what differs between viewers of the same page: the
+logged in user shown in the navigation bar and the CSRF token. CSRF tokens
+expire, so validators change every `CONDITIONAL_MAX_AGE` seconds, which
+must be shorter than `WTF_CSRF_TIME_LIMIT`. Pages with flashed messages are
+always rendered.
+"""
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from flask.ext.login import current_user
+from .compression import encodings, add_vary
+from .models import Identity
+
+
+def conditional(validators):
+    """
+    Answer conditional requests for a view from `validators(**view_args)`,
+    which returns a list of values and a datetime, or None to render the
+    view anyway (for instance because its row does not exist).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or \
+                    session.get('_flashes'):
+                return f(*args, **kwargs)
+            result = validators(*args, **kwargs)
+            if result is None:
+                return f(*args, **kwargs)
+            etag, last_modified = _validators(*result)
+
+            # Compressed responses have their own ETags
+            etags = [etag] + ['{}-{}'.format(etag, e) for e in encodings()]
+            if request.if_none_match:
+                matched = next((e for e in etags
+                                if request.if_none_match.contains(e)), None)
+            elif request.if_modified_since is not None and \
+                    request.if_modified_since >= last_modified:
+                matched = etag
+            else:
+                matched = None
+            if matched is not None:
+                response = current_app.response_class(status=304)
+                response.set_etag(matched)
+                add_vary(response)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+def _validators(values, last_modified):
+    """The ETag and Last-Modified time of a page for the current viewer."""
+    max_age = current_app.config['CONDITIONAL_MAX_AGE']
+    period = int(time.time()) // max_age * max_age
+    viewer = [getattr(current_user, f, None) for f in Identity.fields]
+    etag = hashlib.md5(repr((values, viewer, session.get('csrf_token'),
+                             period))).hexdigest()
+    started = datetime.utcfromtimestamp(period)
+    if last_modified is None or last_modified < started:
+        last_modified = started
+    # HTTP dates have a resolution of one second
+    return etag, last_modified.replace(microsecond=0)
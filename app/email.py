@@ -1,21 +1,266 @@
-from threading import Thread
+"""
+Outbound email.
+
+`send_email` renders a message and adds it to the `outbound_emails` table in
+the caller's transaction, so it is only sent if what it is about is
+committed, and survives the worker that queued it being recycled. The outbox is
+drained by a bounded pool of threads in each web worker (`EMAIL_WORKERS`),
+or by `manage.py email_worker` when that is set to 0. Each drain claims a
+batch of due messages and sends all of them over one SMTP connection.
+Messages that fail are retried with exponential backoff until
+`EMAIL_MAX_ATTEMPTS` is reached.
+"""
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
 
 from flask import current_app, render_template
 from flask.ext.mail import Message
-from . import mail
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from . import db, mail
+from .models import OutboundEmail
+
+# Errors that mean the connection to the SMTP server is unusable, as opposed
+# to a problem with a single message
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                     smtplib.SMTPHeloError, socket.error)
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+def render_email(to, subject, template, **kwargs):
+    """Render a message as the column values of an `OutboundEmail`."""
+    return dict(
+        recipient=to,
+        subject=current_app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        body=render_template(template + '.txt', **kwargs),
+        html=render_template(template + '.html', **kwargs))
 
 
 def send_email(to, subject, template, **kwargs):
-    app = current_app._get_current_object()
-    msg = Message(app.config['EMAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['EMAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    """
+    Queue an email to be sent by the outbox workers. The caller commits, and
+    the workers are woken once it does.
+    """
+    message = OutboundEmail(**render_email(to, subject, template, **kwargs))
+    db.session.add(message)
+    db.session().info['wake_outbox'] = True
+    return message
+
+
+def queue_emails(messages):
+    """
+    Queue many messages at once with a single multi-row insert. `messages`
+    is a list of dicts as returned by `render_email`. The caller commits.
+    """
+    if not messages:
+        return
+    now = datetime.utcnow()
+    db.session.execute(OutboundEmail.__table__.insert(), [
+        dict(m, status=OutboundEmail.PENDING, attempts=0, created_at=now,
+             next_attempt_at=now) for m in messages])
+    # Wake the workers once the messages are committed
+    db.session().info['wake_outbox'] = True
+
+
+class Outbox(object):
+    """Delivers queued emails and keeps delivery metrics."""
+
+    def __init__(self):
+        self.app = None
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = False
+        self.metrics = dict(sent=0, failed=0, retried=0, batches=0,
+                            connections=0, send_seconds=0.0)
+
+    def init_app(self, app):
+        self.app = app
+        self.stop()
+        with self._lock:
+            for key in self.metrics:
+                self.metrics[key] = 0
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self.metrics[key] += amount
+
+    def wake(self):
+        """Start the in-process workers if needed and tell them to drain."""
+        if self.app is None or not self.app.config['EMAIL_WORKERS']:
+            return
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.app.config['EMAIL_WORKERS']:
+                thread = threading.Thread(target=self.run,
+                                          args=(self.app, None))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop = True
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(5)
+        self._threads = []
+        self._stop = False
+        self._wakeup.clear()
+
+    def run(self, app, poll_interval=None):
+        """
+        Deliver messages until stopped. Sleeps for `poll_interval` seconds
+        (`EMAIL_POLL_INTERVAL` by default) when the outbox is empty, or until
+        woken by a newly queued message.
+        """
+        if poll_interval is None:
+            poll_interval = app.config['EMAIL_POLL_INTERVAL']
+        while not self._stop:
+            try:
+                with app.app_context():
+                    sent = self.drain_once()
+            except Exception:
+                app.logger.exception('Error while sending queued emails')
+                sent = 0
+            if not sent:
+                self._wakeup.wait(poll_interval)
+                self._wakeup.clear()
+
+    def drain_once(self):
+        """Claim and send one batch of due messages. Returns the batch size."""
+        try:
+            messages = self._claim_batch()
+            if messages:
+                self._send_batch(messages)
+                db.session.commit()
+            return len(messages)
+        finally:
+            db.session.remove()
+
+    def drain(self):
+        """Send every message that is currently due."""
+        total = 0
+        while True:
+            count = self.drain_once()
+            if not count:
+                return total
+            total += count
+
+    def _claim_batch(self):
+        config = current_app.config
+        now = datetime.utcnow()
+        table = OutboundEmail.__table__
+
+        # Release messages claimed by a worker that died while sending them
+        db.session.execute(
+            table.update()
+            .where(table.c.status == OutboundEmail.SENDING)
+            .where(table.c.claimed_at <
+                   now - timedelta(seconds=config['EMAIL_CLAIM_TIMEOUT']))
+            .values(status=OutboundEmail.PENDING, claim_token=None))
+
+        due = db.session.query(OutboundEmail.id) \
+            .filter(OutboundEmail.status == OutboundEmail.PENDING,
+                    OutboundEmail.next_attempt_at <= now) \
+            .order_by(OutboundEmail.next_attempt_at, OutboundEmail.id) \
+            .limit(config['EMAIL_BATCH_SIZE'])
+        ids = [id for id, in due]
+        if not ids:
+            db.session.commit()
+            return []
+
+        # Only messages that are still pending are claimed, so two workers
+        # never send the same message
+        token = uuid.uuid4().hex
+        db.session.execute(
+            table.update()
+            .where(table.c.id.in_(ids))
+            .where(table.c.status == OutboundEmail.PENDING)
+            .values(status=OutboundEmail.SENDING, claimed_at=now,
+                    claim_token=token))
+        db.session.commit()
+        return OutboundEmail.query.filter_by(claim_token=token) \
+            .order_by(OutboundEmail.id).all()
+
+    def _send_batch(self, messages):
+        config = current_app.config
+        sender = config['EMAIL_SENDER']
+        remaining = list(messages)
+        start = time.time()
+        try:
+            with mail.connect() as connection:
+                self._count(connections=1)
+                while remaining:
+                    message = remaining[0]
+                    try:
+                        connection.send(Message(
+                            message.subject,
+                            sender=sender,
+                            recipients=[message.recipient],
+                            body=message.body,
+                            html=message.html))
+                    except CONNECTION_ERRORS:
+                        raise
+                    except Exception as e:
+                        self._failed(message, e)
+                    else:
+                        message.status = OutboundEmail.SENT
+                        message.sent_at = datetime.utcnow()
+                        message.attempts += 1
+                        self._count(sent=1)
+                    remaining.pop(0)
+        except CONNECTION_ERRORS as e:
+            # Retry everything that was not sent over this connection
+            for message in remaining:
+                self._failed(message, e)
+        finally:
+            for message in messages:
+                message.claim_token = None
+            self._count(batches=1, send_seconds=time.time() - start)
+
+    def _failed(self, message, error):
+        config = current_app.config
+        message.attempts += 1
+        message.last_error = '%s: %s' % (type(error).__name__, error)
+        if message.attempts >= config['EMAIL_MAX_ATTEMPTS']:
+            message.status = OutboundEmail.FAILED
+            self._count(failed=1)
+            current_app.logger.error('Giving up on email %d to %s: %s',
+                                     message.id, message.recipient,
+                                     message.last_error)
+        else:
+            delay = config['EMAIL_RETRY_BACKOFF'] * 2 ** (message.attempts - 1)
+            message.status = OutboundEmail.PENDING
+            message.next_attempt_at = datetime.utcnow() + \
+                timedelta(seconds=delay)
+            self._count(retried=1)
+
+    def counters(self):
+        """Delivery counters of this process."""
+        with self._lock:
+            return dict(self.metrics)
+
+    def queue_sizes(self):
+        """The number of messages in the outbox by status."""
+        return dict(db.session.query(OutboundEmail.status, func.count())
+                    .group_by(OutboundEmail.status).all())
+
+    def stats(self):
+        """Delivery counters for this process and the outbox size by status."""
+        stats = self.counters()
+        stats['queue'] = self.queue_sizes()
+        return stats
+
+
+outbox = Outbox()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_outbox(session):
+    if session.info.pop('wake_outbox', False):
+        outbox.wake()
@@ -0,0 +1,70 @@
+"""
+Export of the member directory as CSV, in the format `importer` reads.
+
+Every user is read by a single query that joins their role and user type
+and aggregates the names of their tags in SQL, instead of loading each
+user's tags separately. Rows are fetched `chunk_size` at a time with
+`yield_per`, which reads from a server-side cursor on Postgres, and written
+out a chunk at a time, so memory use does not depend on the number of
+members. Being one statement, the query sees a single consistent snapshot of
+the database even while other requests change it.
+"""
+import csv
+from cStringIO import StringIO
+from itertools import islice
+
+from . import db
+from .importer import COLUMNS, TAG_SEPARATOR
+from .models import User, Role, Tag, UserType, user_tag_association_table
+
+# Aggregates of the semicolon separated tag names of a user, by dialect
+_TAG_NAMES = {
+    'postgresql': "string_agg(tags.name, '%s' ORDER BY tags.name)",
+    'sqlite': "group_concat(tags.name, '%s')",
+    'mysql': "group_concat(tags.name ORDER BY tags.name SEPARATOR '%s')"
+}
+
+
+def export_rows(chunk_size=1000):
+    """Yield a tuple of the values of `COLUMNS` for each user, by id."""
+    dialect = db.session.connection().dialect.name
+    tag_names = db.literal_column(_TAG_NAMES[dialect] % TAG_SEPARATOR)
+    assoc = user_tag_association_table.c
+    query = db.session.query(User.first_name, User.last_name, User.email,
+                             UserType.name, Role.name, User.hometown,
+                             tag_names) \
+        .outerjoin(UserType, User.user_type_id == UserType.id) \
+        .outerjoin(Role, User.role_id == Role.id) \
+        .outerjoin(user_tag_association_table, assoc.user_id == User.id) \
+        .outerjoin(Tag, Tag.id == assoc.tag_id) \
+        .group_by(User.id, UserType.name, Role.name) \
+        .order_by(User.id)
+    return query.yield_per(chunk_size)
+
+
+def export_csv(chunk_size=1000):
+    """
+    Yield the directory as CSV text, starting with a header line, one chunk
+    of `chunk_size` users at a time.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    rows = iter(export_rows(chunk_size))
+    while True:
+        for row in islice(rows, chunk_size):
+            writer.writerow([_encode(value) for value in row])
+        data = buffer.getvalue()
+        if not data:
+            break
+        yield data
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
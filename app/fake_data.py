@@ -0,0 +1,251 @@
+"""
+Generation of large fake datasets, for reproducing production scale locally.
+
+Users are generated in chunks by a pool of processes, since Faker is slow
+compared to the database, and written by this process with multi-row
+inserts, or with COPY on Postgres. Every chunk is generated from its own
+seed, so the same arguments always produce the same dataset whatever the
+number of processes.
+
+Each user is given a number of tags between 0 and twice `tags_per_user`.
+Tags are drawn according to `distribution`: with 'zipf' the tag of
+popularity rank r is chosen with a probability proportional to
+1 / r ** `exponent`, with 'uniform' every tag is equally likely.
+"""
+import bisect
+import multiprocessing
+import random
+import re
+from collections import deque
+from cStringIO import StringIO
+
+from . import db
+from .models import (
+    User,
+    Tag,
+    role_registry,
+    user_type_registry,
+    user_tag_association_table,
+    touch
+)
+from .passwords import password_hasher
+from .search import index_users
+from .tag_index import tag_index
+from .tag_suggestions import tag_suggestions
+
+DISTRIBUTIONS = ('zipf', 'uniform')
+# Every fake user can log in with this password
+FAKE_PASSWORD = 'password'
+
+USER_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'password_hash',
+                'confirmed', 'admin_check', 'role_id', 'user_type_id',
+                'hometown', 'bio', 'profile_pic')
+
+
+def tag_weights(count, distribution='zipf', exponent=1.0):
+    """Cumulative weights of `count` tags, most popular first."""
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError('Unknown distribution %r' % distribution)
+    weights, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent if distribution == 'zipf' else 1.0
+        weights.append(total)
+    return weights
+
+
+def sample_tags(rng, tag_ids, weights, count):
+    """Choose `count` distinct tags from `tag_ids` with the given weights."""
+    count = min(count, len(tag_ids))
+    chosen = set()
+    while len(chosen) < count:
+        index = bisect.bisect(weights, rng.random() * weights[-1])
+        chosen.add(tag_ids[min(index, len(tag_ids) - 1)])
+    return chosen
+
+
+# State of each generating process, set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(settings):
+    from faker import Faker
+    _worker.clear()
+    _worker.update(settings)
+    _worker['fake'] = Faker()
+
+
+def _generate_chunk(spec):
+    """
+    Generate the users with ids `first_id` to `first_id + size - 1` and
+    their tag memberships. Returns `(users, memberships)`.
+    """
+    first_id, size, seed = spec
+    fake = _worker['fake']
+    fake.seed(seed)
+    rng = random.Random(seed)
+    users, memberships = [], []
+    for user_id in range(first_id, first_id + size):
+        first_name = fake.first_name()
+        last_name = fake.last_name()
+        # Faker repeats emails long before a million users, so the id is
+        # part of the address
+        email = '%s.%s.%d@%s' % (re.sub(r'\W', '', first_name.lower()),
+                                 re.sub(r'\W', '', last_name.lower()),
+                                 user_id, fake.free_email_domain())
+        users.append(dict(id=user_id,
+                          first_name=first_name,
+                          last_name=last_name,
+                          email=email,
+                          password_hash=_worker['password_hash'],
+                          confirmed=True,
+                          admin_check=True,
+                          role_id=rng.choice(_worker['role_ids']),
+                          user_type_id=rng.choice(_worker['user_type_ids']),
+                          hometown=fake.city() + ', ' + fake.state_abbr(),
+                          bio=fake.paragraph(),
+                          profile_pic=fake.image_url()))
+        if _worker['tag_ids']:
+            count = rng.randint(0, 2 * _worker['tags_per_user'])
+            memberships.extend(
+                (user_id, tag_id) for tag_id in sample_tags(
+                    rng, _worker['tag_ids'], _worker['weights'], count))
+    return users, memberships
+
+
+def _generate_in_parallel(specs, settings, processes):
+    """Yield the generated chunks in order, a few ahead of the consumer."""
+    if processes == 1:
+        _init_worker(settings)
+        for spec in specs:
+            yield _generate_chunk(spec)
+        return
+    pool = multiprocessing.Pool(processes, _init_worker, (settings,))
+    try:
+        # Only a few chunks are queued at a time, so that memory does not
+        # grow when the database is slower than the generators
+        pending = deque()
+        for spec in specs:
+            pending.append(pool.apply_async(_generate_chunk, (spec,)))
+            if len(pending) > 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _next_id(table):
+    return (db.session.query(db.func.max(table.c.id)).scalar() or 0) + 1
+
+
+def _is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True or value is False:
+        return 't' if value else 'f'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _insert(table, columns, rows):
+    """Insert `rows`, which are tuples of `columns` values, into `table`."""
+    if not rows:
+        return
+    connection = db.session.connection()
+    if _is_postgres(connection):
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join(_copy_value(v) for v in row))
+            data.write('\n')
+        data.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' %
+                           (table.name, ', '.join(columns)), data)
+    else:
+        connection.execute(table.insert(),
+                           [dict(zip(columns, row)) for row in rows])
+
+
+def _reset_sequence(table):
+    """Make Postgres continue numbering after the explicitly inserted ids."""
+    connection = db.session.connection()
+    if _is_postgres(connection):
+        connection.execute(
+            "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+            "(SELECT max(id) FROM %s))" % (table.name, table.name))
+
+
+def generate_tags(count, seed=0):
+    """Create `count` tags with distinct names. Returns their ids."""
+    from faker import Faker
+
+    fake = Faker()
+    fake.seed(seed)
+    names = set(name for name, in db.session.query(Tag.name))
+    first_id = _next_id(Tag.__table__)
+    rows = []
+    for tag_id in range(first_id, first_id + count):
+        name = fake.word()
+        if name in names:
+            name = '%s-%d' % (name, tag_id)
+        names.add(name)
+        rows.append((tag_id, name, fake.sentence()))
+    _insert(Tag.__table__, ('id', 'name', 'description'), rows)
+    _reset_sequence(Tag.__table__)
+    db.session.commit()
+    return [row[0] for row in rows]
+
+
+def generate(users=1000, tags=100, tags_per_user=5, distribution='zipf',
+             exponent=1.0, seed=0, processes=None, chunk_size=5000,
+             index=True):
+    """
+    Create `tags` tags, then `users` users with tags drawn from all tags
+    according to `distribution`. `processes` defaults to the number of CPUs.
+    Each chunk of users is committed on its own. If `index` is set the new
+    users are added to the search index as they are created. Returns the
+    number of users and memberships created.
+    """
+    weights = tag_weights(tags, distribution, exponent)
+    tag_ids = generate_tags(tags, seed) if tags else []
+    settings = dict(tag_ids=tag_ids,
+                    weights=weights,
+                    tags_per_user=tags_per_user,
+                    password_hash=password_hasher.hash(FAKE_PASSWORD),
+                    role_ids=[r.id for r in role_registry.all()] or [None],
+                    user_type_ids=[t.id for t in user_type_registry.all()] or
+                    [None])
+
+    first_id = _next_id(User.__table__)
+    specs = [(first_id + start, min(chunk_size, users - start),
+              seed * 1000003 + start // chunk_size)
+             for start in range(0, users, chunk_size)]
+    processes = processes or multiprocessing.cpu_count()
+
+    created = memberships = 0
+    for chunk_users, chunk_memberships in _generate_in_parallel(
+            specs, settings, processes):
+        _insert(User.__table__, USER_COLUMNS,
+                [tuple(u[c] for c in USER_COLUMNS) for u in chunk_users])
+        _insert(user_tag_association_table, ('user_id', 'tag_id'),
+                chunk_memberships)
+        if index:
+            index_users([u['id'] for u in chunk_users])
+        db.session.commit()
+        created += len(chunk_users)
+        memberships += len(chunk_memberships)
+
+    _reset_sequence(User.__table__)
+    touch(Tag, tag_ids)
+    db.session.commit()
+    # Rebuilt from the database when next used
+    tag_index.clear()
+    tag_suggestions.clear()
+    return created, memberships
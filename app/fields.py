@@ -0,0 +1,67 @@
+from wtforms import widgets
+from wtforms.fields import SelectFieldBase
+
+from . import db
+
+
+class LookupSelectField(SelectFieldBase):
+    """
+    Choose one row of a small, rarely changing table, like `QuerySelectField`
+    but rendered and validated against the choices kept by its
+    `LookupTable` rather than against a query per form. `data` is the chosen
+    model instance, which is only loaded once a valid choice is submitted and
+    the field's data is used.
+    """
+    widget = widgets.Select()
+
+    def __init__(self, label=None, validators=None, registry=None,
+                 get_label='name', order_by=None, **kwargs):
+        super(LookupSelectField, self).__init__(label, validators, **kwargs)
+        self.registry = registry
+        self.get_label = get_label
+        self.order_by = order_by
+        self._formdata = None
+
+    def _get_data(self):
+        if self._formdata is not None:
+            if self._is_choice(self._formdata):
+                self._set_data(db.session.query(self.registry.model)
+                               .get(int(self._formdata)))
+            else:
+                self._set_data(None)
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._formdata = None
+
+    data = property(_get_data, _set_data)
+
+    def _choices(self):
+        return self.registry.choices(self.get_label, self.order_by)
+
+    def _is_choice(self, pk):
+        return any(pk == choice for choice, _ in self._choices())
+
+    def iter_choices(self):
+        if self._formdata is not None:
+            selected = self._formdata
+        elif self._data is not None:
+            selected = unicode(self._data.id)
+        else:
+            selected = None
+        for pk, label in self._choices():
+            yield (pk, label, pk == selected)
+
+    def process_formdata(self, valuelist):
+        if valuelist:
+            self._data = None
+            self._formdata = valuelist[0]
+
+    def pre_validate(self, form):
+        if self._formdata is not None:
+            valid = self._is_choice(self._formdata)
+        else:
+            valid = self._data is not None
+        if not valid:
+            raise ValueError(self.gettext('Not a valid choice'))
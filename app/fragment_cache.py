@@ -0,0 +1,207 @@
+"""
+Per-worker cache of rendered fragments.
+
+A fragment is cached under a key together with the entities it was rendered
+from, such as `('user', 3)` or `('tag', 7)`. Committing a change to one of
+those entities (its columns, its tag memberships, or its deletion) bumps
+the entity's version, which makes every fragment rendered before it stale.
+Changes committed by other workers are only seen once a fragment expires,
+`FRAGMENT_CACHE_TTL` seconds after it was rendered.
+
+Only one thread renders a missing fragment. Threads that ask for it
+meanwhile wait for that rendering instead of repeating it, so a popular
+page that expires is rendered once rather than by every request in flight.
+
+Templates cache a block with
+
+    {% cache 'tag_info', tag.id depends [('tag', tag.id)] %}
+        ...
+    {% endcache %}
+
+and views call `fragment_cache.cached(key, render)`, where `render` returns
+the fragment and the list of entities it shows.
+"""
+import threading
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from .cache import LRUCache
+from .models import User, Tag, UserType, Role
+from .tag_index import memberships_committed
+
+# The entity kind of each model whose changes invalidate fragments
+KINDS = {User: 'user', Tag: 'tag', UserType: 'user_type', Role: 'role'}
+
+
+class FragmentCache(object):
+    def __init__(self):
+        self.entries = LRUCache()
+        self.max_item_size = 256 * 1024
+        self.wait_timeout = 10
+        # Entity to the generation in which it last changed
+        self._versions = {}
+        self._generation = 0
+        self._rendering = {}
+        self._lock = threading.Lock()
+        self.stale = self.waits = 0
+
+    def init_app(self, app):
+        self.entries.configure(maxsize=app.config['FRAGMENT_CACHE_SIZE'],
+                               ttl=app.config['FRAGMENT_CACHE_TTL'])
+        self.max_item_size = app.config['FRAGMENT_CACHE_MAX_ITEM_SIZE']
+        self.clear()
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._versions.clear()
+            self.stale = self.waits = 0
+
+    def invalidate(self, entities):
+        """Make the fragments showing any of `entities` stale."""
+        with self._lock:
+            self._generation += 1
+            for entity in entities:
+                self._versions[entity] = self._generation
+
+    def get(self, key):
+        """The fragment cached under `key`, or None if missing or stale."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, depends, generation = entry
+        if any(self._versions.get(e, 0) > generation for e in depends):
+            self.stale += 1
+            return None
+        return value
+
+    def set(self, key, value, depends, generation):
+        """
+        Cache a fragment showing the entities in `depends`, which was
+        rendered from the data as of `generation`.
+        """
+        if len(value) <= self.max_item_size:
+            self.entries.set(key, (value, tuple(depends), generation))
+
+    def cached(self, key, render):
+        """
+        The fragment cached under `key`, rendered with `render()` if it is
+        missing. `render` returns the fragment and the entities it shows.
+        """
+        if self.entries.maxsize <= 0:
+            return render()[0]
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            done = self._rendering.get(key)
+            if done is None:
+                done = self._rendering[key] = threading.Event()
+                leader = True
+            else:
+                leader = False
+                self.waits += 1
+        if not leader:
+            done.wait(self.wait_timeout)
+            value = self.get(key)
+            # The rendering failed, or its result was already stale
+            if value is None:
+                value = render()[0]
+            return value
+
+        try:
+            generation = self._generation
+            value, depends = render()
+            self.set(key, value, depends, generation)
+            return value
+        finally:
+            with self._lock:
+                del self._rendering[key]
+            done.set()
+
+    def stats(self):
+        stats = self.entries.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats.update(stale=self.stale, waits=self.waits,
+                     hit_rate=float(stats['hits'] - self.stale) / lookups
+                     if lookups else 0.0)
+        return stats
+
+
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """The `{% cache key, ... depends entities %}` template tag."""
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        depends = nodes.List([])
+        if parser.stream.skip_if('name:depends'):
+            depends = parser.parse_expression()
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_cache', [nodes.Tuple(key, 'load'), depends])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache(self, key, depends, caller):
+        return fragment_cache.cached(key, lambda: (caller(), depends))
+
+
+def _entity(obj):
+    return (KINDS[type(obj)], obj.id)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    changed = set()
+    for obj in session.dirty:
+        if type(obj) in KINDS and obj.id is not None and \
+                session.is_modified(obj, include_collections=False):
+            changed.add(_entity(obj))
+    for obj in session.deleted:
+        if type(obj) in KINDS:
+            changed.add(_entity(obj))
+            # The member counts of a deleted user's tags change
+            if isinstance(obj, User):
+                history = get_history(obj, 'tags')
+                changed.update(_entity(t) for t in
+                               list(history.unchanged) + list(history.deleted)
+                               if t.id is not None)
+    if changed:
+        session.info.setdefault('fragment_cache_pending', set()) \
+            .update(changed)
+
+
+@memberships_committed.connect
+def _memberships_committed(session, added=(), removed=(), deleted_tags=(),
+                           deleted_users=()):
+    changed = set()
+    for user_id, tag_id in list(added) + list(removed):
+        changed.add(('user', user_id))
+        changed.add(('tag', tag_id))
+    changed.update(('tag', tag_id) for tag_id in deleted_tags)
+    changed.update(('user', user_id) for user_id in deleted_users)
+    fragment_cache.invalidate(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changed = session.info.pop('fragment_cache_pending', None)
+    if changed:
+        fragment_cache.invalidate(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('fragment_cache_pending', None)
@@ -0,0 +1,299 @@
+"""
+Bulk import of members from a CSV or TSV file.
+
+The file is read one row at a time and imported in chunks of `chunk_size`
+rows, so memory use does not depend on the size of the file. For each chunk
+the emails that are already registered are found with a single query, the
+new users and their tags are inserted with multi-row inserts, and their
+invitations are queued in the outbox with one more. Each chunk is committed
+on its own; rows of chunks that were committed before an error stay
+imported.
+
+The first line of the file names the columns. `email` is required, and
+`first_name`, `last_name`, `user_type`, `role`, `hometown` and `tags` are
+optional. Tags are separated by semicolons. Roles and user types are
+matched by name, ignoring case.
+"""
+import csv
+import re
+import uuid
+from itertools import chain, islice
+
+from jinja2 import escape
+from . import db
+from .email import render_email, queue_emails
+from .models import (
+    User,
+    Tag,
+    role_registry,
+    user_type_registry,
+    user_tag_association_table,
+    touch
+)
+from .search import index_users
+from .tag_index import record_changes
+
+COLUMNS = ('first_name', 'last_name', 'email', 'user_type', 'role',
+           'hometown', 'tags')
+TAG_SEPARATOR = ';'
+# Longest value accepted for each of the columns stored in a String(64)
+MAX_LENGTH = 64
+# Only the first errors are kept, so a bad file does not use up memory
+MAX_ERRORS = 100
+
+_BOM = '\xef\xbb\xbf'
+
+
+class MemberImportError(ValueError):
+    """Raised when the file cannot be imported at all."""
+
+
+class ImportResult(object):
+    """Counts of what happened to the rows of an imported file."""
+
+    def __init__(self):
+        self.created = 0
+        self.existing = 0
+        self.invalid = 0
+        self.invited = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append('Line %d: %s' % (line, message))
+
+    def __repr__(self):
+        return '<ImportResult created=%d existing=%d invalid=%d>' % (
+            self.created, self.existing, self.invalid)
+
+
+def read_rows(stream, delimiter=None):
+    """
+    Yield `(line number, row)` for each row of a CSV or TSV file, where row
+    is a dict of unicode values keyed by lower case column name. If no
+    `delimiter` is given, tabs are used when the header contains one.
+    """
+    header = stream.readline()
+    if header.startswith(_BOM):
+        header = header[len(_BOM):]
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header else ','
+    reader = csv.reader(chain([header], stream), delimiter=delimiter)
+    try:
+        names = [name.strip().lower().replace(' ', '_')
+                 for name in next(reader)]
+    except StopIteration:
+        raise MemberImportError('The file is empty.')
+    if 'email' not in names:
+        raise MemberImportError('The file has no email column.')
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        row = dict((name, value.decode('utf-8', 'replace').strip())
+                   for name, value in zip(names, values)
+                   if name in COLUMNS)
+        yield reader.line_num, row
+
+
+class MemberImporter(object):
+    """
+    Imports rows as returned by `read_rows`. Roles, user types and tags are
+    resolved through in-memory maps of name to id that are loaded once per
+    import.
+    """
+
+    def __init__(self, invite=True):
+        self.invite = invite
+        self.result = ImportResult()
+        self.roles = dict((r.name.lower(), r.id) for r in role_registry.all())
+        self.default_role = role_registry.find(default=True)
+        self.user_types = dict((t.name.lower(), t.id)
+                               for t in user_type_registry.all())
+        self.tags = dict(db.session.query(Tag.name, Tag.id))
+        if invite:
+            self.serializer = User.confirmation_serializer()
+            self.invitation = InvitationTemplate()
+
+    def run(self, rows, chunk_size=1000):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return self.result
+            try:
+                self.import_chunk(chunk)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def parse(self, line, row):
+        """Turn a row into the column values of a user, or record an error."""
+        email = row.get('email', '')
+        if '@' not in email:
+            return self.result.error(line, 'Invalid email "%s".' % email)
+        for column in ('first_name', 'last_name', 'email', 'hometown'):
+            if len(row.get(column, '')) > MAX_LENGTH:
+                return self.result.error(
+                    line, 'The %s is longer than %d characters.' %
+                    (column.replace('_', ' '), MAX_LENGTH))
+
+        role_name = row.get('role', '').lower()
+        if role_name:
+            role_id = self.roles.get(role_name)
+            if role_id is None:
+                return self.result.error(line, 'Unknown role "%s".' %
+                                         row['role'])
+        else:
+            role_id = self.default_role.id if self.default_role else None
+
+        user_type_id = None
+        user_type_name = row.get('user_type', '').lower()
+        if user_type_name:
+            user_type_id = self.user_types.get(user_type_name)
+            if user_type_id is None:
+                return self.result.error(line, 'Unknown user type "%s".' %
+                                         row['user_type'])
+
+        tags = []
+        for name in row.get('tags', '').split(TAG_SEPARATOR):
+            name = name.strip()
+            if name and name not in tags:
+                tags.append(name)
+
+        return dict(first_name=row.get('first_name', ''),
+                    last_name=row.get('last_name', ''),
+                    email=email,
+                    hometown=row.get('hometown', ''),
+                    role_id=role_id,
+                    user_type_id=user_type_id,
+                    tags=tags)
+
+    def import_chunk(self, chunk):
+        users = []
+        emails = set()
+        for line, row in chunk:
+            user = self.parse(line, row)
+            if user is None:
+                continue
+            if user['email'] in emails:
+                self.result.error(line, 'Duplicate email "%s".' %
+                                  user['email'])
+                continue
+            emails.add(user['email'])
+            users.append(user)
+        if not users:
+            return
+
+        existing = set(email for email, in db.session.query(User.email)
+                       .filter(User.email.in_(emails)))
+        self.result.existing += len(existing)
+        users = [u for u in users if u['email'] not in existing]
+        if not users:
+            return
+
+        db.session.execute(User.__table__.insert(), [
+            dict(first_name=u['first_name'],
+                 last_name=u['last_name'],
+                 email=u['email'],
+                 hometown=u['hometown'],
+                 role_id=u['role_id'],
+                 user_type_id=u['user_type_id'],
+                 confirmed=False,
+                 admin_check=False,
+                 bio='',
+                 profile_pic='') for u in users])
+        ids = dict(db.session.query(User.email, User.id)
+                   .filter(User.email.in_([u['email'] for u in users])))
+        self.result.created += len(users)
+
+        self.create_tags(set(name for u in users for name in u['tags']))
+        memberships = [(ids[u['email']], self.tags[name])
+                       for u in users for name in u['tags']]
+        if memberships:
+            db.session.execute(user_tag_association_table.insert(), [
+                dict(user_id=user_id, tag_id=tag_id)
+                for user_id, tag_id in memberships])
+            record_changes(db.session(), added=memberships)
+            # The new users were just inserted, but the tags gained members
+            touch(Tag, [tag_id for _, tag_id in memberships])
+        index_users(ids.values())
+
+        if self.invite:
+            queue_emails([self.invitation.render(
+                first_name=u['first_name'],
+                last_name=u['last_name'],
+                email=u['email'],
+                user_id=ids[u['email']],
+                token=self.serializer.dumps({'confirm': ids[u['email']]}))
+                for u in users])
+            self.result.invited += len(users)
+
+    def create_tags(self, names):
+        """Create the tags that are not in the map yet and add their ids."""
+        missing = [name for name in names if name not in self.tags]
+        if missing:
+            tags = Tag.upsert_many(missing)
+            self.tags.update((name, tag.id) for name, tag in tags.items())
+
+
+class InvitationTemplate(object):
+    """
+    The invitation email rendered once with placeholders for the values that
+    differ between users. Inviting many users then costs a few string
+    substitutions per user instead of rendering two templates each.
+    """
+
+    def __init__(self):
+        key = uuid.uuid4().hex
+        # The user id goes through the int URL converter, so its placeholder
+        # is a number; the others are letters and digits, which are neither
+        # escaped nor quoted
+        self.placeholders = dict(first_name='first' + key,
+                                 last_name='last' + key,
+                                 email='email' + key,
+                                 token='token' + key,
+                                 user_id=str(int(key, 16)))
+        message = render_email(
+            self.placeholders['email'],
+            'You Are Invited To Join',
+            'account/email/invite',
+            user=User(first_name=self.placeholders['first_name'],
+                      last_name=self.placeholders['last_name'],
+                      email=self.placeholders['email']),
+            user_id=int(self.placeholders['user_id']),
+            token=self.placeholders['token'])
+        self.subject = message['subject']
+        # Split on the placeholders so that the parts at odd indexes are
+        # placeholders and the others are text common to every message
+        pattern = re.compile('(%s)' % '|'.join(self.placeholders.values()))
+        self.body = pattern.split(message['body'])
+        self.html = pattern.split(message['html'])
+
+    @staticmethod
+    def _fill(parts, values):
+        parts = list(parts)
+        parts[1::2] = [values[p] for p in parts[1::2]]
+        return u''.join(parts)
+
+    def render(self, **values):
+        """Return the message for the given values as `render_email` does."""
+        text = dict((self.placeholders[k], unicode(v))
+                    for k, v in values.items())
+        html = dict((k, unicode(escape(v))) for k, v in text.items())
+        return dict(recipient=values['email'],
+                    subject=self.subject,
+                    body=self._fill(self.body, text),
+                    html=self._fill(self.html, html))
+
+
+def import_members(stream, delimiter=None, invite=True, chunk_size=1000):
+    """
+    Import the members listed in a CSV or TSV file and, if `invite` is set,
+    queue an invitation to each new member. Returns an `ImportResult`.
+    Invitations link to the site, so a request context is needed to send
+    them.
+    """
+    importer = MemberImporter(invite=invite)
+    return importer.run(read_rows(stream, delimiter), chunk_size=chunk_size)
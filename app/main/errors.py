@@ -1,5 +1,6 @@
-from flask import render_template
+from flask import current_app, render_template
 from . import main
+from ..passwords import PasswordHashTimeout
 
 
 @main.app_errorhandler(403)
@@ -15,3 +16,11 @@ def page_not_found(_):
 @main.app_errorhandler(500)
 def internal_server_error(_):
     return render_template('errors/500.html'), 500
+
+
+@main.app_errorhandler(PasswordHashTimeout)
+def password_hash_timeout(_):
+    """Any view that hashes or checks a password while the pool is busy."""
+    retry_after = int(current_app.config['PASSWORD_HASH_TIMEOUT'])
+    return render_template('errors/503.html'), 503, \
+        {'Retry-After': str(max(retry_after, 1))}
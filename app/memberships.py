@@ -0,0 +1,53 @@
+"""
+Assign tags to a user with bulk statements on the association table.
+
+Replacing `User.tags` makes SQLAlchemy load the collection and write each
+changed membership through the unit of work. `set_tags` instead diffs the
+wanted tags against the stored memberships, inserts and deletes only the
+difference with one statement each, and updates what the ORM listeners
+would otherwise have kept up to date: the tag index and its subscribers,
+the search documents and the `updated_at` of the user and tags.
+"""
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from . import db
+from .models import User, Tag, user_tag_association_table, touch
+from .search import index_users
+from .tag_index import record_changes
+
+
+def set_tags(user, tags):
+    """
+    Make `tags` the tags of the existing `user`, in the current transaction.
+    Return the (added, removed) tag ids.
+    """
+    session = db.session()
+    assoc = user_tag_association_table.c
+    tags = list(tags)
+    current = set(tag_id for tag_id, in session.query(assoc.tag_id)
+                  .filter(assoc.user_id == user.id))
+    wanted = set(tag.id for tag in tags)
+    added, removed = wanted - current, current - wanted
+    if added:
+        session.execute(user_tag_association_table.insert(), [
+            dict(user_id=user.id, tag_id=tag_id) for tag_id in added])
+    if removed:
+        session.execute(user_tag_association_table.delete().where(
+            (assoc.user_id == user.id) & assoc.tag_id.in_(removed)))
+    # The loaded collection now matches the table, without pending changes
+    set_committed_value(user, 'tags', tags)
+    if not (added or removed):
+        return added, removed
+
+    record_changes(session, added=[(user.id, tag_id) for tag_id in added],
+                   removed=[(user.id, tag_id) for tag_id in removed])
+    touch(User, [user.id])
+    touch(Tag, added | removed)
+    session.expire(user, ['updated_at'])
+    for tag_id in added | removed:
+        tag = session.identity_map.get(identity_key(Tag, tag_id))
+        if tag is not None:
+            session.expire(tag, ['users', 'updated_at'])
+    index_users([user.id])
+    return added, removed
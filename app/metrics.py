@@ -0,0 +1,272 @@
+"""
+Request metrics in the Prometheus text format.
+
+Every request is counted by endpoint, method and status, and its latency,
+time spent in the database and response size are added to histograms with
+fixed buckets. Recording a request is a few dictionary updates under a lock,
+so the metrics are always on.
+
+Each web worker keeps the metrics of the requests it handled. With
+`METRICS_DIR` set, every worker writes them to a file in that directory at
+most every `METRICS_FLUSH_INTERVAL` seconds, and `/admin/metrics` adds up
+the files of all workers. Counters of workers that have exited are kept,
+their in-flight requests are not. The directory should be emptied before
+the server is started.
+"""
+import atexit
+import bisect
+import errno
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, request
+from .email import outbox
+from .sql_stats import QueryTimer, start_collecting, stop_collecting
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': LATENCY_BUCKETS,
+    'http_request_db_seconds': LATENCY_BUCKETS,
+    'http_response_size_bytes': SIZE_BUCKETS
+}
+
+# Name: (type, help) of each metric family, in the order they are served
+FAMILIES = [
+    ('http_requests_total', 'counter', 'Requests handled.'),
+    ('http_request_exceptions_total', 'counter',
+     'Requests that failed with an unhandled exception.'),
+    ('http_requests_in_flight', 'gauge', 'Requests being handled.'),
+    ('http_request_duration_seconds', 'histogram',
+     'Time spent handling a request.'),
+    ('http_request_db_seconds', 'histogram',
+     'Time spent running SQL statements during a request.'),
+    ('http_response_size_bytes', 'histogram', 'Size of a response body.'),
+    ('email_sent_total', 'counter', 'Queued emails sent.'),
+    ('email_failed_total', 'counter',
+     'Queued emails given up on after too many attempts.'),
+    ('email_retried_total', 'counter', 'Failed attempts to send an email.'),
+    ('email_queue_messages', 'gauge', 'Messages in the outbox by status.')
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, _escape(value))
+                             for key, value in labels)
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class RequestMetrics(object):
+    """Counters and histograms of the requests handled by this process."""
+
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = 5
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = {}
+        # Histogram values are the count of each bucket, the last one being
+        # +Inf, followed by the sum of the observations
+        self.histograms = {}
+        self.in_flight = 0
+        self._last_flush = time.time()
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        with self._lock:
+            self._reset()
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+
+    def _start_request(self):
+        queries = QueryTimer()
+        start_collecting(queries)
+        g.request_metrics = dict(start=time.time(), queries=queries,
+                                 recorded=False)
+        with self._lock:
+            self.in_flight += 1
+
+    def _finish_request(self, response):
+        state = getattr(g, 'request_metrics', None)
+        if state is not None and not state['recorded']:
+            size = response.calculate_content_length()
+            if size is None:
+                size = response.content_length
+            self._record(state, response.status_code, size)
+        return response
+
+    def _teardown_request(self, exception=None):
+        state = getattr(g, 'request_metrics', None)
+        if state is None:
+            return
+        # The response to an unhandled exception skips after_request
+        if not state['recorded']:
+            self._record(state, 500, None, exception=True)
+        del g.request_metrics
+        with self._lock:
+            self.in_flight -= 1
+
+    def _record(self, state, status, size, exception=False):
+        duration = time.time() - state['start']
+        queries = state['queries']
+        stop_collecting(queries)
+        state['recorded'] = True
+        labels = (('endpoint', request.endpoint or 'none'),
+                  ('method', request.method))
+        with self._lock:
+            self._increment('http_requests_total',
+                            labels + (('status', str(status)),))
+            if exception:
+                self._increment('http_request_exceptions_total', labels)
+            self._observe('http_request_duration_seconds', labels, duration)
+            self._observe('http_request_db_seconds', labels,
+                          queries.duration)
+            if size is not None:
+                self._observe('http_response_size_bytes', labels, size)
+            flush = self.directory and \
+                time.time() - self._last_flush >= self.flush_interval
+        if flush:
+            self.flush()
+
+    def _increment(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name]
+        key = (name, labels)
+        values = self.histograms.get(key)
+        if values is None:
+            values = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        values[bisect.bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self):
+        """The metrics of this process, as stored in `METRICS_DIR`."""
+        with self._lock:
+            counters = [[name, labels, value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, list(values)]
+                          for (name, labels), values
+                          in self.histograms.items()]
+            in_flight = self.in_flight
+        for key, value in outbox.counters().items():
+            if key in ('sent', 'failed', 'retried') and value:
+                counters.append(['email_%s_total' % key, (), value])
+        return dict(pid=os.getpid(), in_flight=in_flight, counters=counters,
+                    histograms=histograms)
+
+    def flush(self):
+        """Write the metrics of this process to `METRICS_DIR`."""
+        if not self.directory:
+            return
+        self._last_flush = time.time()
+        path = os.path.join(self.directory, 'metrics-%d.json' % os.getpid())
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError):
+            logger.exception('Could not write metrics to %s', path)
+
+    def snapshots(self):
+        """The metrics of every worker."""
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (IOError, OSError, ValueError):
+                logger.exception('Could not read metrics from %s', path)
+        return snapshots
+
+    def collect(self):
+        """
+        The metrics of all workers added up, as a dict of metric name to a
+        dict of labels to value.
+        """
+        samples = dict((name, {}) for name, _, _ in FAMILIES)
+        in_flight = 0
+        for snapshot in self.snapshots():
+            for name, labels, value in snapshot['counters']:
+                labels = tuple(tuple(label) for label in labels)
+                samples[name][labels] = samples[name].get(labels, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                labels = tuple(tuple(label) for label in labels)
+                total = samples[name].get(labels)
+                if total is None:
+                    samples[name][labels] = list(values)
+                elif len(total) == len(values):
+                    for i, value in enumerate(values):
+                        total[i] += value
+            if snapshot['pid'] == os.getpid() or _alive(snapshot['pid']):
+                in_flight += snapshot['in_flight']
+        samples['http_requests_in_flight'][()] = in_flight
+        for status, count in outbox.queue_sizes().items():
+            samples['email_queue_messages'][(('status', status),)] = count
+        return samples
+
+    def render(self):
+        """The metrics of all workers in the Prometheus text format."""
+        samples = self.collect()
+        lines = []
+        for name, kind, description in FAMILIES:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(samples[name].items()):
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (name, _format_labels(labels),
+                                              _format_value(value)))
+                    continue
+                count = 0
+                bounds = HISTOGRAMS[name] + ('+Inf',)
+                for bound, bucket_count in zip(bounds, value):
+                    count += bucket_count
+                    lines.append('%s_bucket%s %d' % (
+                        name, _format_labels(labels + (('le', str(bound)),)),
+                        count))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels),
+                                              _format_value(value[-1])))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels),
+                                                count))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+atexit.register(request_metrics.flush)
@@ -5,3 +5,4 @@ module (as opposed to just their python files)
 
 from user import *  # noqa
 from tag import *  # noqa
+from outbox import *  # noqa
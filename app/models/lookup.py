@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .. import db
+
+
+class LookupTable(object):
+    """
+    Process-level copy of a small, rarely changing table such as `roles`.
+
+    Rows are loaded once per worker into immutable named tuples with the
+    same attribute names as the model's columns, so they can be shared
+    between threads and requests and used wherever only column values are
+    needed (permission checks, choosing a default role). The copy is
+    reloaded when this process commits a change to the table, when `reload`
+    is called, and after `max_age` seconds so that changes made by other
+    workers are picked up.
+
+    `version` is bumped on every load, and anything derived from the rows,
+    such as the choices of a select field, is kept only for one version.
+    """
+
+    def __init__(self, model, max_age=300):
+        self.model = model
+        self.max_age = max_age
+        self.row_type = namedtuple(model.__name__ + 'Row',
+                                   model.__table__.columns.keys())
+        self._rows = None
+        self._loaded_at = None
+        self.version = 0
+        self._choices = {}
+        self._lock = threading.Lock()
+        event.listen(Session, 'before_flush', self._collect_changes)
+        event.listen(Session, 'after_commit', self._apply_changes)
+
+    def init_app(self, app):
+        self.max_age = app.config.get('LOOKUP_TABLE_MAX_AGE', self.max_age)
+        self.clear()
+
+    def clear(self):
+        """Forget the loaded rows; they are reloaded when next needed."""
+        with self._lock:
+            self._rows = None
+
+    def reload(self):
+        """Load every row of the table, ordered by id."""
+        columns = self.model.__table__.columns
+        rows = db.session.query(*columns).order_by(self.model.id).all()
+        with self._lock:
+            self._rows = [self.row_type(*row) for row in rows]
+            self._loaded_at = time.time()
+            self.version += 1
+            self._choices = {}
+        return self._rows
+
+    def all(self):
+        rows = self._rows
+        if rows is None or time.time() - self._loaded_at > self.max_age:
+            rows = self.reload()
+        return rows
+
+    def choices(self, label='name', order_by=None):
+        """
+        Return (id, label) pairs of every row, as text, ordered by the
+        `order_by` column and then by id. The list is built once per version.
+        """
+        rows = self.all()
+        key = (label, order_by)
+        with self._lock:
+            if rows is self._rows and key in self._choices:
+                return self._choices[key]
+        ordered = rows
+        if order_by is not None:
+            ordered = sorted(rows, key=lambda row: getattr(row, order_by))
+        choices = tuple((unicode(row.id), unicode(getattr(row, label)))
+                        for row in ordered)
+        with self._lock:
+            # Unless the rows were reloaded meanwhile
+            if rows is self._rows:
+                self._choices[key] = choices
+        return choices
+
+    def get(self, id):
+        for row in self.all():
+            if row.id == id:
+                return row
+        return None
+
+    def find(self, **criteria):
+        """Return the first row whose columns equal all of `criteria`."""
+        for row in self.all():
+            if all(getattr(row, k) == v for k, v in criteria.items()):
+                return row
+        return None
+
+    def _collect_changes(self, session, flush_context, instances):
+        # Changes to relationships such as `Role.users` do not change any
+        # of the loaded columns
+        dirty = (obj for obj in session.dirty
+                 if session.is_modified(obj, include_collections=False))
+        for objects in (session.new, dirty, session.deleted):
+            if any(isinstance(obj, self.model) for obj in objects):
+                session.info.setdefault('stale_lookup_tables', set()) \
+                    .add(self)
+                return
+
+    def _apply_changes(self, session):
+        stale = session.info.get('stale_lookup_tables')
+        if stale and self in stale:
+            stale.discard(self)
+            self.clear()
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from .. import db
+
+
+class OutboundEmail(db.Model):
+    """
+    An email waiting to be sent, or the record of one that was. Messages
+    are rendered when they are queued and delivered by the outbox workers
+    in `app.email`.
+    """
+    __tablename__ = 'outbound_emails'
+    __table_args__ = (
+        # Workers look for pending messages that are due
+        db.Index('ix_outbound_emails_status_next_attempt_at',
+                 'status', 'next_attempt_at'),
+    )
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False,
+                                default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    claim_token = db.Column(db.String(32), index=True)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<OutboundEmail %r to \'%s\'>' % (self.id, self.recipient)
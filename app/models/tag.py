@@ -1,13 +1,39 @@
+from datetime import datetime
+
+from blinker import Namespace
+
 from .. import db
 
+_signals = Namespace()
+
+# Sent by `Tag.upsert_many` with the session and the `tags` it inserted, which
+# session events do not see since they are inserted with Core statements
+tags_inserted = _signals.signal('tags-inserted')
+
+# Inserts that skip names which already exist, by dialect. Other databases
+# use a plain insert, which fails if another transaction adds the same name.
+# ON CONFLICT needs Postgres 9.5 or later.
+_INSERT_NEW_TAGS = {
+    'sqlite': 'INSERT OR IGNORE INTO tags (name, description) '
+              'VALUES (:name, :description)',
+    'postgresql': 'INSERT INTO tags (name, description) '
+                  'VALUES (:name, :description) ON CONFLICT (name) DO NOTHING'
+}
 
+# Each membership is stored once. The primary key finds the tags of a user,
+# and the reverse index the members of a tag, without scanning the table.
 user_tag_association_table = db.Table('user_tag_association',
                                       db.Column('tag_id',
                                                 db.Integer,
                                                 db.ForeignKey('tags.id')),
                                       db.Column('user_id',
                                                 db.Integer,
-                                                db.ForeignKey('users.id')))
+                                                db.ForeignKey('users.id')),
+                                      db.PrimaryKeyConstraint('user_id',
+                                                              'tag_id'),
+                                      db.Index('ix_user_tag_association_'
+                                               'tag_id_user_id',
+                                               'tag_id', 'user_id'))
 
 
 class Tag(db.Model):
@@ -18,24 +44,111 @@ class Tag(db.Model):
     users = db.relationship('User',
                             secondary=user_tag_association_table,
                             back_populates='tags')
+    # When the tag or its members last changed, and the number of times the
+    # row was updated, which guards against overwriting concurrent edits
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.now())
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     @staticmethod
     def find_or_create(name, description=None):
-        tag = Tag.query.filter_by(name=name).first()
-        if tag is None:
-            tag = Tag(name=name, description=description)
-            db.session.add(tag)
-            db.session.commit()
+        if name:
+            tag = Tag.upsert_many([name], {name: description})[name]
+        else:
+            # `upsert_many` skips empty names
+            tag = Tag.query.filter_by(name=name).first()
+            if tag is None:
+                tag = Tag(name=name, description=description)
+                db.session.add(tag)
+        db.session.commit()
         return tag
 
+    @staticmethod
+    def upsert_many(names, descriptions=None, chunk_size=500):
+        """
+        Return a dict mapping each of `names` to its Tag, creating the tags
+        that do not exist yet. Existing tags are found with one IN query and
+        missing ones are inserted with one statement that ignores names
+        added concurrently, then selected. `descriptions` optionally maps
+        names to the description of newly created tags. The caller commits.
+        """
+        names = set(name for name in names if name)
+        descriptions = descriptions or {}
+        tags = {}
+        for chunk in _chunks(names, chunk_size):
+            tags.update((t.name, t)
+                        for t in Tag.query.filter(Tag.name.in_(chunk)))
+        missing = [name for name in names if name not in tags]
+        if not missing:
+            return tags
+
+        connection = db.session.connection()
+        statement = _INSERT_NEW_TAGS.get(connection.dialect.name)
+        statement = db.text(statement) if statement else Tag.__table__.insert()
+        connection.execute(statement, [
+            dict(name=name, description=descriptions.get(name))
+            for name in missing])
+        inserted = []
+        for chunk in _chunks(missing, chunk_size):
+            inserted.extend(Tag.query.filter(Tag.name.in_(chunk)))
+        tags.update((t.name, t) for t in inserted)
+        tags_inserted.send(db.session(), tags=inserted)
+        return tags
+
+    @staticmethod
+    def user_counts(tag_ids=None):
+        """
+        Count the users associated with each tag in a single GROUP BY query
+        over the association table, without loading any users. If `tag_ids`
+        is given only those tags are counted. Returns a dict mapping tag id
+        to user count; tags without users are absent, so use `.get(id, 0)`.
+        """
+        tag_id = user_tag_association_table.c.tag_id
+        query = db.session.query(tag_id, db.func.count()).group_by(tag_id)
+        if tag_ids is not None:
+            tag_ids = list(tag_ids)
+            if not tag_ids:
+                return {}
+            query = query.filter(tag_id.in_(tag_ids))
+        return dict(query.all())
+
+    def count_users(self):
+        """Count the users associated with this tag without loading them."""
+        return Tag.user_counts([self.id]).get(self.id, 0)
+
     @staticmethod
     def generate_fake(count=100):
         """Generate a number of fake tags for testing."""
         from faker import Faker
 
         fake = Faker()
-        for i in range(count):
-            Tag.find_or_create(fake.word(), description=fake.paragraph())
+        descriptions = dict((fake.word(), fake.paragraph())
+                            for i in range(count))
+        Tag.upsert_many(descriptions, descriptions)
+        db.session.commit()
 
     def __repr__(self):
         return '<Tag \'%s\'>' % self.name
+
+
+def touch(model, ids, chunk_size=500):
+    """
+    Set `updated_at` of the rows of `model` (User or Tag) with the given ids
+    to now, without changing their `version_id`. Used when what is shown
+    with a row, such as its tag memberships, changes without the row itself
+    being updated, so that conditional requests see the change.
+    """
+    connection = db.session.connection()
+    now = datetime.utcnow()
+    for chunk in _chunks(set(ids), chunk_size):
+        connection.execute(model.__table__.update()
+                           .where(model.__table__.c.id.in_(chunk))
+                           .values(updated_at=now))
+
+
+def _chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -1,10 +1,17 @@
+from datetime import datetime
+
 from flask import current_app
 from flask.ext.login import UserMixin, AnonymousUserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
     BadSignature, SignatureExpired
 from .. import db, login_manager
-from tag import user_tag_association_table
+from ..cache import LRUCache
+from ..passwords import password_hasher
+from lookup import LookupTable
+from tag import Tag, user_tag_association_table, touch
 
 
 class Permission:
@@ -40,11 +47,15 @@ class Role(db.Model):
             role.default = roles[r][2]
             db.session.add(role)
         db.session.commit()
+        role_registry.reload()
 
     def __repr__(self):
         return '<Role \'%s\'>' % self.name
 
 
+role_registry = LookupTable(Role)
+
+
 class UserType(db.Model):
     __tablename__ = 'user_types'
     id = db.Column(db.Integer, primary_key=True)
@@ -60,19 +71,27 @@ class UserType(db.Model):
             'Netter Center Staff',
             'Community Member'
         ]
+        existing = set(name for name, in db.session.query(UserType.name))
         for user_type_name in user_types:
-            user_type = UserType.query.filter_by(name=user_type_name).first()
-            if user_type is None:
-                user_type = UserType(name=user_type_name)
-                db.session.add(user_type)
-                db.session.commit()
+            if user_type_name not in existing:
+                db.session.add(UserType(name=user_type_name))
+        db.session.commit()
+        user_type_registry.reload()
 
     def __repr__(self):
         return '<UserType \'%s\'>' % self.name
 
 
+user_type_registry = LookupTable(UserType)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Keysets used to paginate the registered users listing
+        db.Index('ix_users_last_name_id', 'last_name', 'id'),
+        db.Index('ix_users_first_name_id', 'first_name', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     confirmed = db.Column(db.Boolean, default=False)
     admin_check = db.Column(db.Boolean, default=False)
@@ -88,23 +107,47 @@ class User(UserMixin, db.Model):
                            secondary=user_tag_association_table,
                            back_populates='users')
     user_type_id = db.Column(db.Integer, db.ForeignKey('user_types.id'))
+    # When the user or their tags last changed, and the number of times the
+    # row was updated, which guards against overwriting concurrent edits
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.now())
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
+        # Roles are looked up in `role_registry` rather than queried, so
+        # creating many users does not cost a query per user
+        if self.role is None and self.role_id is None:
+            role = None
             if self.email == current_app.config['ADMIN_EMAIL']:
-                self.role = Role.query.filter_by(
-                    permissions=Permission.ADMINISTER).first()
+                role = role_registry.find(permissions=Permission.ADMINISTER)
                 self.admin_check = True
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+            if role is None:
+                role = role_registry.find(default=True)
+            if role is not None:
+                self.role_id = role.id
 
     def full_name(self):
         return '%s %s' % (self.first_name, self.last_name)
 
+    def role_info(self):
+        """
+        Return this user's role without loading it from the database: the
+        Role object if it has been assigned or loaded, otherwise the row in
+        `role_registry` for `role_id`.
+        """
+        if 'role' in self.__dict__:
+            return self.__dict__['role']
+        if self.role_id is None:
+            return None
+        return role_registry.get(self.role_id)
+
     def can(self, permissions):
-        return self.role is not None and \
-            (self.role.permissions & permissions) == permissions
+        role = self.role_info()
+        return role is not None and \
+            (role.permissions & permissions) == permissions
 
     def is_admin(self):
         return self.can(Permission.ADMINISTER)
@@ -115,16 +158,28 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """Whether the password hash was made with an outdated method."""
+        return password_hasher.needs_rehash(self.password_hash)
 
     def generate_confirmation_token(self, expiration=604800):
         """Generate a confirmation token to email a new user."""
+        return User.confirmation_serializer(expiration).dumps(
+            {'confirm': self.id})
 
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'confirm': self.id})
+    @staticmethod
+    def confirmation_serializer(expiration=604800):
+        """
+        The serializer used for confirmation tokens. Reusing one serializer
+        is cheaper when generating tokens for many users at once:
+        `serializer.dumps({'confirm': user_id})`.
+        """
+        return Serializer(current_app.config['SECRET_KEY'], expiration)
 
     def generate_email_change_token(self, new_email, expiration=3600):
         """Generate an email change token to email an existing user."""
@@ -193,7 +248,7 @@ class User(UserMixin, db.Model):
         from faker import Faker
 
         fake = Faker()
-        roles = Role.query.all()
+        roles = role_registry.all()
 
         seed()
         for i in range(count):
@@ -204,7 +259,7 @@ class User(UserMixin, db.Model):
                 password=fake.password(),
                 confirmed=True,
                 admin_check=True,
-                role=choice(roles),
+                role_id=choice(roles).id,
                 bio=fake.paragraph(),
                 hometown=(fake.city() + ', ' + fake.state_abbr()),
                 profile_pic=fake.image_url(),
@@ -228,8 +283,7 @@ class User(UserMixin, db.Model):
             password=password,
             confirmed=True,
             admin_check=True,
-            role=Role.query.filter_by(
-                permissions=Permission.ADMINISTER).first()
+            role_id=role_registry.find(permissions=Permission.ADMINISTER).id
         )
         db.session.add(u)
         try:
@@ -252,6 +306,132 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class Identity(UserMixin):
+    """
+    The logged in user as seen by most requests: the fields needed to
+    authenticate and authorize a request and to render the navigation bar,
+    read from `identity_cache` instead of the database. Any other attribute
+    is looked up on the `User` row, which is loaded the first time it is
+    needed. Views that modify the logged in user should load the `User`
+    themselves rather than assigning attributes on `current_user`.
+    """
+
+    # User columns that are copied into the cache. Changing any of them
+    # invalidates the cached identity.
+    fields = ('id', 'first_name', 'last_name', 'confirmed', 'admin_check',
+              'role_id')
+
+    def __init__(self, snapshot, user=None):
+        self.__dict__.update(snapshot)
+        self._user = user
+
+    @staticmethod
+    def snapshot(user):
+        data = dict((f, getattr(user, f)) for f in Identity.fields)
+        data['role'] = role_registry.get(user.role_id)
+        return data
+
+    def full_name(self):
+        return '%s %s' % (self.first_name, self.last_name)
+
+    def can(self, permissions):
+        return self.role is not None and \
+            (self.role.permissions & permissions) == permissions
+
+    def is_admin(self):
+        return self.can(Permission.ADMINISTER)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return getattr(self._user, name)
+
+    def __repr__(self):
+        return '<Identity \'%s\'>' % self.full_name()
+
+
+identity_cache = LRUCache()
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    snapshot = identity_cache.get(user_id)
+    if snapshot is not None:
+        return Identity(snapshot)
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    snapshot = Identity.snapshot(user)
+    identity_cache.set(user_id, snapshot)
+    return Identity(snapshot, user)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_identity_changes(session, flush_context, instances):
+    """Find the cached identities that this transaction makes stale."""
+    stale = session.info.setdefault('stale_identities', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            if any(get_history(obj, f).has_changes()
+                   for f in Identity.fields + ('role',)):
+                stale.add(obj.id)
+        elif isinstance(obj, Role) and \
+                session.is_modified(obj, include_collections=False):
+            # Every identity with this role caches its name and permissions
+            stale.add(None)
+    stale.update(obj.id for obj in session.deleted if isinstance(obj, User))
+    stale.update(None for obj in session.deleted if isinstance(obj, Role))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_identities(session):
+    stale = session.info.pop('stale_identities', ())
+    if None in stale:
+        identity_cache.clear()
+    else:
+        for user_id in stale:
+            identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_identity_changes(session):
+    session.info.pop('stale_identities', None)
+
+
+@event.listens_for(Session, 'before_flush')
+def _touch_memberships(session, flush_context, instances):
+    """
+    Mark the existing users and tags whose memberships this flush changes as
+    updated. Deleting a user or a tag changes the memberships of the other
+    side.
+    """
+    users, tags = set(), set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = get_history(obj, 'tags')
+            changed = list(history.added) + list(history.deleted)
+            if changed:
+                users.add(obj)
+                tags.update(changed)
+        elif isinstance(obj, Tag):
+            history = get_history(obj, 'users')
+            changed = list(history.added) + list(history.deleted)
+            if changed:
+                tags.add(obj)
+                users.update(changed)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            history = get_history(obj, 'tags')
+            tags.update(list(history.unchanged) + list(history.deleted))
+        elif isinstance(obj, Tag):
+            history = get_history(obj, 'users')
+            users.update(list(history.unchanged) + list(history.deleted))
+    # New rows get the current time when they are inserted
+    for model, objects in [(User, users), (Tag, tags)]:
+        ids = [obj.id for obj in objects if obj.id is not None and
+               obj not in session.new and obj not in session.deleted]
+        if ids:
+            touch(model, ids)
@@ -0,0 +1,130 @@
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+
+class KeysetPage(object):
+    """
+    One page of results from a keyset (seek) paginated query. `next_cursor`
+    is an opaque token that can be passed back to `keyset_paginate` to fetch
+    the following page, or None if this is the last page.
+    """
+
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Encode a list of sort key values as an opaque, URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')) \
+        .decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a token created by `encode_cursor`. Returns None if the token is
+    malformed so that a tampered URL simply starts from the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = str(cursor) + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    return values
+
+
+# Databases that sort NULLs before every value in ascending order. The
+# others, like Postgres, sort them after every value.
+NULLS_FIRST_DIALECTS = ('sqlite', 'mysql', 'mssql')
+
+
+def nulls_first(bind):
+    """Whether NULLs come first when `bind` sorts in ascending order."""
+    return bind.dialect.name in NULLS_FIRST_DIALECTS
+
+
+def _nullable(column):
+    return getattr(getattr(column, 'expression', column), 'nullable', True)
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=50,
+                    descending=False):
+    """
+    Paginate `query` ordered by (`sort_column`, `id_column`) without using
+    OFFSET. Rows after the cursor are found by comparing against the last
+    row of the previous page, so with an index on (`sort_column`, `id`) every
+    page costs the same as the first one.
+
+    NULLs in a nullable `sort_column` are left where the database sorts
+    them (see `nulls_first`), so that the index still serves the order. A
+    page that runs from the values into the NULLs, or the other way round,
+    is fetched with one query for each.
+    """
+    order = [c.desc() if descending else c.asc()
+             for c in (sort_column, id_column)]
+    values = decode_cursor(cursor)
+    if values is None:
+        segments = [None]
+    else:
+        last_value, last_id = values
+        after_id = id_column < last_id if descending else id_column > last_id
+        # Whether the NULLs come before the values in the order of pages
+        leading = nulls_first(query.session.connection()) != descending
+        if last_value is None:
+            # The previous page ended in the NULLs
+            segments = [and_(sort_column.is_(None), after_id)]
+            if leading:
+                segments.append(sort_column.isnot(None))
+        else:
+            if descending:
+                seek = and_(sort_column <= last_value,
+                            or_(sort_column < last_value, after_id))
+            else:
+                seek = and_(sort_column >= last_value,
+                            or_(sort_column > last_value, after_id))
+            segments = [seek]
+            if not leading and _nullable(sort_column):
+                segments.append(sort_column.is_(None))
+
+    # Fetch one extra row to find out whether there is a next page
+    rows = []
+    for criteria in segments:
+        segment = query if criteria is None else query.filter(criteria)
+        rows.extend(segment.order_by(*order)
+                    .limit(per_page + 1 - len(rows)).all())
+        if len(rows) > per_page:
+            break
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, sort_column.key),
+                                     getattr(last, id_column.key)])
+    return KeysetPage(rows, next_cursor, per_page)
+
+
+def contains_pattern(text):
+    """
+    Build a LIKE pattern matching `text` anywhere in a column. LIKE wildcards
+    in `text` are escaped with a backslash, so pass escape='\\' to `like`.
+    """
+    for char in ('\\', '%', '_'):
+        text = text.replace(char, '\\' + char)
+    return '%' + text + '%'
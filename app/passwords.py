@@ -0,0 +1,184 @@
+"""
+Password hashing off the request workers.
+
+Hashing and checking passwords is deliberately slow, so when many people log
+in at once the web workers would spend all their time in PBKDF2 while page
+views queue behind them. `password_hasher` does the work in a small pool of
+processes instead (`PASSWORD_HASH_PROCESSES`, or in the calling thread when
+that is 0) and gives up after `PASSWORD_HASH_TIMEOUT` seconds, or at once
+when `PASSWORD_HASH_MAX_PENDING` operations are already waiting.
+
+New hashes use `PASSWORD_HASH_METHOD`. Hashes made with another method are
+replaced the next time their user logs in, so the cost can be raised or
+lowered without resetting passwords.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+
+from werkzeug.security import (
+    generate_password_hash,
+    check_password_hash,
+    DEFAULT_PBKDF2_ITERATIONS
+)
+
+
+class PasswordHashTimeout(Exception):
+    """Raised when the pool is too busy to hash a password in time."""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def _call(func, *args):
+    """
+    Call `func` in a pool process. Errors are returned rather than raised,
+    as the pool only calls back for results.
+    """
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, e
+
+
+def _normalize(method):
+    """The method as werkzeug writes it in the hashes it makes."""
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return '%s:%d' % (method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+class PasswordHasher(object):
+    """Hashes and checks passwords and keeps timing metrics."""
+
+    def __init__(self, method='pbkdf2:sha256', processes=0, timeout=5,
+                 max_pending=32, samples=1000):
+        self.method = _normalize(method)
+        self.processes = processes
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._pool = None
+        self._pool_pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=samples)
+        self.metrics = dict(hashes=0, verifications=0, rehashes=0,
+                            timeouts=0, rejected=0)
+
+    def init_app(self, app):
+        self.method = _normalize(app.config['PASSWORD_HASH_METHOD'])
+        self.processes = app.config['PASSWORD_HASH_PROCESSES']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self.close()
+        with self._lock:
+            self._durations.clear()
+            for key in self.metrics:
+                self.metrics[key] = 0
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.terminate()
+            self._pool = None
+            self._pending = 0
+
+    def _get_pool(self):
+        # A pool inherited from the process this one was forked from (such
+        # as the gunicorn master) cannot be used, so each process starts its
+        # own when it first needs one
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = multiprocessing.Pool(self.processes)
+            self._pool_pid = os.getpid()
+            self._pending = 0
+        return self._pool
+
+    def _done(self, _=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, func, *args):
+        start = time.time()
+        if not self.processes:
+            result = func(*args)
+        else:
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    self.metrics['rejected'] += 1
+                    raise PasswordHashTimeout('Too many passwords waiting '
+                                              'to be hashed')
+                pool = self._get_pool()
+                self._pending += 1
+            # The callback frees the slot however the call ends, even when
+            # nobody is waiting for it any more
+            async_result = pool.apply_async(_call, (func,) + args,
+                                            callback=self._done)
+            try:
+                ok, result = async_result.get(self.timeout)
+            except multiprocessing.TimeoutError:
+                with self._lock:
+                    self.metrics['timeouts'] += 1
+                raise PasswordHashTimeout('Password hashing took more than '
+                                          '%s seconds' % self.timeout)
+            except Exception:
+                # The result could not be sent back, so there was no callback
+                self._done()
+                raise
+            if not ok:
+                raise result
+        with self._lock:
+            self._durations.append(time.time() - start)
+        return result
+
+    def hash(self, password):
+        """Hash `password` with the configured method."""
+        result = self._run(_hash, password, self.method)
+        self._count('hashes')
+        return result
+
+    def verify(self, pwhash, password):
+        """Check `password` against `pwhash`."""
+        if not pwhash:
+            return False
+        result = self._run(_verify, pwhash, password)
+        self._count('verifications')
+        return result
+
+    def needs_rehash(self, pwhash):
+        """Whether `pwhash` was made with a method other than the current."""
+        return bool(pwhash) and pwhash.split('$', 1)[0] != self.method
+
+    def _count(self, key):
+        with self._lock:
+            self.metrics[key] += 1
+
+    def count_rehash(self):
+        self._count('rehashes')
+
+    def stats(self):
+        """Counters and timings (in seconds, including time spent waiting)."""
+        with self._lock:
+            stats = dict(self.metrics)
+            durations = sorted(self._durations)
+            stats.update(method=self.method, processes=self.processes,
+                         pending=self._pending)
+        if durations:
+            def percentile(p):
+                return durations[min(len(durations) - 1,
+                                     int(p / 100.0 * len(durations)))]
+            stats.update(mean=sum(durations) / len(durations),
+                         p50=percentile(50),
+                         p95=percentile(95),
+                         p99=percentile(99),
+                         max=durations[-1])
+        return stats
+
+
+password_hasher = PasswordHasher()
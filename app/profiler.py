@@ -0,0 +1,175 @@
+"""
+On-demand profiling of live requests.
+
+With `PROFILER_ENABLED` set, a random fraction `PROFILER_SAMPLE_RATE` of
+requests is run under cProfile, as is any request an administrator makes
+with `_profile=1` in its query string (its response then has an `X-Profile`
+header naming the profile). Each profile is saved to `PROFILER_DIR` with a
+description of the request and, with `PROFILER_ALLOCATIONS`, the types of
+the objects it left behind. Only the newest `PROFILER_MAX_PROFILES` are
+kept. They are browsed and downloaded at /admin/profiles.
+
+When profiling is disabled no request hooks are registered, so it costs
+nothing.
+"""
+import cProfile
+import gc
+import glob
+import json
+import os
+import pstats
+import random
+import re
+import resource
+import time
+from collections import Counter
+from datetime import datetime
+from StringIO import StringIO
+
+from flask import g, request
+from flask.ext.login import current_user
+from .models import Permission
+
+_name_re = re.compile(r'^\d{20}-\d+$')
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+def _object_counts():
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+
+def _peak_memory():
+    """Peak resident memory of this process in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Profiler(object):
+    def __init__(self):
+        self.directory = None
+        self.sample_rate = 0
+        self.max_profiles = 50
+        self.allocations = True
+        self._random = random.Random()
+
+    def init_app(self, app):
+        self.directory = app.config['PROFILER_DIR']
+        self.sample_rate = app.config['PROFILER_SAMPLE_RATE']
+        self.max_profiles = app.config['PROFILER_MAX_PROFILES']
+        self.allocations = app.config['PROFILER_ALLOCATIONS']
+        if not app.config['PROFILER_ENABLED']:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+
+    def _start_request(self):
+        requested = request.args.get('_profile') == '1' and \
+            current_user.can(Permission.ADMINISTER)
+        if not requested and not (self.sample_rate and
+                                  self._random.random() < self.sample_rate):
+            return
+        state = dict(requested=requested, start=time.time(),
+                     peak_memory=_peak_memory())
+        if self.allocations:
+            state['objects'] = _object_counts()
+        state['profile'] = cProfile.Profile()
+        g.profile = state
+        state['profile'].enable()
+
+    def _finish_request(self, response):
+        state = getattr(g, 'profile', None)
+        if state is None:
+            return response
+        state['profile'].disable()
+        del g.profile
+        name = self.save(state, response.status_code)
+        if state['requested']:
+            response.headers['X-Profile'] = name
+        return response
+
+    def _teardown_request(self, exception=None):
+        # The response to an unhandled exception skips after_request
+        state = getattr(g, 'profile', None)
+        if state is not None:
+            state['profile'].disable()
+            del g.profile
+            self.save(state, 500)
+
+    def path(self, name, extension):
+        return os.path.join(self.directory, name + extension)
+
+    def save(self, state, status):
+        """Save the profile of the current request and return its name."""
+        duration = time.time() - state['start']
+        now = datetime.utcnow()
+        name = '%s-%d' % (now.strftime('%Y%m%d%H%M%S%f'), os.getpid())
+        description = dict(
+            name=name,
+            started_at=now.isoformat(),
+            method=request.method,
+            path=request.path,
+            query=request.query_string,
+            endpoint=request.endpoint,
+            status=status,
+            duration=duration,
+            requested=state['requested'],
+            peak_memory_growth_kb=_peak_memory() - state['peak_memory'])
+        if 'objects' in state:
+            growth = _object_counts()
+            growth.subtract(state['objects'])
+            description['allocations'] = [
+                (kind, count) for kind, count in growth.most_common(20)
+                if count > 0]
+        state['profile'].dump_stats(self.path(name, '.prof'))
+        with open(self.path(name, '.json'), 'w') as f:
+            json.dump(description, f)
+        self._prune()
+        return name
+
+    def _prune(self):
+        """Delete all but the newest `max_profiles` profiles."""
+        names = self._names()
+        for name in names[:-self.max_profiles or None]:
+            for extension in ('.json', '.prof'):
+                try:
+                    os.remove(self.path(name, extension))
+                except OSError:
+                    pass  # Already deleted by another worker
+
+    def _names(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.basename(path)[:-len('.json')] for path in
+                      glob.glob(os.path.join(self.directory, '*.json')))
+
+    def profiles(self):
+        """Descriptions of the saved profiles, newest first."""
+        descriptions = []
+        for name in reversed(self._names()):
+            description = self.get(name)
+            if description is not None:
+                descriptions.append(description)
+        return descriptions
+
+    def get(self, name):
+        """The description of a saved profile, or None."""
+        if not _name_re.match(name):
+            return None
+        try:
+            with open(self.path(name, '.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def report(self, name, sort='cumulative', limit=60):
+        """The functions of a saved profile as printed by pstats."""
+        stream = StringIO()
+        stats = pstats.Stats(self.path(name, '.prof'), stream=stream)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+profiler = Profiler()
@@ -0,0 +1,290 @@
+"""
+Full-text search over member profiles.
+
+Each user has one document in the `user_search` index built from their name,
+hometown, bio and the names and descriptions of their tags. On SQLite this
+is an FTS5 virtual table keyed by the user's id; on Postgres it is a
+`tsvector` column with a GIN index. Neither is a model, so the index is
+created by a migration, or by `create_index` for a database made with
+`db.create_all()`, and dropped by `drop_index` before `db.drop_all()`.
+
+The index is kept up to date from SQLAlchemy session events, so any flush
+that changes a searchable field of a user or tag (or a user's tags)
+reindexes the affected users in the same transaction. Code that writes with
+Core statements instead of the ORM (such as bulk imports) should call
+`index_users` itself.
+"""
+import re
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from . import db
+from .models import User, Tag, user_tag_association_table
+
+SEARCH_TABLE = 'user_search'
+
+# Relative weight of each part of the document when ranking results.
+# Postgres requires weights between 0 and 1.
+NAME_WEIGHT = 1.0
+TAGS_WEIGHT = 0.5
+HOMETOWN_WEIGHT = 0.2
+BIO_WEIGHT = 0.1
+
+USER_FIELDS = ('first_name', 'last_name', 'hometown', 'bio', 'tags')
+TAG_FIELDS = ('name', 'description')
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(bind):
+    return bind.dialect.name in ('sqlite', 'postgresql')
+
+
+def create_index(connection=None):
+    """Create the search index, after the tables it refers to."""
+    connection = connection or db.engine
+    if connection.dialect.name == 'sqlite':
+        connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+            "name, tags, hometown, bio, "
+            "tokenize='unicode61 remove_diacritics 2')"
+            .format(table=SEARCH_TABLE))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS {table} ("
+            "user_id INTEGER PRIMARY KEY "
+            "REFERENCES users (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)".format(table=SEARCH_TABLE))
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_{table}_document "
+            "ON {table} USING GIN (document)".format(table=SEARCH_TABLE))
+
+
+def drop_index(connection=None):
+    """Drop the search index, before the tables it refers to."""
+    connection = connection or db.engine
+    if is_supported(connection):
+        connection.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+
+def _documents(connection, user_ids):
+    """Build the text of the search document for each of the given users."""
+    users = User.__table__.c
+    rows = connection.execute(
+        select([users.id, users.first_name, users.last_name,
+                users.hometown, users.bio])
+        .where(users.id.in_(user_ids)))
+    documents = dict((row.id, {
+        'name': ' '.join(n for n in (row.first_name, row.last_name) if n),
+        'hometown': row.hometown or '',
+        'bio': row.bio or '',
+        'tags': []
+    }) for row in rows)
+
+    tags = Tag.__table__.c
+    assoc = user_tag_association_table.c
+    rows = connection.execute(
+        select([assoc.user_id, tags.name, tags.description])
+        .select_from(user_tag_association_table.join(
+            Tag.__table__, tags.id == assoc.tag_id))
+        .where(assoc.user_id.in_(user_ids)))
+    for row in rows:
+        if row.user_id in documents:
+            documents[row.user_id]['tags'].extend(
+                t for t in (row.name, row.description) if t)
+
+    for document in documents.values():
+        document['tags'] = ' '.join(document['tags'])
+    return documents
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def remove_users(user_ids, connection=None):
+    """Remove the given users from the search index."""
+    connection = connection or db.session.connection()
+    if not is_supported(connection):
+        return
+    key = 'rowid' if connection.dialect.name == 'sqlite' else 'user_id'
+    for chunk in _chunks(set(user_ids)):
+        connection.execute(
+            text('DELETE FROM {table} WHERE {key} IN ({ids})'.format(
+                table=SEARCH_TABLE, key=key,
+                ids=', '.join(str(int(i)) for i in chunk))))
+
+
+def index_users(user_ids, connection=None):
+    """(Re)build the search documents of the given users."""
+    connection = connection or db.session.connection()
+    if not is_supported(connection):
+        return
+    for chunk in _chunks(set(user_ids)):
+        remove_users(chunk, connection)
+        documents = _documents(connection, chunk)
+        if not documents:
+            continue
+        params = [dict(document, id=user_id)
+                  for user_id, document in documents.items()]
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text(
+                'INSERT INTO {table} (rowid, name, tags, hometown, bio) '
+                'VALUES (:id, :name, :tags, :hometown, :bio)'
+                .format(table=SEARCH_TABLE)), params)
+        else:
+            connection.execute(text(
+                "INSERT INTO {table} (user_id, document) VALUES (:id, "
+                "setweight(to_tsvector('english', :name), 'A') || "
+                "setweight(to_tsvector('english', :tags), 'B') || "
+                "setweight(to_tsvector('english', :hometown), 'C') || "
+                "setweight(to_tsvector('english', :bio), 'D'))"
+                .format(table=SEARCH_TABLE)), params)
+
+
+def rebuild_index(chunk_size=1000):
+    """Reindex every user. Used after creating the index on existing data."""
+    connection = db.session.connection()
+    if not is_supported(connection):
+        return
+    connection.execute('DELETE FROM {}'.format(SEARCH_TABLE))
+    last_id = 0
+    while True:
+        ids = [row.id for row in connection.execute(
+            select([User.__table__.c.id])
+            .where(User.__table__.c.id > last_id)
+            .order_by(User.__table__.c.id)
+            .limit(chunk_size))]
+        if not ids:
+            break
+        index_users(ids, connection)
+        last_id = ids[-1]
+    db.session.commit()
+
+
+def _members_of(connection, tag_ids):
+    assoc = user_tag_association_table.c
+    return set(row.user_id for row in connection.execute(
+        select([assoc.user_id]).where(assoc.tag_id.in_(tag_ids))))
+
+
+def _has_changes(obj, fields):
+    return any(get_history(obj, field).has_changes() for field in fields)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    """Work out which users need reindexing once this flush is done."""
+    pending = session.info.setdefault('search_pending', set())
+    removed = session.info.setdefault('search_removed', set())
+
+    changed_tags = set()
+    for obj in session.new:
+        if isinstance(obj, Tag):
+            pending.update(u.id for u in obj.users if u.id is not None)
+    for obj in session.dirty:
+        if isinstance(obj, User) and _has_changes(obj, USER_FIELDS):
+            pending.add(obj.id)
+        elif isinstance(obj, Tag):
+            if _has_changes(obj, TAG_FIELDS) and obj.id is not None:
+                changed_tags.add(obj.id)
+            history = get_history(obj, 'users')
+            pending.update(u.id for u in history.added + history.deleted
+                           if u.id is not None)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            removed.add(obj.id)
+        elif isinstance(obj, Tag):
+            changed_tags.add(obj.id)
+
+    # Members of deleted tags must be looked up before the association rows
+    # are removed by the flush
+    if changed_tags:
+        pending.update(_members_of(session.connection(), changed_tags))
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_changes(session, flush_context):
+    pending = session.info.pop('search_pending', set())
+    removed = session.info.pop('search_removed', set())
+    # Users inserted by this flush only have an id now
+    pending.update(obj.id for obj in session.new if isinstance(obj, User))
+    pending.discard(None)
+    removed.discard(None)
+    pending -= removed
+    if not pending and not removed:
+        return
+    connection = session.connection()
+    if removed:
+        remove_users(removed, connection)
+    if pending:
+        index_users(pending, connection)
+
+
+def _terms(query):
+    return [w.lower() for w in _word_re.findall(query)]
+
+
+def search_users(query, page=1, per_page=20):
+    """
+    Search the member directory. Returns a tuple of the users on the given
+    page in ranked order and whether there is another page after it. Every
+    word in `query` must match, and the last word matches as a prefix so
+    partially typed names find results.
+    """
+    terms = _terms(query)
+    if not terms:
+        return [], False
+    connection = db.session.connection()
+    offset = (max(page, 1) - 1) * per_page
+    params = {'limit': per_page + 1, 'offset': offset}
+
+    if connection.dialect.name == 'sqlite':
+        params['query'] = u' '.join(u'"{}"'.format(t) for t in terms) + u'*'
+        sql = ('SELECT rowid AS user_id FROM {table} '
+               'WHERE {table} MATCH :query '
+               'ORDER BY bm25({table}, {name}, {tags}, {hometown}, {bio}), '
+               'rowid LIMIT :limit OFFSET :offset')
+    elif connection.dialect.name == 'postgresql':
+        params['query'] = u' & '.join(terms) + u':*'
+        # ts_rank takes weights in D, C, B, A order
+        sql = ("SELECT user_id FROM {table}, "
+               "to_tsquery('english', :query) query "
+               "WHERE document @@ query "
+               "ORDER BY ts_rank('{weights}', document, query) DESC, "
+               "user_id "
+               "LIMIT :limit OFFSET :offset")
+    else:
+        return _search_users_fallback(terms, offset, per_page)
+
+    weights = (NAME_WEIGHT, TAGS_WEIGHT, HOMETOWN_WEIGHT, BIO_WEIGHT)
+    sql = sql.format(
+        table=SEARCH_TABLE,
+        name=NAME_WEIGHT, tags=TAGS_WEIGHT,
+        hometown=HOMETOWN_WEIGHT, bio=BIO_WEIGHT,
+        weights='{%s}' % ', '.join(str(w) for w in reversed(weights)))
+    ids = [row.user_id for row in connection.execute(text(sql), params)]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if not ids:
+        return [], False
+    users = dict((u.id, u) for u in User.query.filter(User.id.in_(ids)))
+    return [users[i] for i in ids if i in users], has_next
+
+
+def _search_users_fallback(terms, offset, per_page):
+    """Unranked name matching for databases without full-text search."""
+    from .pagination import contains_pattern
+
+    query = User.query
+    for term in terms:
+        pattern = contains_pattern(term)
+        query = query.filter(db.or_(User.first_name.ilike(pattern, '\\'),
+                                    User.last_name.ilike(pattern, '\\')))
+    users = query.order_by(User.last_name, User.id) \
+        .offset(offset).limit(per_page + 1).all()
+    return users[:per_page], len(users) > per_page
@@ -0,0 +1,223 @@
+"""
+SQL instrumentation.
+
+Every statement sent to the database is timed. Statements slower than
+`SQL_SLOW_QUERY_THRESHOLD` seconds are always logged. With `SQL_STATS_LOG`
+or `SQL_STATS_HEADERS` set (the default in development), the statements of
+each request are also collected: the number of statements, the time spent
+in the database and the statements run the most often are logged and sent
+as `X-SQL-*` response headers, and a statement run at least
+`SQL_REPEAT_THRESHOLD` times in one request is reported as a likely N+1
+query.
+
+`collect_queries` and `query_budget` collect the statements run in a block
+of code, for tests that check how many queries a page needs. Other code can
+register its own collector, any object with an `add(statement, duration)`
+method, with `start_collecting` and `stop_collecting`.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def _logger():
+    return current_app.logger if has_app_context() else \
+        logging.getLogger(__name__)
+
+
+# Lists of bound parameters, as in `IN (?, ?, ?)`, whose length varies
+_parameter_list_re = re.compile(
+    r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))+\s*\)')
+
+_local = threading.local()
+
+
+def statement_shape(statement):
+    """The statement with lists of parameters collapsed to `(...)`."""
+    return _parameter_list_re.sub('(...)', ' '.join(statement.split()))
+
+
+class QueryTimer(object):
+    """The number of statements run while collecting, and their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+
+
+class QueryStats(object):
+    """The statements run while collecting, with their durations."""
+
+    def __init__(self, slowest=5):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.slowest = []
+        self._slowest_size = slowest
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+        entry = (duration, statement)
+        if len(self.slowest) < self._slowest_size:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def repeated(self, threshold=2):
+        """`(count, shape)` of statements run at least `threshold` times."""
+        return sorted(((count, shape) for shape, count in self.shapes.items()
+                       if count >= threshold), reverse=True)
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+    def __repr__(self):
+        return '<QueryStats %d queries in %.1f ms>' % (self.count,
+                                                       self.duration * 1000)
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def start_collecting(collector):
+    """Pass the statements run by this thread to `collector`."""
+    _collectors().append(collector)
+
+
+def stop_collecting(collector):
+    collectors = _collectors()
+    if collector in collectors:
+        collectors.remove(collector)
+
+
+@contextmanager
+def collect_queries():
+    """Collect the statements run by this thread within the block."""
+    stats = QueryStats()
+    start_collecting(stats)
+    try:
+        yield stats
+    finally:
+        stop_collecting(stats)
+
+
+@contextmanager
+def query_budget(maximum):
+    """
+    Fail with an AssertionError listing the statements if more than
+    `maximum` are run within the block. For use in tests:
+
+        with query_budget(4):
+            self.client.get('/admin/tags')
+    """
+    with collect_queries() as stats:
+        yield stats
+    if stats.count > maximum:
+        raise AssertionError(
+            '%d queries run, the budget is %d:\n%s' % (
+                stats.count, maximum,
+                '\n'.join('%4d x %s' % (count, shape)
+                          for count, shape in stats.repeated(1))))
+
+
+class SQLStats(object):
+    def __init__(self):
+        self.slow_query_threshold = None
+        self.repeat_threshold = 5
+        self.headers = False
+        self.log = False
+
+    def init_app(self, app):
+        self.slow_query_threshold = app.config['SQL_SLOW_QUERY_THRESHOLD']
+        self.repeat_threshold = app.config['SQL_REPEAT_THRESHOLD']
+        self.headers = app.config['SQL_STATS_HEADERS']
+        self.log = app.config['SQL_STATS_LOG']
+        if self.headers or self.log:
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+            app.teardown_request(self._teardown_request)
+
+    def _start_request(self):
+        g.sql_stats = QueryStats()
+        start_collecting(g.sql_stats)
+
+    def _teardown_request(self, exception=None):
+        stats = getattr(g, 'sql_stats', None)
+        if stats is not None:
+            stop_collecting(stats)
+
+    def _finish_request(self, response):
+        stats = getattr(g, 'sql_stats', None)
+        if stats is None:
+            return response
+        self._teardown_request()
+        repeated = stats.repeated(self.repeat_threshold)
+        if self.headers:
+            response.headers['X-SQL-Queries'] = str(stats.count)
+            response.headers['X-SQL-Time'] = '%.1f' % (stats.duration * 1000)
+            response.headers['X-SQL-Repeated'] = str(
+                max(stats.shapes.values()) if stats.shapes else 0)
+        if self.log:
+            current_app.logger.info('%s %s: %d queries in %.1f ms',
+                                    request.method, request.path,
+                                    stats.count, stats.duration * 1000)
+            for duration, statement in stats.slowest_statements()[:1]:
+                current_app.logger.info('Slowest query (%.1f ms): %s',
+                                        duration * 1000,
+                                        ' '.join(statement.split()))
+            for count, shape in repeated:
+                current_app.logger.warning(
+                    'Possible N+1 query in %s %s, run %d times: %s',
+                    request.method, request.path, count, shape)
+        return response
+
+    def record(self, statement, duration):
+        for stats in _collectors():
+            stats.add(statement, duration)
+        if self.slow_query_threshold is not None and \
+                duration >= self.slow_query_threshold:
+            _logger().warning('Slow query (%.1f ms): %s', duration * 1000,
+                              ' '.join(statement.split()))
+
+
+sql_stats = SQLStats()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('sql_stats_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('sql_stats_start')
+    if starts:
+        sql_stats.record(statement, time.time() - starts.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # A failed statement has no after_cursor_execute event
+    starts = context.connection.info.get('sql_stats_start') \
+        if context.connection is not None else None
+    if starts:
+        starts.pop()
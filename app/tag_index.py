@@ -0,0 +1,423 @@
+"""
+In-memory inverted index from tags to the users that have them.
+
+Each tag's members are kept in a `Bitmap`, a compressed integer set in the
+style of Roaring bitmaps: ids are split into 2^16-wide chunks, and each chunk
+is stored either as a sorted array (when it has few members) or as a plain
+bit set (when it is dense). Intersections and unions work chunk by chunk, so
+"members with tags A AND B" costs about as much as the smaller of the two
+tags rather than a multi-way self-join of the association table.
+
+The index is built lazily from `user_tag_association_table` once per worker
+and then kept up to date from SQLAlchemy session events: membership changes
+are collected while flushing and applied when the transaction commits.
+Changes committed by other processes are picked up when the index is rebuilt
+after `TAG_INDEX_MAX_AGE` seconds. Other code can follow committed membership
+changes through the `memberships_committed` signal.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from blinker import Namespace
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from . import db
+from .models import User, Tag, user_tag_association_table
+
+_signals = Namespace()
+
+# Sent by the committed session with the `added` and `removed` (user_id,
+# tag_id) memberships and the `deleted_tags` and `deleted_users` ids
+memberships_committed = _signals.signal('memberships-committed')
+
+# Chunks with more members than this are stored as bit sets instead of
+# arrays. At 4096 members both take 8KB.
+ARRAY_MAX = 4096
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _iter_bits(bits, start=0):
+    """Yield the positions of the set bits of `bits` at or after `start`."""
+    bits >>= start
+    position = start
+    # Scan a hexadecimal digit at a time, which is much cheaper than
+    # isolating each bit with big integer arithmetic
+    for digit in reversed('%x' % bits if bits else ''):
+        nibble = int(digit, 16)
+        if nibble:
+            for offset in range(4):
+                if nibble & (1 << offset):
+                    yield position + offset
+        position += 4
+
+
+class Bitmap(object):
+    """A compressed set of non-negative integers."""
+
+    def __init__(self, values=()):
+        # Maps the high 16 bits of a value to a container for the low 16
+        # bits, either a sorted array('H') or an int used as a bit set
+        self._chunks = {}
+        # Chunks are filled as arrays and converted once at the end, since
+        # adding to a bit set copies the whole int
+        high, chunk = None, None
+        for value in sorted(set(values)):
+            if value >> 16 != high:
+                high = value >> 16
+                chunk = self._chunks[high] = array('H')
+            chunk.append(value & 0xffff)
+        for high, chunk in self._chunks.items():
+            self._chunks[high] = self._normalize(chunk)
+
+    @classmethod
+    def _from_chunks(cls, chunks):
+        bitmap = cls()
+        # Both empty arrays and empty bit sets are falsy
+        bitmap._chunks = dict((k, c) for k, c in chunks.items() if c)
+        return bitmap
+
+    @staticmethod
+    def _to_bits(container):
+        if isinstance(container, array):
+            bits = 0
+            for low in container:
+                bits |= 1 << low
+            return bits
+        return container
+
+    @staticmethod
+    def _normalize(container):
+        """Pick the cheapest representation for the members of a chunk."""
+        if isinstance(container, array):
+            if len(container) > ARRAY_MAX:
+                return Bitmap._to_bits(container)
+            return container
+        if _popcount(container) <= ARRAY_MAX:
+            return array('H', _iter_bits(container))
+        return container
+
+    def add(self, value):
+        high, low = value >> 16, value & 0xffff
+        container = self._chunks.get(high)
+        if container is None:
+            self._chunks[high] = array('H', [low])
+        elif isinstance(container, array):
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                insort(container, low)
+                self._chunks[high] = self._normalize(container)
+        else:
+            self._chunks[high] = container | (1 << low)
+
+    def discard(self, value):
+        high, low = value >> 16, value & 0xffff
+        container = self._chunks.get(high)
+        if container is None:
+            return
+        if isinstance(container, array):
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+        else:
+            # Counting the bits left on every discard would be expensive, so
+            # a chunk that empties out stays a bit set (at most 8KB)
+            container &= ~(1 << low)
+        if container:
+            self._chunks[high] = container
+        else:
+            del self._chunks[high]
+
+    def __contains__(self, value):
+        container = self._chunks.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xffff
+        if isinstance(container, array):
+            i = bisect_left(container, low)
+            return i < len(container) and container[i] == low
+        return bool(container & (1 << low))
+
+    def __len__(self):
+        return sum(len(c) if isinstance(c, array) else _popcount(c)
+                   for c in self._chunks.values())
+
+    def __nonzero__(self):
+        return bool(self._chunks)
+
+    __bool__ = __nonzero__
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """Iterate in ascending order over the members >= `start`."""
+        start = max(start, 0)
+        for high in sorted(self._chunks):
+            if high < start >> 16:
+                continue
+            base = high << 16
+            first = start - base if high == start >> 16 else 0
+            container = self._chunks[high]
+            if isinstance(container, array):
+                for low in container[bisect_left(container, first):]:
+                    yield base + low
+            else:
+                for low in _iter_bits(container, first):
+                    yield base + low
+
+    def __and__(self, other):
+        chunks = {}
+        for high in set(self._chunks) & set(other._chunks):
+            a, b = self._chunks[high], other._chunks[high]
+            if isinstance(a, array) and isinstance(b, array):
+                if len(a) > len(b):
+                    a, b = b, a
+                chunks[high] = array('H', [low for low in a
+                                           if _array_contains(b, low)])
+            elif isinstance(a, array) or isinstance(b, array):
+                values, bits = (a, b) if isinstance(a, array) else (b, a)
+                chunks[high] = array('H', [low for low in values
+                                           if bits & (1 << low)])
+            else:
+                chunks[high] = self._normalize(a & b)
+        return Bitmap._from_chunks(chunks)
+
+    def __or__(self, other):
+        chunks = self.copy()._chunks
+        for high, b in other._chunks.items():
+            a = chunks.get(high)
+            if a is None:
+                chunks[high] = array('H', b) if isinstance(b, array) else b
+            else:
+                chunks[high] = self._normalize(self._to_bits(a) |
+                                               self._to_bits(b))
+        return Bitmap._from_chunks(chunks)
+
+    def copy(self):
+        # Arrays are mutated in place by add() and discard(), so they must
+        # not be shared between bitmaps. Bit sets are immutable ints.
+        return Bitmap._from_chunks(dict(
+            (k, array('H', c) if isinstance(c, array) else c)
+            for k, c in self._chunks.items()))
+
+
+def _array_contains(values, low):
+    i = bisect_left(values, low)
+    return i < len(values) and values[i] == low
+
+
+class TagIndex(object):
+    """Per-process map from tag id to a `Bitmap` of member user ids."""
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._bitmaps = None
+        self._built_at = None
+        # Changes applied while each running build scans the table, which
+        # are replayed on its result
+        self._logs = []
+        # Bumped by `clear`, so that builds started before are discarded
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.max_age = app.config.get('TAG_INDEX_MAX_AGE', self.max_age)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._bitmaps = None
+            self._built_at = None
+            self._generation += 1
+
+    def _ensure_built(self):
+        with self._lock:
+            missing = self._bitmaps is None
+            # Meanwhile other threads keep using the current index
+            stale = not missing and not self._logs and \
+                time.time() - self._built_at > self.max_age
+        if missing or stale:
+            self.build()
+
+    def build(self):
+        """
+        Load every membership from the association table. The table is read
+        without holding the lock, and changes applied in the meantime are
+        replayed on the result before it replaces the current index.
+        """
+        with self._lock:
+            generation = self._generation
+            log = []
+            self._logs.append(log)
+        try:
+            assoc = user_tag_association_table.c
+            members = {}
+            rows = db.session.execute(
+                select([assoc.tag_id, assoc.user_id])
+                .order_by(assoc.tag_id, assoc.user_id))
+            for tag_id, user_id in rows:
+                ids = members.get(tag_id)
+                if ids is None:
+                    ids = members[tag_id] = array('l')
+                ids.append(user_id)
+            bitmaps = dict((tag_id, Bitmap(ids))
+                           for tag_id, ids in members.items())
+        finally:
+            with self._lock:
+                self._logs.remove(log)
+        with self._lock:
+            if generation != self._generation:
+                return
+            # Replaying changes the snapshot already has is harmless
+            for changes in log:
+                self._apply(bitmaps, **changes)
+            self._bitmaps = bitmaps
+            self._built_at = time.time()
+
+    def members(self, tag_id):
+        """Return a Bitmap of the ids of the users with the given tag."""
+        self._ensure_built()
+        with self._lock:
+            bitmap = self._bitmaps.get(tag_id)
+            return bitmap.copy() if bitmap is not None else Bitmap()
+
+    def query(self, all_of=(), any_of=()):
+        """
+        Return a Bitmap of the users that have every tag in `all_of` and at
+        least one of the tags in `any_of`. Either list may be empty, but not
+        both.
+        """
+        self._ensure_built()
+        with self._lock:
+            empty = Bitmap()
+            result = None
+            # Intersect the smallest tags first to keep intermediate sets small
+            for tag_id in sorted(set(all_of),
+                                 key=lambda t: len(self._bitmaps.get(t,
+                                                                     empty))):
+                bitmap = self._bitmaps.get(tag_id, empty)
+                result = bitmap.copy() if result is None else result & bitmap
+                if not result:
+                    return Bitmap()
+            if any_of:
+                union = Bitmap()
+                for tag_id in set(any_of):
+                    union = union | self._bitmaps.get(tag_id, empty)
+                result = union if result is None else result & union
+            return result if result is not None else Bitmap()
+
+    def apply(self, added=(), removed=(), deleted_tags=(), deleted_users=()):
+        """Apply committed membership changes to the index, if it is built."""
+        changes = dict(added=added, removed=removed,
+                       deleted_tags=deleted_tags, deleted_users=deleted_users)
+        with self._lock:
+            for log in self._logs:
+                log.append(changes)
+            if self._bitmaps is not None:
+                self._apply(self._bitmaps, **changes)
+
+    @staticmethod
+    def _apply(bitmaps, added, removed, deleted_tags, deleted_users):
+        for user_id, tag_id in added:
+            bitmaps.setdefault(tag_id, Bitmap()).add(user_id)
+        for user_id, tag_id in removed:
+            if tag_id in bitmaps:
+                bitmaps[tag_id].discard(user_id)
+        for tag_id in deleted_tags:
+            bitmaps.pop(tag_id, None)
+        if deleted_users:
+            for bitmap in bitmaps.values():
+                for user_id in deleted_users:
+                    bitmap.discard(user_id)
+
+
+tag_index = TagIndex()
+
+
+def page_of(bitmap, after=None, per_page=50):
+    """
+    Return the ids of one page of members of `bitmap` in ascending order,
+    starting after the id `after`, and whether more ids follow.
+    """
+    ids = []
+    for user_id in bitmap.iter_from((after or 0) + 1):
+        if len(ids) == per_page:
+            return ids, True
+        ids.append(user_id)
+    return ids, False
+
+
+def record_changes(session, added=(), removed=()):
+    """
+    Record (user_id, tag_id) memberships added or removed by `session` so
+    that they are applied to the index when it commits. Code that changes
+    the association table with Core statements should call this.
+    """
+    pending = session.info.setdefault('tag_index_pending', {
+        'added': set(), 'removed': set(),
+        'deleted_tags': set(), 'deleted_users': set()})
+    # A later change to the same membership overrides an earlier one
+    added, removed = set(added), set(removed)
+    pending['removed'].difference_update(added)
+    pending['added'].difference_update(removed)
+    pending['added'].update(added)
+    pending['removed'].update(removed)
+    return pending
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    added, removed = set(), set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = get_history(obj, 'tags')
+            added.update((obj, t) for t in history.added)
+            removed.update((obj, t) for t in history.deleted)
+        elif isinstance(obj, Tag):
+            history = get_history(obj, 'users')
+            added.update((u, obj) for u in history.added)
+            removed.update((u, obj) for u in history.deleted)
+    deleted = [obj for obj in session.deleted
+               if isinstance(obj, (User, Tag))]
+    if not (added or removed or deleted):
+        return
+    pending = session.info.setdefault('tag_index_pending', {
+        'added': set(), 'removed': set(),
+        'deleted_tags': set(), 'deleted_users': set()})
+    # Ids of new objects are only known after the flush, so keep the objects
+    # around until then
+    session.info.setdefault('tag_index_objects', []).append((added, removed))
+    for obj in deleted:
+        if isinstance(obj, User):
+            pending['deleted_users'].add(obj.id)
+        else:
+            pending['deleted_tags'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _resolve_ids(session, flush_context):
+    for added, removed in session.info.pop('tag_index_objects', []):
+        record_changes(session,
+                       added=[(u.id, t.id) for u, t in added],
+                       removed=[(u.id, t.id) for u, t in removed])
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop('tag_index_pending', None)
+    if pending is not None:
+        tag_index.apply(**pending)
+        memberships_committed.send(session, **pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('tag_index_pending', None)
+    session.info.pop('tag_index_objects', None)
@@ -0,0 +1,197 @@
+"""
+Per-worker prefix index of tag names, for suggesting tags as users type.
+
+Every word of every tag name starts a key: "Machine Learning" is found both
+by "mac" and by "lea". The keys are kept in a sorted list, so the tags
+matching a prefix are a contiguous run of it found with a binary search.
+Matches are ranked by their number of members, then by name.
+
+The index is built lazily once per worker, then kept up to date from
+SQLAlchemy session events: tags created, renamed or deleted through the ORM
+are applied when their transaction commits, as are the tags inserted by
+`Tag.upsert_many`, and member counts follow the `memberships_committed`
+signal and the deletion of users. Other code that creates tags with Core
+statements should call `record_new_tags`. Changes made by other processes
+are picked up when the index is rebuilt after `TAG_INDEX_MAX_AGE` seconds.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from . import db
+from .models import User, Tag, tags_inserted
+from .tag_index import memberships_committed
+
+
+def _keys(name):
+    """The lower case suffixes of `name` that start at a word."""
+    words = name.lower().split()
+    return set(' '.join(words[i:]) for i in range(len(words)))
+
+
+class TagSuggestions(object):
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._names = None
+        self._counts = None
+        # Sorted (key, tag id) pairs
+        self._keys = None
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.max_age = app.config.get('TAG_INDEX_MAX_AGE', self.max_age)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._names = self._counts = self._keys = None
+            self._built_at = None
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._names is None or \
+                    time.time() - self._built_at > self.max_age:
+                self.build()
+
+    def build(self):
+        """Load every tag name and member count."""
+        names = dict(db.session.query(Tag.id, Tag.name))
+        counts = Tag.user_counts()
+        keys = sorted((key, tag_id) for tag_id, name in names.items()
+                      if name for key in _keys(name))
+        with self._lock:
+            self._names, self._counts, self._keys = names, counts, keys
+            self._built_at = time.time()
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to `limit` (id, name) pairs of the tags with a word that
+        starts with `prefix`, most popular first.
+        """
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        self._ensure_built()
+        with self._lock:
+            matches = set()
+            for i in range(bisect_left(self._keys, (prefix,)),
+                           len(self._keys)):
+                key, tag_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                matches.add(tag_id)
+            ranked = heapq.nsmallest(
+                limit, matches,
+                key=lambda t: (-self._counts.get(t, 0),
+                               self._names[t].lower()))
+            return [(t, self._names[t]) for t in ranked]
+
+    def apply(self, names=None, deleted=(), counts=None):
+        """
+        Apply committed changes, if the index is built: `names` maps the ids
+        of new or renamed tags to their names and `counts` maps tag ids to
+        changes in their member counts.
+        """
+        with self._lock:
+            if self._names is None:
+                return
+            for tag_id in list(deleted) + list(names or ()):
+                old = self._names.pop(tag_id, None)
+                if old:
+                    for key in _keys(old):
+                        i = bisect_left(self._keys, (key, tag_id))
+                        if i < len(self._keys) and \
+                                self._keys[i] == (key, tag_id):
+                            del self._keys[i]
+            for tag_id in deleted:
+                self._counts.pop(tag_id, None)
+            for tag_id, name in (names or {}).items():
+                self._names[tag_id] = name
+                for key in _keys(name or ''):
+                    insort(self._keys, (key, tag_id))
+            for tag_id, change in (counts or {}).items():
+                self._counts[tag_id] = \
+                    max(self._counts.get(tag_id, 0) + change, 0)
+
+
+tag_suggestions = TagSuggestions()
+
+
+def record_new_tags(session, tags):
+    """
+    Record tags created by `session` with Core statements, so that they are
+    added to the index when it commits.
+    """
+    session.info.setdefault('tag_suggestions_pending', {}) \
+        .update((tag.id, tag.name) for tag in tags)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    new = [obj for obj in session.new if isinstance(obj, Tag)]
+    if new:
+        # Ids of new tags are only known after the flush
+        session.info.setdefault('tag_suggestions_new', []).extend(new)
+    renamed = [obj for obj in session.dirty if isinstance(obj, Tag) and
+               get_history(obj, 'name').has_changes()]
+    if renamed:
+        record_new_tags(session, renamed)
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Tag)]
+    if deleted:
+        session.info.setdefault('tag_suggestions_deleted', set()) \
+            .update(deleted)
+    # The memberships of deleted users are removed with them, which the
+    # `memberships_committed` signal does not list, so they are counted
+    # while they are still stored
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            history = get_history(obj, 'tags')
+            counts = session.info.setdefault('tag_suggestions_counts', {})
+            for tag in list(history.unchanged) + list(history.deleted):
+                counts[tag.id] = counts.get(tag.id, 0) - 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _resolve_ids(session, flush_context):
+    new = session.info.pop('tag_suggestions_new', None)
+    if new:
+        record_new_tags(session, new)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    names = session.info.pop('tag_suggestions_pending', None)
+    deleted = session.info.pop('tag_suggestions_deleted', ())
+    counts = session.info.pop('tag_suggestions_counts', None)
+    if names or deleted or counts:
+        tag_suggestions.apply(names=names, deleted=deleted, counts=counts)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    for key in ('tag_suggestions_pending', 'tag_suggestions_new',
+                'tag_suggestions_deleted', 'tag_suggestions_counts'):
+        session.info.pop(key, None)
+
+
+@tags_inserted.connect
+def _tags_inserted(session, tags=()):
+    record_new_tags(session, tags)
+
+
+@memberships_committed.connect
+def _memberships_committed(session, added=(), removed=(), deleted_tags=(),
+                           deleted_users=()):
+    counts = {}
+    for _, tag_id in added:
+        counts[tag_id] = counts.get(tag_id, 0) + 1
+    for _, tag_id in removed:
+        counts[tag_id] = counts.get(tag_id, 0) - 1
+    if counts:
+        tag_suggestions.apply(counts=counts)
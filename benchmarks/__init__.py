@@ -0,0 +1,12 @@
+"""
+Load and latency benchmarks of the main user journeys.
+
+Run them with `python manage.py benchmark`. A dataset of the requested size
+is generated into the benchmark database (`BENCHMARK_DATABASE_URL`, or
+data-benchmark.sqlite by default), then each scenario in `scenarios` sends
+its requests through the Flask test client. Each scenario runs in a process
+of its own and reports its throughput, latency percentiles, SQL queries per
+request and the peak memory of that process. Results are saved as JSON in
+benchmarks/results, and `python manage.py compare_benchmarks` compares two
+runs.
+"""
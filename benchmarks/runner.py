@@ -0,0 +1,212 @@
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import time
+from datetime import datetime
+
+from app import db
+from app.fake_data import generate, FAKE_PASSWORD
+from app.models import User, Tag, Role, UserType, role_registry, \
+    user_type_registry
+from app.search import create_index, drop_index
+from app.sql_stats import collect_queries
+from scenarios import SCENARIOS, Context
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+ADMIN_EMAIL = 'benchmark-admin@example.com'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def peak_memory():
+    """
+    Peak resident memory of this process in kilobytes. A forked process
+    starts from its resident memory at the time of the fork, not from the
+    peak of its parent.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed(users, tags, tags_per_user, seed=0):
+    """Recreate the database with a generated dataset."""
+    drop_index()
+    db.drop_all()
+    db.create_all()
+    create_index()
+    Role.insert_roles()
+    UserType.insert_user_types()
+    User.create_confirmed_admin('Benchmark', 'Admin', ADMIN_EMAIL,
+                                FAKE_PASSWORD)
+    generate(users=users, tags=tags, tags_per_user=tags_per_user, seed=seed)
+
+
+def run_scenario(func, context, iterations, warmup):
+    for _ in range(warmup):
+        func(context)
+        context.iteration += 1
+    latencies = []
+    errors = 0
+    with collect_queries() as queries:
+        start = time.time()
+        for _ in range(iterations):
+            request_start = time.time()
+            response = func(context)
+            latencies.append(time.time() - request_start)
+            if response.status_code >= 400:
+                errors += 1
+            context.iteration += 1
+        elapsed = time.time() - start
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput': iterations / elapsed if elapsed else None,
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'queries_per_request': float(queries.count) / iterations,
+        'query_seconds_per_request': queries.duration / iterations,
+        'peak_memory_kb': peak_memory()
+    }
+
+
+def run_isolated(func, context, iterations, warmup):
+    """
+    Run a scenario like `run_scenario`, but in a forked process, so that its
+    peak memory is not that of the largest scenario run before it. Requests
+    in the child do not change the parent's copy of the context, apart from
+    the iteration count, which is kept going so that what the scenarios
+    create stays unique.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    def child():
+        sender.send((run_scenario(func, context, iterations, warmup),
+                     context.iteration))
+
+    process = multiprocessing.Process(target=child)
+    process.start()
+    sender.close()
+    try:
+        result, context.iteration = receiver.recv()
+    except EOFError:
+        raise RuntimeError('Scenario %s failed' % func.__name__)
+    finally:
+        receiver.close()
+        process.join()
+    return result
+
+
+def isolate_database(app):
+    """
+    Close the pooled connections before forking, as a connection must not be
+    used by two processes. An in-memory SQLite database only exists in its
+    connection, which each child then gets a private copy of.
+    """
+    with app.app_context():
+        if db.engine.url.database not in (None, '', ':memory:'):
+            db.engine.dispose()
+
+
+def run(app, users=1000, tags=None, tags_per_user=5, iterations=100,
+        warmup=5, scenarios=None, reuse=False, output=None, log=None):
+    """
+    Seed a dataset (unless `reuse` is set), run the named `scenarios` (all
+    of them by default) and save the results as JSON. Returns the results.
+    """
+    log = log or (lambda message: None)
+    tags = max(1, users // 10) if tags is None else tags
+    selected = [s for s in SCENARIOS
+                if scenarios is None or s.__name__ in scenarios]
+
+    with app.app_context():
+        if not reuse:
+            log('Seeding %d users and %d tags' % (users, tags))
+            seed(users, tags, tags_per_user)
+        member = User.query.filter(User.email != ADMIN_EMAIL) \
+            .order_by(User.id).first()
+        context = Context(
+            app,
+            random.Random(0),
+            run_id=datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+            admin_email=ADMIN_EMAIL,
+            member_email=member.email,
+            user_ids=[id for id, in db.session.query(User.id)],
+            tag_ids=[id for id, in db.session.query(Tag.id)],
+            role_id=role_registry.find(default=True).id,
+            user_type_id=user_type_registry.all()[0].id)
+        database = db.engine.dialect.name
+        db.session.remove()
+
+    # Requests are run outside of an application context, so that each of
+    # them gets its own, as in production. Each scenario runs in its own
+    # process, so that its peak memory is measured on its own
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.utcnow().isoformat(),
+        'dataset': {'users': len(context.user_ids),
+                    'tags': len(context.tag_ids),
+                    'tags_per_user': tags_per_user},
+        'database': database,
+        'scenarios': {}
+    }
+    for func in selected:
+        log('Running %s' % func.__name__)
+        isolate_database(app)
+        results['scenarios'][func.__name__] = run_isolated(
+            func, context, iterations, warmup)
+
+    if output is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' % (
+            context.run_id, (results['commit'] or 'unknown')[:8]))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    results['output'] = output
+    return results
+
+
+def format_results(results):
+    lines = ['%-18s %10s %9s %9s %9s %9s %11s' % (
+        'scenario', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries',
+        'peak MB')]
+    for name, r in sorted(results['scenarios'].items()):
+        lines.append('%-18s %10.1f %9.1f %9.1f %9.1f %9.1f %11.1f' % (
+            name, r['throughput'] or 0, r['p50'] * 1000, r['p95'] * 1000,
+            r['p99'] * 1000, r['queries_per_request'],
+            r['peak_memory_kb'] / 1024.0))
+    return '\n'.join(lines)
+
+
+def compare(before, after):
+    """Describe the change of each scenario between two saved results."""
+    lines = ['%-18s %12s %12s %12s' % ('scenario', 'req/s', 'p95',
+                                       'queries')]
+    for name in sorted(set(before['scenarios']) & set(after['scenarios'])):
+        b, a = before['scenarios'][name], after['scenarios'][name]
+
+        def change(key):
+            if not b[key]:
+                return 'n/a'
+            return '%+.1f%%' % (100.0 * (a[key] - b[key]) / b[key])
+        lines.append('%-18s %12s %12s %12s' % (
+            name, change('throughput'), change('p95'),
+            change('queries_per_request')))
+    return '\n'.join(lines)
@@ -0,0 +1,89 @@
+"""
+The user journeys that are benchmarked. Each scenario is a function that
+sends the requests of one iteration and returns the last response. It gets
+a `Context` with test clients logged in as an administrator and as a member,
+and a random generator for choosing users and tags.
+"""
+from app.fake_data import FAKE_PASSWORD
+
+SCENARIOS = []
+
+
+def scenario(func):
+    SCENARIOS.append(func)
+    return func
+
+
+class Context(object):
+    def __init__(self, app, rng, run_id, admin_email, member_email, user_ids,
+                 tag_ids, role_id, user_type_id):
+        self.app = app
+        self.rng = rng
+        self.run_id = run_id
+        self.member_email = member_email
+        self.admin = self.login(admin_email)
+        self.member = self.login(member_email)
+        self.user_ids = user_ids
+        self.tag_ids = tag_ids
+        self.role_id = role_id
+        self.user_type_id = user_type_id
+        self.iteration = 0
+
+    def login(self, email, password=FAKE_PASSWORD):
+        client = self.app.test_client()
+        response = client.post('/account/login', data=dict(email=email,
+                                                           password=password))
+        if response.status_code != 302:
+            raise RuntimeError('Could not log in as %s' % email)
+        return client
+
+
+@scenario
+def login(context):
+    client = context.app.test_client()
+    return client.post('/account/login', data=dict(
+        email=context.member_email, password=FAKE_PASSWORD))
+
+
+@scenario
+def profile(context):
+    user_id = context.rng.choice(context.user_ids)
+    return context.member.get('/account/profile/%d' % user_id)
+
+
+@scenario
+def edit_profile(context):
+    tags = context.rng.sample(context.tag_ids, min(3, len(context.tag_ids)))
+    return context.member.post('/account/profile/edit', data=dict(
+        first_name='Bench',
+        last_name='Mark %d' % context.iteration,
+        hometown='Philadelphia, PA',
+        bio='Benchmarking the profile editor.',
+        tags=[str(t) for t in tags]))
+
+
+@scenario
+def registered_users(context):
+    return context.admin.get('/admin/users')
+
+
+@scenario
+def registered_tags(context):
+    return context.admin.get('/admin/tags')
+
+
+@scenario
+def tag_info(context):
+    return context.admin.get('/admin/tag/%d' %
+                             context.rng.choice(context.tag_ids))
+
+
+@scenario
+def invite(context):
+    return context.admin.post('/admin/invite-user', data=dict(
+        role=str(context.role_id),
+        user_type=str(context.user_type_id),
+        first_name='Invited',
+        last_name='Member',
+        email='invite-%s-%d@example.com' % (context.run_id,
+                                            context.iteration)))
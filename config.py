@@ -20,6 +20,110 @@ class Config:
     EMAIL_SENDER = '{app_name} Admin <{email}>'.format(app_name=APP_NAME,
                                                        email=MAIL_USERNAME)
 
+    # Queued emails are sent by this many threads per web worker. Set it to
+    # 0 to send them from `manage.py email_worker` instead, as the Procfile
+    # does, so that only one of them delivers the outbox.
+    EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+    EMAIL_BATCH_SIZE = 50  # messages sent per SMTP connection
+    EMAIL_MAX_ATTEMPTS = 5
+    EMAIL_RETRY_BACKOFF = 30  # seconds, doubled after each failed attempt
+    EMAIL_CLAIM_TIMEOUT = 600  # seconds before a stuck message is retried
+    EMAIL_POLL_INTERVAL = 30
+    MAIL_MAX_EMAILS = 100  # reconnect after this many messages
+
+    # Seconds before the in-memory tag index is rebuilt from the database to
+    # pick up changes made by other workers
+    TAG_INDEX_MAX_AGE = 300
+
+    # Seconds before the in-memory copies of the roles and user types tables
+    # are reloaded to pick up changes made by other workers
+    LOOKUP_TABLE_MAX_AGE = 300
+
+    # Identities of logged in users are cached per worker. Changes made by
+    # other workers (such as revoking a role) take up to the TTL to apply.
+    IDENTITY_CACHE_SIZE = 10000
+    IDENTITY_CACHE_TTL = 60
+
+    # Rendered fragments (profiles, tag information, the navigation bar) are
+    # cached per worker and invalidated when their data changes. Changes made
+    # by other workers take up to the TTL to show.
+    FRAGMENT_CACHE_SIZE = 2000  # fragments
+    FRAGMENT_CACHE_TTL = 60
+    FRAGMENT_CACHE_MAX_ITEM_SIZE = 64 * 1024  # characters
+
+    # Pages answered with 304 Not Modified are rendered again at least this
+    # often, so that the CSRF token they carry has not expired
+    CONDITIONAL_MAX_AGE = 600  # seconds, less than WTF_CSRF_TIME_LIMIT
+
+    # Passwords are hashed and checked by this many processes per web
+    # worker, or by the worker itself when it is 0. Hashes made with a
+    # different method are replaced when their user next logs in.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or \
+        'pbkdf2:sha256:50000'
+    PASSWORD_HASH_PROCESSES = int(os.environ.get('PASSWORD_HASH_PROCESSES', 2))
+    PASSWORD_HASH_TIMEOUT = 5  # seconds, including time spent waiting
+    PASSWORD_HASH_MAX_PENDING = 32  # operations waiting before logins fail
+
+    # Statements slower than this many seconds are logged. A statement run
+    # this many times in one request is reported as a likely N+1 query.
+    SQL_SLOW_QUERY_THRESHOLD = 0.5
+    SQL_REPEAT_THRESHOLD = 5
+    # Log the statements of each request and add X-SQL-* response headers
+    SQL_STATS_LOG = False
+    SQL_STATS_HEADERS = False
+
+    # The read-only JSON API at /api/v1 is open to administrators and to
+    # clients that send the header `Authorization: Bearer <API_TOKEN>`.
+    # Listings streamed as newline-delimited JSON are read from the database
+    # this many rows at a time.
+    API_TOKEN = os.environ.get('API_TOKEN')
+    API_STREAM_BATCH_SIZE = 1000
+
+    # Request metrics are served in the Prometheus text format at
+    # /admin/metrics, to administrators and to scrapers that send the header
+    # `Authorization: Bearer <METRICS_TOKEN>`. Under several workers, set
+    # METRICS_DIR to a directory shared by them (and emptied on startup);
+    # each worker writes its metrics there every METRICS_FLUSH_INTERVAL
+    # seconds.
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+
+    # With PROFILER_ENABLED, this fraction of requests is profiled, as are
+    # requests made by administrators with `_profile=1` in the query string.
+    # The newest PROFILER_MAX_PROFILES profiles are kept in PROFILER_DIR.
+    PROFILER_ENABLED = bool(os.environ.get('PROFILER_ENABLED'))
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    PROFILER_DIR = os.environ.get('PROFILER_DIR') or \
+        os.path.join(basedir, 'profiles')
+    PROFILER_MAX_PROFILES = 50
+    PROFILER_ALLOCATIONS = True  # record the types of objects left behind
+
+    # `manage.py build_assets` compiles the asset bundles into files named
+    # after their content and lists them in ASSET_MANIFEST. Without
+    # ASSETS_AUTO_BUILD, bundles are served from that manifest and never
+    # compiled at runtime.
+    ASSET_MANIFEST = os.path.join(basedir, 'app', 'static',
+                                  'assets-manifest.json')
+    ASSETS_AUTO_BUILD = True
+
+    # Responses of these types are compressed with the encoding the client
+    # prefers, at a lower level for large bodies and while the worker is
+    # handling more than COMPRESS_BUSY_REQUESTS requests. Compressed bodies
+    # up to COMPRESS_CACHE_MAX_BODY bytes are cached by ETag.
+    COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/xml', 'text/plain',
+                          'text/csv', 'text/javascript', 'application/json',
+                          'application/javascript', 'image/svg+xml']
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_LEVEL = 5
+    COMPRESS_BUSY_LEVEL = 1
+    COMPRESS_BR_BUSY_LEVEL = 1
+    COMPRESS_BUSY_REQUESTS = 4
+    COMPRESS_LARGE_SIZE = 1024 * 1024
+    COMPRESS_CACHE_SIZE = 256  # bodies
+    COMPRESS_CACHE_MAX_BODY = 256 * 1024
+
     @staticmethod
     def init_app(app):
         pass
@@ -28,6 +132,9 @@ class Config:
 class DevelopmentConfig(Config):
     DEBUG = True
     ASSETS_DEBUG = True
+    SQL_STATS_LOG = True
+    SQL_STATS_HEADERS = True
+    PROFILER_ENABLED = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
     # SQLALCHEMY_DATABASE_URI = 'postgres://localhost/dev_netter_center'
@@ -40,12 +147,28 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    EMAIL_WORKERS = 0
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_PROCESSES = 0
+
+    MAIL_SERVER = 'smtp.googlemail.com'
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'data-benchmark.sqlite')
+    SQLALCHEMY_RECORD_QUERIES = False
+    # The benchmarks post forms with the test client
+    WTF_CSRF_ENABLED = False
+    # Invitations are queued but not sent
+    EMAIL_WORKERS = 0
 
     MAIL_SERVER = 'smtp.googlemail.com'
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    ASSETS_AUTO_BUILD = False
 
     MAIL_SERVER = 'smtp.sendgrid.net'
 
@@ -89,6 +212,7 @@ class HerokuConfig(ProductionConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'default': DevelopmentConfig
 }
@@ -2,6 +2,7 @@
 import os
 from app import create_app, db
 from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
 from flask.ext.script import Manager, Shell
 from flask.ext.migrate import Migrate, MigrateCommand
 
@@ -42,8 +43,10 @@ def recreate_db():
     Recreates a local database. You probably should not use this on
     production.
     """
+    drop_index()
     db.drop_all()
     db.create_all()
+    create_index()
     db.session.commit()
 
 
@@ -51,14 +54,190 @@ def recreate_db():
                 '--number-fakes',
                 default=10,
                 type=int,
-                help='Number of each model type to create',
+                help='Number of users to create, and of tags unless -t is set',
                 dest='number_fakes')
-def add_fake_data(number_fakes):
+@manager.option('-t',
+                '--tags',
+                default=None,
+                type=int,
+                help='Number of tags to create',
+                dest='tags')
+@manager.option('-m',
+                '--tags-per-user',
+                default=5,
+                type=int,
+                help='Average number of tags of each user',
+                dest='tags_per_user')
+@manager.option('-d',
+                '--distribution',
+                default='zipf',
+                choices=('zipf', 'uniform'),
+                help='How the tags of users are chosen',
+                dest='distribution')
+@manager.option('-e',
+                '--exponent',
+                default=1.0,
+                type=float,
+                help='Exponent of the Zipf distribution',
+                dest='exponent')
+@manager.option('-s',
+                '--seed',
+                default=0,
+                type=int,
+                help='Seed of the random generators',
+                dest='seed')
+@manager.option('-p',
+                '--processes',
+                default=None,
+                type=int,
+                help='Number of generating processes (default: CPU count)',
+                dest='processes')
+def add_fake_data(number_fakes, tags, tags_per_user, distribution, exponent,
+                  seed, processes):
     """
     Adds fake data to the database.
     """
-    User.generate_fake(count=number_fakes)
-    Tag.generate_fake(count=number_fakes)
+    from app.fake_data import generate
+    users, memberships = generate(
+        users=number_fakes,
+        tags=number_fakes if tags is None else tags,
+        tags_per_user=tags_per_user,
+        distribution=distribution,
+        exponent=exponent,
+        seed=seed,
+        processes=processes)
+    print('Created {} users with {} tag memberships'.format(
+        users, memberships))
+
+
+@manager.option('-i',
+                '--poll-interval',
+                default=None,
+                type=float,
+                help='Seconds to wait between checks of an empty outbox',
+                dest='poll_interval')
+def email_worker(poll_interval):
+    """Sends queued emails until interrupted."""
+    from app.email import outbox
+    outbox.run(app, poll_interval)
+
+
+@manager.option('path', help='CSV or TSV file of members')
+@manager.option('-u',
+                '--base-url',
+                default=None,
+                help='Root URL of the site, used in invitation links',
+                dest='base_url')
+@manager.option('--no-invites',
+                action='store_true',
+                default=False,
+                help='Import the members without inviting them',
+                dest='no_invites')
+@manager.option('-c',
+                '--chunk-size',
+                default=1000,
+                type=int,
+                help='Number of rows inserted at a time',
+                dest='chunk_size')
+def import_members(path, base_url, no_invites, chunk_size):
+    """Imports members from a CSV or TSV file and invites them."""
+    from app.importer import import_members
+
+    if not no_invites and not base_url and not app.config.get('SERVER_NAME'):
+        print('Pass --base-url so invitation links can be generated.')
+        return
+    with app.test_request_context(base_url=base_url), open(path, 'rb') as f:
+        result = import_members(f, invite=not no_invites,
+                                chunk_size=chunk_size)
+    for error in result.errors:
+        print(error)
+    print('{} imported, {} already registered, {} invalid'.format(
+        result.created, result.existing, result.invalid))
+
+
+@manager.option('-n',
+                '--users',
+                default=1000,
+                type=int,
+                help='Number of users in the dataset',
+                dest='users')
+@manager.option('-i',
+                '--iterations',
+                default=100,
+                type=int,
+                help='Requests measured per scenario',
+                dest='iterations')
+@manager.option('-s',
+                '--scenario',
+                action='append',
+                default=None,
+                help='Scenario to run (default: all). Can be repeated.',
+                dest='scenarios')
+@manager.option('-r',
+                '--reuse',
+                action='store_true',
+                default=False,
+                help='Use the dataset of the previous run',
+                dest='reuse')
+@manager.option('-o',
+                '--output',
+                default=None,
+                help='File to save the results to',
+                dest='output')
+def benchmark(users, iterations, scenarios, reuse, output):
+    """Benchmarks the main user journeys against a generated dataset."""
+    from benchmarks.runner import run, format_results
+
+    def log(message):
+        print(message)
+    results = run(create_app('benchmark'), users=users,
+                  iterations=iterations, scenarios=scenarios, reuse=reuse,
+                  output=output, log=log)
+    print(format_results(results))
+    print('Results saved to {}'.format(results['output']))
+
+
+@manager.command
+def compare_benchmarks(before, after):
+    """Compares two saved benchmark results."""
+    import json
+    from benchmarks.runner import compare
+
+    with open(before) as b, open(after) as a:
+        print(compare(json.load(b), json.load(a)))
+
+
+@manager.command
+def build_assets():
+    """Compiles the asset bundles into files named after their content."""
+    from app.assets import build_assets
+    for name, path in sorted(build_assets(app).items()):
+        print('{}: {}'.format(name, path))
+
+
+@manager.option('-o',
+                '--output',
+                default='-',
+                help='File to write, or - for standard output',
+                dest='output')
+def export_users(output):
+    """Exports the member directory as CSV."""
+    import sys
+    from app.exporter import export_csv
+    f = sys.stdout if output == '-' else open(output, 'wb')
+    try:
+        for chunk in export_csv():
+            f.write(chunk)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+@manager.command
+def reindex_search():
+    """Rebuilds the member search index from scratch."""
+    from app.search import rebuild_index
+    rebuild_index()
 
 
 @manager.command
@@ -0,0 +1,82 @@
+"""Initial schema
+
+Revision ID: 0a1e7134f650
+Revises: None
+Create Date: 2026-10-18 08:00:00.000000
+
+The tables as they were before the first migration. Databases that already
+have them should be marked as being at this revision with
+`manage.py db stamp 0a1e7134f650` before they are upgraded.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0a1e7134f650'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'roles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=True),
+        sa.Column('index', sa.String(length=64), nullable=True),
+        sa.Column('default', sa.Boolean(), nullable=True),
+        sa.Column('permissions', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_index('ix_roles_default', 'roles', ['default'])
+    op.create_table(
+        'user_types',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('confirmed', sa.Boolean(), nullable=True),
+        sa.Column('admin_check', sa.Boolean(), nullable=True),
+        sa.Column('first_name', sa.String(length=64), nullable=True),
+        sa.Column('last_name', sa.String(length=64), nullable=True),
+        sa.Column('email', sa.String(length=64), nullable=True),
+        sa.Column('password_hash', sa.String(length=128), nullable=True),
+        sa.Column('role_id', sa.Integer(), nullable=True),
+        sa.Column('hometown', sa.String(length=64), nullable=True),
+        sa.Column('bio', sa.Text(), nullable=True),
+        sa.Column('profile_pic', sa.Text(), nullable=True),
+        sa.Column('user_type_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['role_id'], ['roles.id']),
+        sa.ForeignKeyConstraint(['user_type_id'], ['user_types.id']),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_first_name', 'users', ['first_name'])
+    op.create_index('ix_users_last_name', 'users', ['last_name'])
+    op.create_table(
+        'user_tag_association',
+        sa.Column('tag_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']))
+
+
+def downgrade():
+    op.drop_table('user_tag_association')
+    op.drop_index('ix_users_last_name', 'users')
+    op.drop_index('ix_users_first_name', 'users')
+    op.drop_index('ix_users_email', 'users')
+    op.drop_table('users')
+    op.drop_table('tags')
+    op.drop_table('user_types')
+    op.drop_index('ix_roles_default', 'roles')
+    op.drop_table('roles')
@@ -0,0 +1,63 @@
+"""Deduplicate and index user_tag_association
+
+Revision ID: 2d64c8a88371
+Revises: 3b99037812b0
+Create Date: 2026-10-18 08:30:00.000000
+
+The association table had no key and no index, so every lookup of the tags
+of a user or the members of a tag scanned it, and the same membership could
+be stored more than once. The table is rebuilt with one row per membership,
+a (user_id, tag_id) primary key and a (tag_id, user_id) index. Neither
+SQLite nor Postgres can add a primary key to a table in place with the same
+statement, so the rows are copied into a new table.
+
+Databases created with `manage.py recreate_db` already have this schema;
+mark them as up to date with `manage.py db stamp head`.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d64c8a88371'
+down_revision = '3b99037812b0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _create_table(name, keyed):
+    constraints = []
+    if keyed:
+        constraints.append(sa.PrimaryKeyConstraint(
+            'user_id', 'tag_id', name='user_tag_association_pkey'))
+    op.create_table(
+        name,
+        sa.Column('tag_id', sa.Integer(), nullable=not keyed),
+        sa.Column('user_id', sa.Integer(), nullable=not keyed),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'],
+                                name='user_tag_association_tag_id_fkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                name='user_tag_association_user_id_fkey'),
+        *constraints)
+
+
+def _replace_table(keyed):
+    _create_table('user_tag_association_new', keyed)
+    # Memberships missing either side could not be used, and cannot be part
+    # of the primary key
+    op.execute('INSERT INTO user_tag_association_new (tag_id, user_id) '
+               'SELECT DISTINCT tag_id, user_id FROM user_tag_association '
+               'WHERE tag_id IS NOT NULL AND user_id IS NOT NULL')
+    op.drop_table('user_tag_association')
+    op.rename_table('user_tag_association_new', 'user_tag_association')
+
+
+def upgrade():
+    _replace_table(keyed=True)
+    op.create_index('ix_user_tag_association_tag_id_user_id',
+                    'user_tag_association', ['tag_id', 'user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_user_tag_association_tag_id_user_id',
+                  'user_tag_association')
+    _replace_table(keyed=False)
@@ -0,0 +1,67 @@
+"""Add updated_at and version_id to users and tags
+
+Revision ID: 3b99037812b0
+Revises: 6644036fb420
+Create Date: 2026-10-18 08:20:00.000000
+
+`updated_at` is the Last-Modified time of the pages showing a user or tag,
+and `version_id` guards against overwriting concurrent edits. Existing rows
+get the time of the upgrade and version 1. SQLite cannot add a column with
+a non-constant default in place, so the tables are rebuilt there, without
+their indexes, whose names would clash with those of the old table.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b99037812b0'
+down_revision = '6644036fb420'
+
+from alembic import op
+import sqlalchemy as sa
+
+# The indexes of each table before this revision: (name, columns, unique)
+INDEXES = {
+    'users': [('ix_users_email', ['email'], True),
+              ('ix_users_first_name', ['first_name'], False),
+              ('ix_users_last_name', ['last_name'], False),
+              ('ix_users_last_name_id', ['last_name', 'id'], False),
+              ('ix_users_first_name_id', ['first_name', 'id'], False)],
+    'tags': []
+}
+
+
+def _rebuild(table):
+    """Alter `table` in a batch, rebuilding it on SQLite."""
+    if op.get_bind().dialect.name != 'sqlite':
+        return op.batch_alter_table(table)
+    for name, columns, unique in INDEXES[table]:
+        op.drop_index(name, table)
+    return op.batch_alter_table(table, recreate='always')
+
+
+def _restore_indexes(table):
+    if op.get_bind().dialect.name == 'sqlite':
+        for name, columns, unique in INDEXES[table]:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def upgrade():
+    for table in sorted(INDEXES):
+        with _rebuild(table) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(),
+                                          nullable=False,
+                                          server_default=sa.func.now()))
+            batch_op.add_column(sa.Column('version_id', sa.Integer(),
+                                          nullable=False,
+                                          server_default='1'))
+        _restore_indexes(table)
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at'])
+
+
+def downgrade():
+    for table in sorted(INDEXES):
+        op.drop_index('ix_%s_updated_at' % table, table)
+        with _rebuild(table) as batch_op:
+            batch_op.drop_column('version_id')
+            batch_op.drop_column('updated_at')
+        _restore_indexes(table)
@@ -0,0 +1,71 @@
+"""Add the member search index
+
+Revision ID: 3d2f9e253f29
+Revises: b21496687296
+Create Date: 2026-10-18 08:10:00.000000
+
+`user_search` holds one full-text document per user: an FTS5 virtual table
+on SQLite, and a `tsvector` column with a GIN index on Postgres. It is not a
+model, so it is created here rather than from the metadata, and filled with
+the documents of the existing users. Other databases have no index and fall
+back to matching names. `manage.py reindex_search` rebuilds it.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d2f9e253f29'
+down_revision = 'b21496687296'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    # Memberships may be stored more than once until the association table
+    # is keyed, so each tag is looked up once
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE user_search USING fts5("
+                   "name, tags, hometown, bio, "
+                   "tokenize='unicode61 remove_diacritics 2')")
+        op.execute(
+            "INSERT INTO user_search (rowid, name, tags, hometown, bio) "
+            "SELECT users.id, "
+            "trim(coalesce(users.first_name, '') || ' ' || "
+            "coalesce(users.last_name, '')), "
+            "coalesce((SELECT group_concat(trim(coalesce(tags.name, '') || "
+            "' ' || coalesce(tags.description, '')), ' ') "
+            "FROM tags WHERE tags.id IN (SELECT tag_id "
+            "FROM user_tag_association "
+            "WHERE user_tag_association.user_id = users.id)), ''), "
+            "coalesce(users.hometown, ''), coalesce(users.bio, '') "
+            "FROM users")
+    elif dialect == 'postgresql':
+        op.execute("CREATE TABLE user_search ("
+                   "user_id INTEGER PRIMARY KEY "
+                   "REFERENCES users (id) ON DELETE CASCADE, "
+                   "document TSVECTOR NOT NULL)")
+        op.execute("CREATE INDEX ix_user_search_document "
+                   "ON user_search USING GIN (document)")
+        op.execute(
+            "INSERT INTO user_search (user_id, document) "
+            "SELECT id, "
+            "setweight(to_tsvector('english', name), 'A') || "
+            "setweight(to_tsvector('english', tags), 'B') || "
+            "setweight(to_tsvector('english', hometown), 'C') || "
+            "setweight(to_tsvector('english', bio), 'D') "
+            "FROM (SELECT users.id, "
+            "concat_ws(' ', users.first_name, users.last_name) AS name, "
+            "coalesce((SELECT string_agg(concat_ws(' ', tags.name, "
+            "tags.description), ' ') "
+            "FROM tags WHERE tags.id IN (SELECT tag_id "
+            "FROM user_tag_association "
+            "WHERE user_tag_association.user_id = users.id)), '') AS tags, "
+            "coalesce(users.hometown, '') AS hometown, "
+            "coalesce(users.bio, '') AS bio "
+            "FROM users) documents")
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE user_search')
@@ -0,0 +1,47 @@
+"""Add the outbound email queue
+
+Revision ID: 6644036fb420
+Revises: 3d2f9e253f29
+Create Date: 2026-10-18 08:15:00.000000
+
+Emails are stored in `outbound_emails` when they are queued and delivered
+from there by the outbox workers.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6644036fb420'
+down_revision = '3d2f9e253f29'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'outbound_emails',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.Text(), nullable=False),
+        sa.Column('subject', sa.Text(), nullable=False),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('html', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('claim_token', sa.String(length=32), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_outbound_emails_status_next_attempt_at',
+                    'outbound_emails', ['status', 'next_attempt_at'])
+    op.create_index('ix_outbound_emails_claim_token', 'outbound_emails',
+                    ['claim_token'])
+
+
+def downgrade():
+    op.drop_index('ix_outbound_emails_claim_token', 'outbound_emails')
+    op.drop_index('ix_outbound_emails_status_next_attempt_at',
+                  'outbound_emails')
+    op.drop_table('outbound_emails')
@@ -0,0 +1,27 @@
+"""Index users by name and id
+
+Revision ID: b21496687296
+Revises: 0a1e7134f650
+Create Date: 2026-10-18 08:05:00.000000
+
+The registered users listing is paginated with a (name, id) keyset cursor,
+which these indexes serve in order.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b21496687296'
+down_revision = '0a1e7134f650'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_users_last_name_id', 'users', ['last_name', 'id'])
+    op.create_index('ix_users_first_name_id', 'users', ['first_name', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_users_first_name_id', 'users')
+    op.drop_index('ix_users_last_name_id', 'users')
@@ -0,0 +1,117 @@
+import json
+import unittest
+from app import create_app, db
+from app.api import serializers
+from app.models import User, Role, Tag, UserType, role_registry
+from app.search import create_index, drop_index
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['API_TOKEN'] = 'secret'
+        self.app.config['API_STREAM_BATCH_SIZE'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.math = Tag(name='Mathematics')
+        self.poetry = Tag(name='Poetry')
+        names = [('Ada', 'Lovelace', [self.math, self.poetry]),
+                 ('Charles', 'Babbage', [self.math]),
+                 ('George', 'Byron', [self.poetry]),
+                 ('Mary', 'Somerville', [])]
+        for first_name, last_name, tags in names:
+            db.session.add(User(first_name=first_name, last_name=last_name,
+                                email='%s@example.com' % first_name.lower(),
+                                tags=tags))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.headers = {'Authorization': 'Bearer secret'}
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, headers=self.headers, **kwargs)
+        return response.status_code, json.loads(response.data)
+
+    def test_authentication(self):
+        self.assertEqual(self.client.get('/api/v1/users').status_code, 403)
+        response = self.client.get('/api/v1/users', headers={
+            'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('error', json.loads(response.data))
+
+    def test_serializers(self):
+        ada = User.query.filter_by(first_name='Ada').one()
+        item = serializers.users.dump_one(ada, ['id', 'last_name', 'tags'])
+        self.assertEqual(item, {'id': ada.id, 'last_name': 'Lovelace',
+                                'tags': [self.math.id, self.poetry.id]})
+        self.assertTrue(serializers.users.dump_one(
+            ada, ['updated_at'])['updated_at'].endswith('Z'))
+        with self.assertRaises(ValueError):
+            serializers.tags.parse_fields('name,members')
+        role = role_registry.find(name='Administrator')
+        self.assertEqual(serializers.roles.dump_one(role, ['name']),
+                         {'name': 'Administrator'})
+
+    def test_pagination(self):
+        status, page = self.get('/api/v1/users?per_page=3&fields=last_name')
+        self.assertEqual(status, 200)
+        self.assertEqual(page['items'], [{'last_name': 'Babbage'},
+                                         {'last_name': 'Byron'},
+                                         {'last_name': 'Lovelace'}])
+        status, page = self.get(page['next'])
+        self.assertEqual(page['items'], [{'last_name': 'Somerville'}])
+        self.assertIsNone(page['next_cursor'])
+
+    def test_filters(self):
+        status, page = self.get('/api/v1/users?tag=%d&tag=%d&fields=id'
+                                % (self.math.id, self.poetry.id))
+        ada = User.query.filter_by(first_name='Ada').one()
+        self.assertEqual(page['items'], [{'id': ada.id}])
+        role = role_registry.find(default=True)
+        status, page = self.get('/api/v1/users?role=%d&user_type=0'
+                                % role.id)
+        self.assertEqual(page['items'], [])
+
+        status, page = self.get('/api/v1/tags?fields=name,user_count')
+        self.assertEqual(page['items'], [
+            {'name': 'Mathematics', 'user_count': 2},
+            {'name': 'Poetry', 'user_count': 2}])
+        status, tag = self.get('/api/v1/tags/%d' % self.math.id)
+        self.assertEqual(tag['name'], 'Mathematics')
+        self.assertEqual(self.get('/api/v1/tags/0')[0], 404)
+        self.assertEqual(self.get('/api/v1/users?fields=password_hash')[0],
+                         400)
+        self.assertEqual(self.get('/api/v1/users?sort=bio')[0], 400)
+
+    def test_lookup_tables(self):
+        status, roles = self.get('/api/v1/roles?fields=name')
+        self.assertEqual(sorted(r['name'] for r in roles['items']),
+                         ['Administrator', 'User'])
+        status, user_types = self.get('/api/v1/user-types')
+        self.assertEqual(len(user_types['items']), 5)
+
+    def test_ndjson(self):
+        response = self.client.get('/api/v1/users?fields=first_name,tags',
+                                   headers=dict(self.headers, Accept=(
+                                       'application/x-ndjson')))
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(lines, [
+            {'first_name': 'Ada', 'tags': [self.math.id, self.poetry.id]},
+            {'first_name': 'Charles', 'tags': [self.math.id]},
+            {'first_name': 'George', 'tags': [self.poetry.id]},
+            {'first_name': 'Mary', 'tags': []}])
+
+        response = self.client.get('/api/v1/tags?format=ndjson',
+                                   headers=self.headers)
+        self.assertEqual(len(response.data.splitlines()), 2)
@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+from flask import Flask, render_template_string
+from app import assets, create_app
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def manifest_app(self, manifest):
+        app = Flask(__name__, static_folder=self.directory,
+                    static_url_path='/static')
+        app.config.update(ASSETS_AUTO_BUILD=False,
+                          ASSET_MANIFEST=os.path.join(self.directory,
+                                                      'manifest.json'))
+        with open(app.config['ASSET_MANIFEST'], 'w') as f:
+            json.dump(manifest, f)
+        assets.init_app(app)
+        return app
+
+    def test_serves_from_manifest(self):
+        manifest = dict((name, 'built/%s.0123456789ab' % name)
+                        for name in assets.BUNDLES)
+        os.makedirs(os.path.join(self.directory, 'built'))
+        with open(os.path.join(self.directory, manifest['app_css']), 'w') as f:
+            f.write('body {}')
+        with open(os.path.join(self.directory, 'other.css'), 'w') as f:
+            f.write('body {}')
+        app = self.manifest_app(manifest)
+        with app.test_request_context():
+            self.assertEqual(render_template_string(
+                '{% assets "app_css" %}{{ ASSET_URL }}{% endassets %}'),
+                '/static/built/app_css.0123456789ab')
+        client = app.test_client()
+        response = client.get('/static/built/app_css.0123456789ab')
+        self.assertEqual(response.headers['Cache-Control'],
+                         assets.IMMUTABLE_CACHE_CONTROL)
+        response = client.get('/static/other.css')
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+    def test_missing_manifest_builds_at_runtime(self):
+        app = Flask(__name__, static_folder=self.directory,
+                    static_url_path='/static')
+        app.config.update(ASSETS_AUTO_BUILD=False,
+                          ASSET_MANIFEST=os.path.join(self.directory,
+                                                      'missing.json'))
+        assets_env = assets.init_app(app)
+        self.assertTrue(assets_env.auto_build)
+        self.assertEqual(sorted(assets_env._named_bundles),
+                         sorted(assets.BUNDLES))
+
+    @unittest.skipIf(find_executable('sass') is None, 'sass is not installed')
+    def test_build_assets(self):
+        app = create_app('testing')
+        app.static_folder = self.directory
+        app.config['ASSET_MANIFEST'] = os.path.join(self.directory,
+                                                    'manifest.json')
+        manifest = assets.build_assets(app)
+        self.assertEqual(sorted(manifest), sorted(assets.BUNDLES))
+        for path in manifest.values():
+            self.assertTrue(os.path.exists(os.path.join(self.directory, path)))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, manifest['vendor_js'] + '.gz')))
+        with open(app.config['ASSET_MANIFEST']) as f:
+            self.assertEqual(json.load(f), manifest)
@@ -1,6 +1,7 @@
 import unittest
 from flask import current_app
 from app import create_app, db
+from app.search import create_index, drop_index
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -9,9 +10,11 @@ class BasicsTestCase(unittest.TestCase):
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
+        create_index()
 
     def tearDown(self):
         db.session.remove()
+        drop_index()
         db.drop_all()
         self.app_context.pop()
 
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+from app import create_app
+from benchmarks.runner import run, run_isolated, compare, format_results, \
+    peak_memory
+from benchmarks.scenarios import SCENARIOS
+
+
+class Response(object):
+    status_code = 200
+
+
+class Context(object):
+    iteration = 0
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        handle, self.output = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def test_run_all_scenarios(self):
+        results = run(self.app, users=20, tags=5, iterations=3, warmup=1,
+                      output=self.output)
+        self.assertEqual(sorted(results['scenarios']),
+                         sorted(s.__name__ for s in SCENARIOS))
+        for name, result in results['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertTrue(result['queries_per_request'] > 0, name)
+            self.assertTrue(result['p99'] >= result['p50'], name)
+        with open(self.output) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['dataset']['users'], 21)
+        self.assertTrue('registered_users' in format_results(saved))
+        self.assertTrue('+0.0%' in compare(saved, saved))
+
+    def test_peak_memory_per_scenario(self):
+        block = ' ' * (128 * 1024 * 1024)
+        del block
+        context = Context()
+        result = run_isolated(lambda context: Response(), context,
+                              iterations=3, warmup=1)
+        self.assertEqual(context.iteration, 4)
+        self.assertEqual(result['errors'], 0)
+        self.assertTrue(result['peak_memory_kb'] <
+                        peak_memory() - 64 * 1024)
@@ -0,0 +1,133 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from app import create_app, db, compress
+from app.compression import precompress
+from app.models import User, Role, UserType
+from app.search import create_index, drop_index
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        self.app.static_folder = self.directory
+        with open(os.path.join(self.directory, path), 'w') as f:
+            f.write(content)
+
+    def test_dynamic_response(self):
+        plain = self.client.get('/account/register')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        response = self.client.get('/account/register',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(response.data), plain.data)
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+
+        response = self.client.get('/account/register', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_per_url(self):
+        Role.insert_roles()
+        UserType.insert_user_types()
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        db.session.add(User(first_name='Zed', last_name='Able',
+                            email='zed@example.com'))
+        db.session.commit()
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+        self.client.get('/', follow_redirects=True)
+        headers = {'Accept-Encoding': 'gzip'}
+        by_last = self.client.get('/admin/users?sort=last_name',
+                                  headers=headers)
+        by_first = self.client.get('/admin/users?sort=first_name',
+                                   headers=headers)
+        self.assertEqual(by_last.headers['Content-Encoding'], 'gzip')
+        self.assertNotEqual(gunzip(by_last.data), gunzip(by_first.data))
+        self.assertEqual(gunzip(by_first.data), self.client.get(
+            '/admin/users?sort=first_name').data)
+
+    def test_cached_by_etag(self):
+        self.write('app.js', 'var x = 1;\n' * 1000)
+        headers = {'Accept-Encoding': 'gzip'}
+        first = self.client.get('/static/app.js', headers=headers)
+        second = self.client.get('/static/app.js', headers=headers)
+        self.assertEqual(second.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(second.data), 'var x = 1;\n' * 1000)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(compress.stats()['compressed'], 1)
+        self.assertEqual(compress.stats()['cached'], 1)
+
+    def test_precompressed_static_files(self):
+        self.write('app.css', 'body { color: red; }\n' * 1000)
+        self.write('tiny.css', 'a{}')
+        precompress(self.directory)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, 'app.css.gz')))
+        # Not worth compressing
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'tiny.css.gz')))
+        self.assertEqual(precompress(self.directory), 0)
+
+        response = self.client.get('/static/app.css',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertEqual(gunzip(response.data),
+                         'body { color: red; }\n' * 1000)
+        self.assertEqual(compress.stats()['compressed'], 0)
+
+        response = self.client.get('/static/app.css')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+    def test_adaptive_level(self):
+        with self.app.test_request_context():
+            self.assertEqual(compress.level('gzip', 1000), 6)
+            self.assertEqual(compress.level('gzip', 10 * 1024 * 1024), 1)
+            self.app.config['COMPRESS_BUSY_REQUESTS'] = -1
+            self.assertEqual(compress.level('gzip', 1000), 1)
+
+    def test_stale_precompressed_copy(self):
+        self.write('app.css', 'body { color: red; }\n' * 1000)
+        self.write('app.js', 'var x = 1;\n' * 1000)
+        precompress(self.directory, ['app.css'])
+        gz = os.path.join(self.directory, 'app.css.gz')
+        self.assertTrue(os.path.exists(gz))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'app.js.gz')))
+
+        # The file is rewritten after it was precompressed
+        self.write('app.css', 'body { color: blue; }\n' * 1000)
+        os.utime(gz, (0, 0))
+        response = self.client.get('/static/app.css',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gunzip(response.data),
+                         'body { color: blue; }\n' * 1000)
+        self.assertEqual(compress.stats()['compressed'], 1)
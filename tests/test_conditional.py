@@ -0,0 +1,158 @@
+import unittest
+from io import BytesIO
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.http import http_date
+from app import create_app, db
+from app.importer import import_members
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
+
+
+class ConditionalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        self.admin_id = User.query.filter_by(email='ada@example.com') \
+            .one().id
+        tag = Tag(name='Mathematics')
+        db.session.add(tag)
+        db.session.commit()
+        self.tag_id = tag.id
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+        # Show the login message
+        self.client.get('/', follow_redirects=True)
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertNotModified(self, url, response):
+        """Check that `url` still has the ETag of an earlier response."""
+        etag = response.headers['ETag'].strip('"')
+        again = self.client.get(url, headers={'If-None-Match': '"%s"' % etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, '')
+
+    def assertModified(self, url, response):
+        etag = response.headers['ETag'].strip('"')
+        again = self.client.get(url, headers={'If-None-Match': '"%s"' % etag})
+        self.assertEqual(again.status_code, 200)
+        return again
+
+    def test_profile(self):
+        url = '/account/profile/%d' % self.admin_id
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertNotModified(url, response)
+        compressed = self.client.get(url, headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': response.headers['ETag'][:-1] + '-gzip"'})
+        self.assertEqual(compressed.status_code, 304)
+        self.assertEqual(self.client.get(url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']})
+            .status_code, 304)
+
+        user = User.query.get(self.admin_id)
+        user.tags.append(Tag.query.get(self.tag_id))
+        db.session.commit()
+        response = self.assertModified(url, response)
+        self.assertIn('Mathematics', response.data)
+
+        # The member counts of the user's tags are shown
+        db.session.add(User(email='grace@example.com',
+                            tags=[Tag.query.get(self.tag_id)]))
+        db.session.commit()
+        response = self.assertModified(url, response)
+
+        Tag.query.get(self.tag_id).name = 'Algebra'
+        db.session.commit()
+        response = self.assertModified(url, response)
+        self.assertIn('Algebra', response.data)
+
+        self.assertEqual(self.client.get('/account/profile/0').status_code,
+                         404)
+
+    def test_membership_changes(self):
+        url = '/admin/tag/%d' % self.tag_id
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        version_id = Tag.query.get(self.tag_id).version_id
+
+        import_members(BytesIO('email,tags\ngrace@example.com,Mathematics\n'),
+                       invite=False)
+        db.session.commit()
+        response = self.assertModified(url, response)
+        self.assertIn('<td>1</td>', response.data)
+
+        db.session.delete(User.query.filter_by(email='grace@example.com')
+                          .one())
+        db.session.commit()
+        response = self.assertModified(url, response)
+        self.assertIn('<td>0</td>', response.data)
+        # Membership changes do not conflict with edits of the tag
+        self.assertEqual(Tag.query.get(self.tag_id).version_id, version_id)
+
+    def test_listings(self):
+        response = self.client.get('/admin/tags')
+        self.assertNotModified('/admin/tags', response)
+        tag = Tag(name='Physics')
+        db.session.add(tag)
+        db.session.commit()
+        response = self.assertModified('/admin/tags', response)
+        db.session.delete(tag)
+        db.session.commit()
+        self.assertModified('/admin/tags', response)
+
+        response = self.client.get('/admin/users?sort=first_name')
+        self.assertNotModified('/admin/users?sort=first_name', response)
+        User.query.get(self.admin_id).last_name = 'Byron'
+        db.session.commit()
+        self.assertModified('/admin/users?sort=first_name', response)
+
+    def test_flashed_messages_are_rendered(self):
+        response = self.client.get('/admin/tags')
+        self.client.get('/admin/tag/%d/_delete' % self.tag_id)
+        response = self.client.get('/admin/tags', headers={
+            'If-Modified-Since': http_date(1e10)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Successfully deleted', response.data)
+
+    def test_concurrent_edits(self):
+        url = '/admin/tag/%d/edit' % self.tag_id
+        version_id = Tag.query.get(self.tag_id).version_id
+        response = self.client.post(url, data={
+            'name': 'Algebra', 'description': '', 'version': version_id})
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        tag = Tag.query.get(self.tag_id)
+        self.assertEqual(tag.name, 'Algebra')
+        self.assertEqual(tag.version_id, version_id + 1)
+
+        # Submitted from the form rendered before the first edit
+        response = self.client.post(url, data={
+            'name': 'Geometry', 'description': '', 'version': version_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('changed by someone else', response.data)
+        self.assertIn('value="%d"' % (version_id + 1), response.data)
+        db.session.expire_all()
+        self.assertEqual(Tag.query.get(self.tag_id).name, 'Algebra')
+
+    def test_version_checked_on_update(self):
+        tag = Tag.query.get(self.tag_id)
+        db.session.execute(Tag.__table__.update()
+                           .values(version_id=Tag.version_id + 1))
+        tag.name = 'Geometry'
+        with self.assertRaises(StaleDataError):
+            db.session.commit()
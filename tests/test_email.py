@@ -0,0 +1,145 @@
+import asyncore
+import smtpd
+import threading
+import unittest
+from datetime import datetime
+from app import create_app, db, mail
+from app.email import send_email, queue_emails, outbox
+from app.models import OutboundEmail, User
+from app.search import create_index, drop_index
+
+
+class SMTPStandIn(smtpd.SMTPServer):
+    """A local SMTP server that records the messages it receives."""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.connections = 0
+        self.refuse = set()
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={'timeout': 0.05,
+                                               'map': self._map})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if set(rcpttos) & self.refuse:
+            return '550 No such user'
+        self.received.extend(rcpttos)
+
+    def stop(self):
+        self.close()
+        asyncore.close_all(self._map)
+        self.thread.join(1)
+
+
+class EmailOutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smtp = SMTPStandIn()
+        self.app = create_app('testing')
+        self.app.config.update(MAIL_SERVER='127.0.0.1',
+                               MAIL_PORT=self.smtp.port,
+                               MAIL_USE_TLS=False,
+                               MAIL_USERNAME=None,
+                               MAIL_SUPPRESS_SEND=False,
+                               EMAIL_RETRY_BACKOFF=0)
+        mail.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+        create_index()
+        self.user = User(first_name='Ada', email='ada@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.request_context.pop()
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+        self.smtp.stop()
+
+    def queue(self, to):
+        send_email(to, 'Confirm Your Account', 'account/email/confirm',
+                   user=self.user, token='token')
+        db.session.commit()
+
+    def test_messages_are_persisted_then_sent(self):
+        self.queue('ada@example.com')
+        message = OutboundEmail.query.one()
+        self.assertEqual(message.status, OutboundEmail.PENDING)
+        self.assertTrue('Confirm Your Account' in message.subject)
+        self.assertEqual(self.smtp.received, [])
+
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.smtp.received, ['ada@example.com'])
+        message = OutboundEmail.query.one()
+        self.assertEqual(message.status, OutboundEmail.SENT)
+        self.assertEqual(message.attempts, 1)
+
+    def test_messages_are_queued_in_the_callers_transaction(self):
+        send_email('ada@example.com', 'Confirm Your Account',
+                   'account/email/confirm', user=self.user, token='token')
+        db.session.rollback()
+        self.assertEqual(OutboundEmail.query.count(), 0)
+        self.queue('ada@example.com')
+        self.assertEqual(OutboundEmail.query.count(), 1)
+
+    def test_batch_shares_one_connection(self):
+        for i in range(5):
+            self.queue('user%d@example.com' % i)
+        outbox.drain()
+        self.assertEqual(len(self.smtp.received), 5)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(outbox.metrics['connections'], 1)
+        self.assertEqual(outbox.metrics['sent'], 5)
+
+    def test_bulk_queue(self):
+        queue_emails([dict(recipient='user%d@example.com' % i,
+                           subject='Hello', body='Hi', html='<p>Hi</p>')
+                      for i in range(3)])
+        db.session.commit()
+        outbox.drain()
+        self.assertEqual(len(self.smtp.received), 3)
+
+    def test_failed_messages_are_retried_then_abandoned(self):
+        self.app.config['EMAIL_MAX_ATTEMPTS'] = 2
+        self.smtp.refuse.add('bounce@example.com')
+        self.queue('bounce@example.com')
+        self.queue('ada@example.com')
+        outbox.drain_once()
+        message = OutboundEmail.query.filter_by(
+            recipient='bounce@example.com').one()
+        self.assertEqual(message.status, OutboundEmail.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertTrue(message.last_error)
+        self.assertEqual(self.smtp.received, ['ada@example.com'])
+
+        outbox.drain()
+        message = OutboundEmail.query.filter_by(
+            recipient='bounce@example.com').one()
+        self.assertEqual(message.status, OutboundEmail.FAILED)
+        self.assertEqual(outbox.metrics['retried'], 1)
+        self.assertEqual(outbox.metrics['failed'], 1)
+
+    def test_unreachable_server_retries_later(self):
+        self.smtp.stop()
+        self.app.config['EMAIL_RETRY_BACKOFF'] = 60
+        self.queue('ada@example.com')
+        outbox.drain()
+        message = OutboundEmail.query.one()
+        self.assertEqual(message.status, OutboundEmail.PENDING)
+        self.assertTrue(message.next_attempt_at > datetime.utcnow())
+
+    def test_stats(self):
+        self.queue('ada@example.com')
+        self.assertEqual(outbox.stats()['queue'], {'pending': 1})
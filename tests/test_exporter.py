@@ -0,0 +1,73 @@
+import unittest
+from io import BytesIO
+from app import create_app, db
+from app.exporter import export_csv
+from app.importer import read_rows
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
+from app.sql_stats import query_budget
+
+
+class ExporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        math, poetry = Tag(name='Mathematics'), Tag(name=u'Po\xe9sie')
+        student = UserType.query.filter_by(name='Student').one()
+        db.session.add_all([
+            User(first_name='Ada', last_name='Lovelace',
+                 email='ada@example.com', hometown='London',
+                 user_type=student, tags=[math, poetry]),
+            User(first_name='Charles', last_name='Babbage, Jr.',
+                 email='charles@example.com', tags=[math]),
+            User(first_name='Mary', email='mary@example.com')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_export_csv(self):
+        with query_budget(1):
+            chunks = list(export_csv(chunk_size=2))
+        # The header and first two users, then the last user
+        self.assertEqual(len(chunks), 2)
+        rows = [row for _, row in read_rows(BytesIO(''.join(chunks)))]
+        for row in rows:
+            row['tags'] = sorted(row['tags'].split(';'))
+        self.assertEqual(rows, [
+            {'first_name': 'Ada', 'last_name': 'Lovelace',
+             'email': 'ada@example.com', 'user_type': 'Student',
+             'role': 'User', 'hometown': 'London',
+             'tags': ['Mathematics', u'Po\xe9sie']},
+            {'first_name': 'Charles', 'last_name': 'Babbage, Jr.',
+             'email': 'charles@example.com', 'user_type': '',
+             'role': 'User', 'hometown': '', 'tags': ['Mathematics']},
+            {'first_name': 'Mary', 'last_name': '',
+             'email': 'mary@example.com', 'user_type': '',
+             'role': 'User', 'hometown': '', 'tags': ['']}])
+
+    def test_export_view(self):
+        User.create_confirmed_admin('Grace', 'Hopper', 'grace@example.com',
+                                    'password')
+        client = self.app.test_client()
+        self.assertNotEqual(client.get('/admin/users/export').status_code,
+                            200)
+        client.post('/account/login', data={'email': 'grace@example.com',
+                                            'password': 'password'})
+        response = client.get('/admin/users/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        lines = response.data.splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1],
+                         'Grace,Hopper,grace@example.com,,Administrator,,')
@@ -0,0 +1,65 @@
+import random
+import unittest
+from app import create_app, db
+from app.fake_data import generate, tag_weights, sample_tags, FAKE_PASSWORD
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
+
+
+class FakeDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generate(self):
+        users, memberships = generate(users=30, tags=10, tags_per_user=3,
+                                      processes=1, chunk_size=7)
+        self.assertEqual(users, 30)
+        self.assertEqual(User.query.count(), 30)
+        self.assertEqual(Tag.query.count(), 10)
+        self.assertEqual(sum(Tag.user_counts().values()), memberships)
+        user = User.query.first()
+        self.assertTrue(user.verify_password(FAKE_PASSWORD))
+        self.assertIsNotNone(user.user_type)
+        # New rows are numbered after the generated ones
+        db.session.add(User(email='new@example.com'))
+        db.session.commit()
+        self.assertEqual(User.query.filter_by(email='new@example.com')
+                         .one().id, 31)
+
+    def test_same_seed_same_data(self):
+        generate(users=10, tags=5, processes=1, seed=4, chunk_size=3)
+        first = [(u.email, [t.name for t in u.tags])
+                 for u in User.query.order_by(User.id)]
+        drop_index()
+        db.drop_all()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        generate(users=10, tags=5, processes=1, seed=4, chunk_size=3)
+        second = [(u.email, [t.name for t in u.tags])
+                  for u in User.query.order_by(User.id)]
+        self.assertEqual(first, second)
+
+    def test_zipf_favours_popular_tags(self):
+        rng = random.Random(0)
+        weights = tag_weights(100, 'zipf')
+        counts = [0] * 100
+        for _ in range(2000):
+            for tag in sample_tags(rng, range(100), weights, 1):
+                counts[tag] += 1
+        self.assertTrue(counts[0] > 10 * counts[99])
+        self.assertEqual(tag_weights(3, 'uniform'), [1.0, 2.0, 3.0])
+        self.assertEqual(len(sample_tags(rng, range(3), weights[:3], 5)), 3)
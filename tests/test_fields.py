@@ -0,0 +1,97 @@
+import unittest
+from werkzeug.datastructures import MultiDict
+from wtforms import Form
+from wtforms.ext.sqlalchemy.fields import QuerySelectField
+from app import create_app, db
+from app.fields import LookupSelectField
+from app.models import Role, User, UserType, role_registry, \
+    user_type_registry
+from app.search import create_index, drop_index
+from app.sql_stats import query_budget
+
+
+class RoleForm(Form):
+    role = LookupSelectField('Account type', registry=role_registry,
+                             order_by='permissions')
+    user_type = LookupSelectField('User Type', registry=user_type_registry)
+
+
+class QueryRoleForm(Form):
+    role = QuerySelectField('Account type', get_label='name',
+                            query_factory=lambda: db.session.query(Role).
+                            order_by('permissions'))
+    user_type = QuerySelectField('User Type', get_label='name',
+                                 query_factory=lambda:
+                                 db.session.query(UserType))
+
+
+class LookupSelectFieldTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_same_as_query_select_field(self):
+        admin = Role.query.filter_by(name='Administrator').one()
+        student = UserType.query.filter_by(name='Student').one()
+        for formdata, obj in [
+                (None, None),
+                (None, User(role=admin, user_type=student)),
+                (MultiDict({'role': str(admin.id), 'user_type': '0'}), None)]:
+            form = RoleForm(formdata, obj=obj)
+            expected = QueryRoleForm(formdata, obj=obj)
+            self.assertEqual(form.validate(), expected.validate())
+            self.assertEqual(form.errors, expected.errors)
+            for name in ('role', 'user_type'):
+                self.assertEqual(form[name](), expected[name]())
+                self.assertEqual(form[name].data, expected[name].data)
+
+    def test_choices_are_cached(self):
+        RoleForm().role()
+        admin = role_registry.find(name='Administrator')
+        with query_budget(0):
+            html = RoleForm().role()
+            form = RoleForm(MultiDict({'role': str(admin.id),
+                                       'user_type': '0'}))
+            self.assertFalse(form.validate())
+        self.assertIn('Administrator', html)
+        self.assertIn('user_type', form.errors)
+        self.assertNotIn('role', form.errors)
+        with query_budget(1):
+            self.assertEqual(form.role.data.name, 'Administrator')
+
+    def test_choices_follow_changes(self):
+        version = user_type_registry.version
+        self.assertNotIn('Partner', RoleForm().user_type())
+        db.session.add(UserType(name='Partner'))
+        db.session.commit()
+        self.assertIn('Partner', RoleForm().user_type())
+        self.assertNotEqual(user_type_registry.version, version)
+
+        partner = UserType.query.filter_by(name='Partner').one()
+        db.session.delete(partner)
+        db.session.commit()
+        form = RoleForm(MultiDict({'user_type': str(partner.id)}))
+        self.assertFalse(form.validate())
+        self.assertIn('user_type', form.errors)
+
+    def test_register(self):
+        student = UserType.query.filter_by(name='Student').one()
+        client = self.app.test_client()
+        self.assertIn('Community Member', client.get('/account/register').data)
+        client.post('/account/register', data={
+            'first_name': 'Ada', 'last_name': 'Lovelace',
+            'email': 'ada@example.com', 'password': 'password',
+            'password2': 'password', 'user_type': str(student.id)})
+        user = User.query.filter_by(email='ada@example.com').one()
+        self.assertEqual(user.user_type, student)
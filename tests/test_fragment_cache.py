@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+from flask import render_template_string
+from app import create_app, db
+from app.fragment_cache import fragment_cache
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        self.admin_id = User.query.filter_by(email='ada@example.com') \
+            .one().id
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_template_tag(self):
+        template = "{% cache 'greeting', name depends [('user', 1)] %}" \
+            "Hello {{ name }} {{ calls.append(1) or '' }}{% endcache %}"
+        calls = []
+        with self.app.test_request_context():
+            for name in ['Ada', 'Ada', 'Grace']:
+                render_template_string(template, name=name, calls=calls)
+            self.assertEqual(len(calls), 2)
+            fragment_cache.invalidate([('user', 1)])
+            self.assertEqual(render_template_string(
+                template, name='Ada', calls=calls).strip(), 'Hello Ada')
+            self.assertEqual(len(calls), 3)
+
+    def test_profile_invalidated_by_edits(self):
+        url = '/account/profile/%d' % self.admin_id
+        self.client.get(url)
+        hits = fragment_cache.stats()['hits']
+        self.assertIn('Ada Lovelace', self.client.get(url).data)
+        self.assertTrue(fragment_cache.stats()['hits'] > hits)
+
+        user = User.query.get(self.admin_id)
+        user.first_name = 'Augusta'
+        db.session.commit()
+        self.assertIn('Augusta Lovelace', self.client.get(url).data)
+
+        tag = Tag(name='Mathematics')
+        db.session.add(tag)
+        db.session.commit()
+        self.assertNotIn('Mathematics', self.client.get(url).data)
+        User.query.get(self.admin_id).tags.append(tag)
+        db.session.commit()
+        self.assertIn('Mathematics', self.client.get(url).data)
+
+        # The member count of the tag is shown on the profile
+        db.session.add(User(email='grace@example.com', tags=[tag]))
+        db.session.commit()
+        self.assertIn('>2</a>', self.client.get(url).data)
+
+    def test_tag_info_invalidated_by_membership(self):
+        tag = Tag(name='Mathematics')
+        db.session.add(tag)
+        db.session.commit()
+        url = '/admin/tag/%d' % tag.id
+        self.assertIn('<td>0</td>', self.client.get(url).data)
+        self.assertIn('<td>0</td>', self.client.get(url).data)
+        db.session.add(User(email='grace@example.com', tags=[tag]))
+        db.session.commit()
+        self.assertIn('<td>1</td>', self.client.get(url).data)
+        # Rolled back changes do not invalidate anything
+        tag.description = 'Numbers'
+        db.session.flush()
+        db.session.rollback()
+        stale = fragment_cache.stats()['stale']
+        self.client.get(url)
+        self.assertEqual(fragment_cache.stats()['stale'], stale)
+
+    def test_single_flight(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.05)
+            return 'fragment', [('tag', 1)]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            fragment_cache.cached('key', render))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['fragment'] * 5)
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(fragment_cache.stats()['waits'], 4)
+
+    def test_changed_while_rendering(self):
+        def render():
+            fragment_cache.invalidate([('tag', 1)])
+            return 'old', [('tag', 1)]
+
+        self.assertEqual(fragment_cache.cached('key', render), 'old')
+        self.assertIsNone(fragment_cache.get('key'))
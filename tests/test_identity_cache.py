@@ -0,0 +1,94 @@
+import unittest
+from app import create_app, db
+from app.models import (
+    User,
+    Role,
+    UserType,
+    Permission,
+    Identity,
+    identity_cache,
+    load_user
+)
+from app.search import create_index, drop_index
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.user = User(first_name='Ada', last_name='Lovelace',
+                         email='ada@example.com', password='password',
+                         confirmed=True, admin_check=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_identity_is_cached(self):
+        identity = load_user(self.user.id)
+        self.assertTrue(isinstance(identity, Identity))
+        self.assertEqual(identity_cache.stats()['misses'], 1)
+        identity = load_user(self.user.id)
+        self.assertEqual(identity_cache.stats()['hits'], 1)
+        self.assertEqual(identity.full_name(), 'Ada Lovelace')
+        self.assertTrue(identity.can(Permission.GENERAL))
+        self.assertFalse(identity.is_admin())
+        self.assertEqual(identity.role.index, 'main')
+        # Uncached attributes come from the database
+        self.assertEqual(identity.email, 'ada@example.com')
+
+    def test_unknown_user(self):
+        self.assertIsNone(load_user(12345))
+
+    def test_changes_invalidate_identity(self):
+        load_user(self.user.id)
+        self.user.confirmed = False
+        db.session.commit()
+        self.assertFalse(load_user(self.user.id).confirmed)
+
+        self.user.role = Role.query.filter_by(
+            permissions=Permission.ADMINISTER).first()
+        db.session.commit()
+        self.assertTrue(load_user(self.user.id).is_admin())
+
+        self.user.first_name = 'Augusta'
+        db.session.commit()
+        self.assertEqual(load_user(self.user.id).first_name, 'Augusta')
+
+        db.session.delete(self.user)
+        db.session.commit()
+        self.assertIsNone(load_user(self.user.id))
+
+    def test_role_changes_invalidate_all_identities(self):
+        load_user(self.user.id)
+        role = Role.query.filter_by(default=True).first()
+        role.name = 'Member'
+        db.session.commit()
+        self.assertEqual(load_user(self.user.id).role.name, 'Member')
+
+    def test_rolled_back_changes_keep_identity(self):
+        load_user(self.user.id)
+        self.user.confirmed = False
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(load_user(self.user.id).confirmed)
+        self.assertEqual(identity_cache.stats()['hits'], 1)
+
+    def test_requests_use_cached_identity(self):
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'ada@example.com',
+                                            'password': 'password'})
+        for _ in range(3):
+            response = client.get('/account/profile/%d' % self.user.id)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(identity_cache.stats()['misses'], 1)
+        self.assertEqual(identity_cache.stats()['hits'], 2)
@@ -0,0 +1,95 @@
+import unittest
+from io import BytesIO
+from app import create_app, db
+from app.importer import import_members, read_rows, MemberImportError
+from app.models import User, Role, Tag, UserType, OutboundEmail, Permission
+from app.search import create_index, drop_index, search_users
+from app.tag_index import tag_index
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+
+    def tearDown(self):
+        self.request_context.pop()
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_read_rows(self):
+        data = '\xef\xbb\xbfEmail\tFirst Name\tignored\n' \
+               'ada@example.com\tAda\tx\n\n' \
+               'zoe@example.com\tZo\xc3\xab\ty\n'
+        rows = list(read_rows(BytesIO(data)))
+        self.assertEqual(rows, [
+            (2, {'email': u'ada@example.com', 'first_name': u'Ada'}),
+            (4, {'email': u'zoe@example.com', 'first_name': u'Zo\xeb'})])
+
+    def test_missing_email_column(self):
+        with self.assertRaises(MemberImportError):
+            list(read_rows(BytesIO('first_name,last_name\nAda,Lovelace\n')))
+
+    def test_import(self):
+        Tag.find_or_create('math')
+        db.session.add(User(first_name='Old', email='old@example.com'))
+        db.session.commit()
+        data = 'first_name,last_name,email,user_type,role,hometown,tags\n' \
+               'Ada,Lovelace,ada@example.com,student,,London,math; poetry\n' \
+               'Grace,Hopper,grace@example.com,,Administrator,,math\n' \
+               'Old,User,old@example.com,,,,\n' \
+               'Bad,Email,not-an-email,,,,\n' \
+               'Bad,Role,bad@example.com,,Emperor,,\n' \
+               'Ada,Again,ada@example.com,,,,\n'
+        result = import_members(BytesIO(data), chunk_size=2)
+        self.assertEqual(result.created, 2)
+        # The repeated row is in a later chunk than the first, which has
+        # been committed by then
+        self.assertEqual(result.existing, 2)
+        self.assertEqual(result.invalid, 2)
+        self.assertEqual(result.invited, 2)
+        self.assertEqual(len(result.errors), 2)
+
+        ada = User.query.filter_by(email='ada@example.com').one()
+        self.assertEqual(ada.full_name(), 'Ada Lovelace')
+        self.assertEqual(ada.hometown, 'London')
+        self.assertEqual(ada.user_type.name, 'Student')
+        self.assertEqual(ada.role.permissions, Permission.GENERAL)
+        self.assertFalse(ada.confirmed)
+        self.assertEqual(sorted(t.name for t in ada.tags), ['math', 'poetry'])
+        grace = User.query.filter_by(email='grace@example.com').one()
+        self.assertTrue(grace.is_admin())
+
+        # Imported users are visible to the search and tag indexes
+        self.assertEqual(search_users('lovelace')[0], [ada])
+        math = Tag.query.filter_by(name='math').one()
+        self.assertEqual(sorted(tag_index.members(math.id)),
+                         sorted([ada.id, grace.id]))
+
+        invitations = OutboundEmail.query.order_by(OutboundEmail.id).all()
+        self.assertEqual([m.recipient for m in invitations],
+                         ['ada@example.com', 'grace@example.com'])
+        self.assertTrue('/join-from-invite/%d/' % ada.id in
+                        invitations[0].body)
+
+    def test_duplicates_within_a_chunk(self):
+        result = import_members(
+            BytesIO('email\nada@example.com\nada@example.com\n'))
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors,
+                         [u'Line 3: Duplicate email "ada@example.com".'])
+
+    def test_import_without_invites(self):
+        result = import_members(BytesIO('email\nada@example.com\n'),
+                                invite=False)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(OutboundEmail.query.count(), 0)
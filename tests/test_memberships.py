@@ -0,0 +1,105 @@
+import time
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.memberships import set_tags
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index, search_users
+from app.tag_index import tag_index
+from app.tag_suggestions import tag_suggestions
+
+
+class SetTagsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.math, self.music, self.poetry = tags = [
+            Tag(name='Mathematics'), Tag(name='Music'), Tag(name='Poetry')]
+        self.user = User(first_name='Ada', last_name='Lovelace',
+                         email='ada@example.com', tags=tags[:2])
+        db.session.add_all([self.user, self.poetry])
+        db.session.commit()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def writes(self):
+        return [s.split()[0] for s in self.statements
+                if 'user_tag_association' in s and not s.startswith('SELECT')]
+
+    def test_unchanged(self):
+        updated_at = self.user.updated_at
+        self.assertEqual(set_tags(self.user, [self.music, self.math]),
+                         (set(), set()))
+        db.session.commit()
+        self.assertEqual(self.writes(), [])
+        self.assertEqual(self.user.updated_at, updated_at)
+
+    def test_changed(self):
+        self.assertEqual(list(tag_index.members(self.math.id)),
+                         [self.user.id])
+        self.assertEqual(tag_suggestions.suggest('p'), [(self.poetry.id,
+                                                         'Poetry')])
+        updated_at = self.poetry.updated_at
+        time.sleep(0.01)
+        added, removed = set_tags(
+            self.user, [self.music, self.poetry, self.poetry])
+        self.assertEqual((added, removed), ({self.poetry.id}, {self.math.id}))
+        db.session.commit()
+        self.assertEqual(self.writes(), ['INSERT', 'DELETE'])
+
+        db.session.expire_all()
+        user = User.query.get(self.user.id)
+        self.assertEqual(sorted(t.name for t in user.tags),
+                         ['Music', 'Poetry'])
+        self.assertEqual(self.poetry.users, [user])
+        self.assertTrue(self.poetry.updated_at > updated_at)
+        self.assertEqual(list(tag_index.members(self.poetry.id)), [user.id])
+        self.assertEqual(list(tag_index.members(self.math.id)), [])
+        self.assertEqual(tag_suggestions.suggest('m'), [
+            (self.music.id, 'Music'), (self.math.id, 'Mathematics')])
+        self.assertEqual(search_users('poetry')[0], [user])
+        self.assertEqual(search_users('mathematics')[0], [])
+
+    def test_rollback(self):
+        tag_index.members(self.math.id)
+        set_tags(self.user, [])
+        db.session.rollback()
+        self.assertEqual(len(self.user.tags), 2)
+        self.assertEqual(list(tag_index.members(self.math.id)),
+                         [self.user.id])
+
+    def test_edit_profile(self):
+        client = self.app.test_client()
+        self.user.password = 'password'
+        self.user.confirmed = True
+        db.session.commit()
+        client.post('/account/login', data={'email': 'ada@example.com',
+                                            'password': 'password'})
+        data = {'first_name': 'Ada', 'last_name': 'Lovelace',
+                'tags': [self.math.id, self.music.id]}
+        del self.statements[:]
+        self.assertEqual(
+            client.post('/account/profile/edit', data=data).status_code, 302)
+        self.assertEqual(self.writes(), [])
+
+        data['tags'] = [self.poetry.id]
+        client.post('/account/profile/edit', data=data)
+        self.assertEqual(self.writes(), ['INSERT', 'DELETE'])
+        db.session.expire_all()
+        self.assertEqual([t.name for t in User.query.get(self.user.id).tags],
+                         ['Poetry'])
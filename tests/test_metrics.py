@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from app import create_app, db
+from app.metrics import RequestMetrics, request_metrics
+from app.models import User, Role, UserType
+from app.search import create_index, drop_index
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = None
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+    def login_admin(self):
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+
+    def test_histogram(self):
+        metrics = RequestMetrics()
+        labels = (('endpoint', 'main.index'), ('method', 'GET'))
+        for value in [0.001, 0.005, 0.3, 20]:
+            metrics._observe('http_request_duration_seconds', labels, value)
+        text = metrics.render()
+        self.assertIn('http_request_duration_seconds_bucket{'
+                      'endpoint="main.index",method="GET",le="0.005"} 2',
+                      text)
+        self.assertIn('http_request_duration_seconds_bucket{'
+                      'endpoint="main.index",method="GET",le="0.5"} 3', text)
+        self.assertIn('http_request_duration_seconds_bucket{'
+                      'endpoint="main.index",method="GET",le="+Inf"} 4',
+                      text)
+        self.assertIn('http_request_duration_seconds_count{'
+                      'endpoint="main.index",method="GET"} 4', text)
+
+    def test_requests_are_recorded(self):
+        for _ in range(2):
+            self.client.get('/account/login')
+        self.client.get('/no-such-page')
+        samples = request_metrics.collect()
+        requests = samples['http_requests_total']
+        self.assertEqual(requests[(('endpoint', 'account.login'),
+                                   ('method', 'GET'), ('status', '200'))], 2)
+        self.assertEqual(requests[(('endpoint', 'none'), ('method', 'GET'),
+                                   ('status', '404'))], 1)
+        durations = samples['http_request_db_seconds'][
+            (('endpoint', 'account.login'), ('method', 'GET'))]
+        self.assertEqual(sum(durations[:-1]), 2)
+        self.assertEqual(samples['http_requests_in_flight'][()], 0)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/admin/metrics').status_code, 403)
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        response = self.client.get(
+            '/admin/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertEqual(self.client.get(
+            '/admin/metrics', headers={'Authorization': 'Bearer wrong'})
+            .status_code, 403)
+        self.login_admin()
+        response = self.client.get('/admin/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_requests_total counter', response.data)
+
+    def test_workers_are_added_up(self):
+        self.directory = tempfile.mkdtemp()
+        request_metrics.directory = self.directory
+        self.client.get('/account/login')
+        # A worker that has exited, in the middle of a request
+        process = subprocess.Popen(['true'])
+        process.wait()
+        key = [['endpoint', 'account.login'], ['method', 'GET'],
+               ['status', '200']]
+        with open(os.path.join(self.directory,
+                               'metrics-%d.json' % process.pid), 'w') as f:
+            json.dump(dict(pid=process.pid, in_flight=1,
+                           counters=[['http_requests_total', key, 3]],
+                           histograms=[]), f)
+        samples = request_metrics.collect()
+        self.assertEqual(
+            samples['http_requests_total'][tuple(map(tuple, key))], 4)
+        self.assertEqual(samples['http_requests_in_flight'][()], 0)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.directory, 'metrics-%d.json' % os.getpid())))
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+import sqlalchemy as sa
+from flask.ext.migrate import Migrate, upgrade, downgrade
+from app import create_app, db
+from app.search import create_index
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'migrations')
+
+
+def describe(engine):
+    """The tables, columns and indexes of a database."""
+    inspector = sa.inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table == 'alembic_version':
+            continue
+        schema[table] = (
+            sorted((c['name'], repr(c['type']), c['nullable'])
+                   for c in inspector.get_columns(table)),
+            sorted((i['name'], tuple(i['column_names']), bool(i['unique']))
+                   for i in inspector.get_indexes(table)),
+            inspector.get_pk_constraint(table)['constrained_columns'])
+    return schema
+
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.directory, 'migrated.sqlite')
+        Migrate(self.app, db, directory=MIGRATIONS)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_upgrade_matches_models(self):
+        upgrade(MIGRATIONS, '0a1e7134f650')
+        engine = db.get_engine(self.app)
+        engine.execute("INSERT INTO users (id, first_name, last_name, email) "
+                       "VALUES (1, 'Ada', 'Lovelace', 'ada@example.com')")
+        engine.execute("INSERT INTO tags (id, name) VALUES (1, 'Math')")
+        engine.execute("INSERT INTO user_tag_association (tag_id, user_id) "
+                       "VALUES (1, 1), (1, 1)")
+        upgrade(MIGRATIONS)
+
+        created = sa.create_engine('sqlite://')
+        db.metadata.create_all(created)
+        create_index(created)
+        self.assertEqual(describe(engine), describe(created))
+        self.assertEqual(
+            engine.execute('SELECT tag_id, user_id '
+                           'FROM user_tag_association').fetchall(), [(1, 1)])
+        self.assertEqual(
+            engine.execute("SELECT rowid FROM user_search "
+                           "WHERE user_search MATCH 'lovelace math'")
+            .fetchall(), [(1,)])
+
+        downgrade(MIGRATIONS, 'base')
+        self.assertEqual(describe(engine), {})
@@ -0,0 +1,111 @@
+import re
+import unittest
+from app import create_app, db
+from app.models import User, Role
+from app.pagination import keyset_paginate, decode_cursor, nulls_first
+from app.search import create_index, drop_index
+from app.sql_stats import collect_queries
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        for i, last_name in enumerate(['Smith', 'Adams', 'Smith', 'Brown',
+                                       'Adams', 'Smith', 'Clark']):
+            db.session.add(User(first_name='User%d' % i, last_name=last_name,
+                                email='user%d@example.com' % i))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def collect_pages(self, per_page, descending=False):
+        pages = []
+        cursor = None
+        while True:
+            page = keyset_paginate(User.query, User.last_name, User.id,
+                                   cursor=cursor, per_page=per_page,
+                                   descending=descending)
+            pages.append([u.id for u in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_all_rows_in_order(self):
+        expected = [u.id for u in
+                    User.query.order_by(User.last_name, User.id).all()]
+        pages = self.collect_pages(per_page=2)
+        self.assertEqual([len(p) for p in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_descending_pages(self):
+        expected = [u.id for u in User.query.order_by(
+            User.last_name.desc(), User.id.desc()).all()]
+        pages = self.collect_pages(per_page=3, descending=True)
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_last_page_has_no_cursor(self):
+        page = keyset_paginate(User.query, User.last_name, User.id,
+                               per_page=7)
+        self.assertEqual(len(page), 7)
+        self.assertFalse(page.has_next)
+
+    def test_malformed_cursor_starts_from_first_page(self):
+        self.assertIsNone(decode_cursor('not a cursor'))
+        page = keyset_paginate(User.query, User.last_name, User.id,
+                               cursor='not a cursor', per_page=1)
+        first = User.query.order_by(User.last_name, User.id).first()
+        self.assertEqual(page.items[0].id, first.id)
+
+    def test_null_sort_values(self):
+        # Invited users who have not joined yet have no names
+        for i in range(5):
+            db.session.add(User(email='invited%d@example.com' % i))
+        db.session.commit()
+        users = User.query.all()
+        named = sorted((u for u in users if u.last_name is not None),
+                       key=lambda u: (u.last_name, u.id))
+        unnamed = sorted(u.id for u in users if u.last_name is None)
+        expected = [u.id for u in named] + unnamed
+        if nulls_first(db.engine):
+            expected = unnamed + [u.id for u in named]
+        for per_page in (1, 3, 5, 7):
+            pages = self.collect_pages(per_page=per_page)
+            self.assertEqual(sum(pages, []), expected)
+            pages = self.collect_pages(per_page=per_page, descending=True)
+            self.assertEqual(sum(pages, []), expected[::-1])
+
+    def test_null_sort_values_in_listing(self):
+        Role.insert_roles()
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        for i in range(5):
+            db.session.add(User(email='invited%d@example.com' % i))
+        db.session.commit()
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'ada@example.com',
+                                            'password': 'password'})
+        seen = 0
+        url = '/admin/users?per_page=3'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += response.data.count('class="user role"')
+            after = re.search(r'after=([\w-]+)', response.data)
+            url = '/admin/users?per_page=3&after=' + after.group(1) \
+                if after else None
+        self.assertEqual(seen, 13)
+
+        # Roles and user types for the filters come from the registries
+        with collect_queries() as stats:
+            client.get('/admin/users')
+        self.assertFalse([shape for shape in stats.shapes
+                          if 'FROM roles' in shape or
+                          'FROM user_types' in shape])
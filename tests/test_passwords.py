@@ -0,0 +1,125 @@
+import time
+import unittest
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models import User, Role, UserType
+from app.passwords import PasswordHasher, PasswordHashTimeout, password_hasher
+from app.search import create_index, drop_index
+
+
+def fail_slowly(seconds):
+    time.sleep(seconds)
+    raise ValueError('Unknown hash method')
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    def test_hash_and_verify(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000')
+        pwhash = hasher.hash('cat')
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(hasher.verify(pwhash, 'cat'))
+        self.assertFalse(hasher.verify(pwhash, 'dog'))
+        self.assertFalse(hasher.verify(None, 'cat'))
+        stats = hasher.stats()
+        self.assertEqual(stats['hashes'], 1)
+        self.assertEqual(stats['verifications'], 2)
+        self.assertTrue(stats['p99'] >= stats['p50'] > 0)
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher('pbkdf2:sha256')
+        self.assertEqual(hasher.method, 'pbkdf2:sha256:1000')
+        self.assertFalse(hasher.needs_rehash(hasher.hash('cat')))
+        self.assertTrue(hasher.needs_rehash(
+            generate_password_hash('cat', method='pbkdf2:sha1:1000')))
+        self.assertFalse(hasher.needs_rehash(None))
+
+    def test_process_pool(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', processes=1)
+        try:
+            self.assertTrue(hasher.verify(hasher.hash('cat'), 'cat'))
+            self.assertEqual(hasher.stats()['pending'], 0)
+        finally:
+            hasher.close()
+
+    def test_timeout(self):
+        hasher = PasswordHasher('pbkdf2:sha256:5000000', processes=1,
+                                timeout=0.01, max_pending=1)
+        try:
+            with self.assertRaises(PasswordHashTimeout):
+                hasher.hash('cat')
+            # The first hash is still running, so there is no room for more
+            with self.assertRaises(PasswordHashTimeout):
+                hasher.hash('dog')
+            self.assertEqual(hasher.metrics['timeouts'], 1)
+            self.assertEqual(hasher.metrics['rejected'], 1)
+        finally:
+            hasher.close()
+
+    def test_failure_after_timeout(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', processes=1,
+                                timeout=0.05, max_pending=1)
+        try:
+            with self.assertRaises(ValueError):
+                hasher._run(fail_slowly, 0)
+            with self.assertRaises(PasswordHashTimeout):
+                hasher._run(fail_slowly, 0.2)
+            # The failure frees its slot once it ends
+            deadline = time.time() + 5
+            while hasher.stats()['pending'] and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(hasher.stats()['pending'], 0)
+            self.assertTrue(hasher.verify(hasher.hash('cat'), 'cat'))
+        finally:
+            hasher.close()
+
+
+class RehashOnLoginTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_outdated_hash_is_replaced(self):
+        old_hash = generate_password_hash('password', method='pbkdf2:sha1')
+        user = User(email='ada@example.com', password_hash=old_hash,
+                    confirmed=True, admin_check=True)
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        response = client.post('/account/login',
+                               data={'email': 'ada@example.com',
+                                     'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+        user = User.query.get(user.id)
+        self.assertNotEqual(user.password_hash, old_hash)
+        self.assertFalse(user.password_needs_rehash())
+        self.assertTrue(user.verify_password('password'))
+        self.assertEqual(password_hasher.metrics['rehashes'], 1)
+
+    def test_busy_pool(self):
+        def busy(*args):
+            raise PasswordHashTimeout('Too many passwords waiting')
+        password_hasher._run, run = busy, password_hasher._run
+        try:
+            response = self.app.test_client().post('/account/register', data={
+                'first_name': 'Ada', 'last_name': 'Lovelace',
+                'email': 'ada@example.com', 'password': 'password',
+                'password2': 'password',
+                'user_type': str(UserType.query.first().id)})
+        finally:
+            password_hasher._run = run
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+        db.session.remove()
+        self.assertIsNone(User.query.filter_by(email='ada@example.com')
+                          .first())
@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import User, Role, UserType
+from app.profiler import profiler
+from app.search import create_index, drop_index
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def enable(self, **config):
+        self.app.config.update(PROFILER_ENABLED=True,
+                               PROFILER_DIR=self.directory, **config)
+        profiler.init_app(self.app)
+
+    def login(self):
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+
+    def test_disabled(self):
+        self.assertFalse(self.app.config['PROFILER_ENABLED'])
+        self.assertNotIn(profiler._start_request,
+                         self.app.before_request_funcs.get(None, []))
+
+    def test_requested_profile(self):
+        self.enable()
+        response = self.client.get('/account/login?_profile=1')
+        self.assertNotIn('X-Profile', response.headers)
+        self.login()
+        response = self.client.get('/admin/tags?_profile=1')
+        name = response.headers['X-Profile']
+        profile = profiler.get(name)
+        self.assertEqual(profile['endpoint'], 'admin.registered_tags')
+        self.assertTrue(profile['requested'])
+        self.assertEqual([p['name'] for p in profiler.profiles()], [name])
+
+        response = self.client.get('/admin/profiles')
+        self.assertIn('/admin/tags', response.data)
+        response = self.client.get('/admin/profiles/%s?sort=tottime' % name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('tottime', response.data)
+        response = self.client.get('/admin/profiles/%s/download' % name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertEqual(
+            self.client.get('/admin/profiles/..%2Fconfig').status_code, 404)
+
+    def test_sampling_keeps_newest(self):
+        self.enable(PROFILER_SAMPLE_RATE=1.0, PROFILER_MAX_PROFILES=2)
+        for path in ['/account/login', '/account/register', '/']:
+            self.client.get(path)
+        self.assertEqual([p['path'] for p in profiler.profiles()],
+                         ['/', '/account/register'])
+        self.assertFalse(profiler.profiles()[0]['requested'])
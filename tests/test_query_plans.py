@@ -0,0 +1,140 @@
+import re
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.admin.views import USER_SORT_COLUMNS
+from app.memberships import set_tags
+from app.models import User, Role, Tag, UserType
+from app.pagination import keyset_paginate, encode_cursor
+from app.search import create_index, drop_index, index_users
+
+# Plan lines showing a full scan of the association table
+_SCANS = {
+    'sqlite': re.compile(r'^SCAN (TABLE )?user_tag_association\b'),
+    'postgresql': re.compile(r'Seq Scan on user_tag_association\b'),
+}
+
+# Plan lines showing that the users were sorted rather than read in the
+# order of an index, or read in full
+_USER_SORTS = {
+    'sqlite': re.compile(r'^USE TEMP B-TREE FOR ORDER BY|'
+                         r'^SCAN (TABLE )?users$'),
+    'postgresql': re.compile(r'(^|-> +)Sort\b|Seq Scan on users\b'),
+}
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """
+    The lookups of memberships run on every profile, tag page and save use
+    the indexes of the association table rather than scanning it, and the
+    pages of the registered users listing are read in index order.
+    """
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        self.dialect = db.engine.dialect.name
+        if self.dialect not in _SCANS:
+            self.skipTest('No query plan checks for %s' % self.dialect)
+        Role.insert_roles()
+        UserType.insert_user_types()
+        tags = [Tag(name='Tag %d' % i) for i in range(20)]
+        db.session.add_all(User(email='user%d@example.com' % i,
+                                tags=tags[i % 7:i % 7 + 5])
+                           for i in range(50))
+        db.session.commit()
+        self.statements = []
+        self.table = 'user_tag_association'
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        if self.table in statement and not executemany:
+            self.statements.append((statement, parameters))
+
+    def run_queries(self, f):
+        """The statements on the association table run by `f`."""
+        db.session.expire_all()
+        del self.statements[:]
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+        try:
+            f()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', self.record)
+        self.assertTrue(self.statements)
+        return list(self.statements)
+
+    def plan(self, statement, parameters):
+        connection = db.session.connection()
+        if self.dialect == 'sqlite':
+            rows = connection.execute('EXPLAIN QUERY PLAN ' + statement,
+                                      parameters)
+            # Inserts of values have no plan
+            if not rows.returns_rows:
+                return []
+            return [tuple(row)[-1] for row in rows]
+        connection.execute('SET LOCAL enable_seqscan = off')
+        return [row[0] for row in
+                connection.execute('EXPLAIN ' + statement, parameters)]
+
+    def assertIndexed(self, f):
+        for statement, parameters in self.run_queries(f):
+            plan = self.plan(statement, parameters)
+            scans = [line for line in plan
+                     if _SCANS[self.dialect].search(line.strip())]
+            self.assertEqual(scans, [], '%s\n%s' % (statement,
+                                                    '\n'.join(plan)))
+
+    def assertInIndexOrder(self, f):
+        for statement, parameters in self.run_queries(f):
+            plan = self.plan(statement, parameters)
+            sorts = [line for line in plan
+                     if _USER_SORTS[self.dialect].search(line.strip())]
+            self.assertEqual(sorts, [], '%s\n%s' % (statement,
+                                                    '\n'.join(plan)))
+
+    def test_tags_of_user(self):
+        self.assertIndexed(lambda: User.query.get(1).tags)
+        self.assertIndexed(lambda: index_users([1, 2, 3]))
+
+    def test_members_of_tag(self):
+        self.assertIndexed(lambda: Tag.query.get(3).users)
+
+    def test_member_counts(self):
+        self.assertIndexed(lambda: Tag.user_counts([1, 2, 3]))
+        self.assertIndexed(lambda: Tag.query.get(1).count_users())
+
+    def test_changes(self):
+        self.assertIndexed(
+            lambda: set_tags(User.query.get(1), Tag.query.filter(
+                Tag.id.in_([1, 10])).all()))
+
+        def delete_user():
+            db.session.delete(User.query.get(2))
+            db.session.flush()
+        self.assertIndexed(delete_user)
+
+        def delete_tag():
+            db.session.delete(Tag.query.get(4))
+            db.session.flush()
+        self.assertIndexed(delete_tag)
+
+    def test_registered_users_pages(self):
+        self.table = 'FROM users'
+        query = User.query.options(db.joinedload(User.role))
+        cursors = [None, encode_cursor([None, 10]),
+                   encode_cursor(['user3@example.com', 10])]
+        for column in USER_SORT_COLUMNS.values():
+            for cursor in cursors:
+                for descending in (False, True):
+                    self.assertInIndexOrder(lambda: keyset_paginate(
+                        query, column, User.id, cursor, per_page=100,
+                        descending=descending))
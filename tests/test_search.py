@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import unittest
+from app import create_app, db
+from app.models import User, Tag
+from app.search import create_index, drop_index, search_users, rebuild_index
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def search_ids(self, query, **kwargs):
+        users, _ = search_users(query, **kwargs)
+        return [u.id for u in users]
+
+    def test_search_by_profile_fields(self):
+        u = User(first_name='Ada', last_name='Lovelace',
+                 email='ada@example.com', hometown='West Philadelphia, PA',
+                 bio='Writes programs for the analytical engine.')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(self.search_ids('lovelace'), [u.id])
+        self.assertEqual(self.search_ids('philadelphia'), [u.id])
+        self.assertEqual(self.search_ids('analytical engine'), [u.id])
+        self.assertEqual(self.search_ids('babbage'), [])
+
+    def test_last_word_matches_as_prefix(self):
+        u = User(first_name=u'José', last_name=u'Martínez',
+                 email='jose@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(self.search_ids(u'jose mart'), [u.id])
+
+    def test_name_ranks_above_bio(self):
+        in_bio = User(first_name='Alan', last_name='Turing',
+                      email='alan@example.com', bio='Worked with Hopper.')
+        in_name = User(first_name='Grace', last_name='Hopper',
+                       email='grace@example.com')
+        db.session.add_all([in_bio, in_name])
+        db.session.commit()
+        self.assertEqual(self.search_ids('hopper'), [in_name.id, in_bio.id])
+
+    def test_profile_changes_are_reindexed(self):
+        u = User(first_name='Ada', last_name='Lovelace',
+                 email='ada@example.com')
+        db.session.add(u)
+        db.session.commit()
+        u.last_name = 'King'
+        db.session.commit()
+        self.assertEqual(self.search_ids('lovelace'), [])
+        self.assertEqual(self.search_ids('king'), [u.id])
+        db.session.delete(u)
+        db.session.commit()
+        self.assertEqual(self.search_ids('king'), [])
+
+    def test_tag_changes_are_reindexed(self):
+        tag = Tag(name='education', description='Tutoring in schools')
+        u = User(first_name='Ada', email='ada@example.com')
+        db.session.add_all([tag, u])
+        db.session.commit()
+        u.tags.append(tag)
+        db.session.commit()
+        self.assertEqual(self.search_ids('tutoring'), [u.id])
+        tag.name = 'mentoring'
+        db.session.commit()
+        self.assertEqual(self.search_ids('mentoring'), [u.id])
+        db.session.delete(tag)
+        db.session.commit()
+        self.assertEqual(self.search_ids('mentoring'), [])
+
+    def test_pagination(self):
+        for i in range(5):
+            db.session.add(User(first_name='Member', last_name=str(i),
+                                email='m%d@example.com' % i))
+        db.session.commit()
+        users, has_next = search_users('member', page=1, per_page=2)
+        self.assertEqual(len(users), 2)
+        self.assertTrue(has_next)
+        users, has_next = search_users('member', page=3, per_page=2)
+        self.assertEqual(len(users), 1)
+        self.assertFalse(has_next)
+
+    def test_rebuild_index(self):
+        u = User(first_name='Ada', email='ada@example.com')
+        db.session.add(u)
+        db.session.commit()
+        rebuild_index()
+        self.assertEqual(self.search_ids('ada'), [u.id])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search_ids('"ada" OR NEAR(*'), [])
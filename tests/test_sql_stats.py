@@ -0,0 +1,113 @@
+import logging
+import unittest
+from app import create_app, db
+from app.models import User, Role, Tag, UserType, Permission
+from app.search import create_index, drop_index
+from app.sql_stats import (
+    collect_queries,
+    query_budget,
+    statement_shape,
+    sql_stats
+)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class SQLStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        admin = Role.query.filter_by(permissions=Permission.ADMINISTER).one()
+        self.admin = User(first_name='Ada', last_name='Lovelace',
+                          email='ada@example.com', password='password',
+                          confirmed=True, admin_check=True, role=admin)
+        db.session.add(self.admin)
+        db.session.commit()
+        self.admin_id = self.admin.id
+        self.client = self.app.test_client()
+        self.client.post('/account/login', data={'email': 'ada@example.com',
+                                                 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_members(self, count):
+        start = Tag.query.count()
+        tags = [Tag(name='tag %d' % i) for i in range(start, start + count)]
+        db.session.add_all(tags)
+        for i, tag in enumerate(tags):
+            db.session.add(User(email='member%d@example.com' % (start + i),
+                                tags=tags[:i + 1]))
+        User.query.get(self.admin_id).tags = Tag.query.all()
+        db.session.commit()
+
+    def test_statement_shape(self):
+        self.assertEqual(
+            statement_shape('SELECT a FROM t\n WHERE id IN (?, ?, ?)'),
+            'SELECT a FROM t WHERE id IN (...)')
+        self.assertEqual(
+            statement_shape('SELECT a FROM t WHERE id IN (%(id_1)s, '
+                            '%(id_2)s) AND b = %(b_1)s'),
+            'SELECT a FROM t WHERE id IN (...) AND b = %(b_1)s')
+
+    def test_collect_queries(self):
+        with collect_queries() as stats:
+            for _ in range(3):
+                User.query.filter_by(email='ada@example.com').first()
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.repeated()[0][0], 3)
+        self.assertEqual(len(stats.slowest_statements()), 3)
+        with self.assertRaises(AssertionError):
+            with query_budget(1):
+                User.query.all()
+                Tag.query.all()
+
+    def test_page_query_budgets(self):
+        pages = ['/admin/tags', '/account/profile/%d' % self.admin_id,
+                 '/admin/users']
+        budgets = {}
+        self.add_members(2)
+        for page in pages:
+            # Measured on the second request, once the caches are warm
+            self.client.get(page)
+            with collect_queries() as stats:
+                self.assertEqual(self.client.get(page).status_code, 200)
+            budgets[page] = stats.count
+        # The number of queries does not grow with the number of rows
+        self.add_members(20)
+        for page in pages:
+            self.client.get(page)
+            with query_budget(budgets[page]):
+                self.client.get(page)
+
+    def test_headers_and_logs(self):
+        self.app.config.update(SQL_STATS_HEADERS=True, SQL_STATS_LOG=True,
+                               SQL_REPEAT_THRESHOLD=2,
+                               SQL_SLOW_QUERY_THRESHOLD=0)
+        sql_stats.init_app(self.app)
+        handler = RecordingHandler()
+        self.app.logger.addHandler(handler)
+        self.app.logger.setLevel(logging.INFO)
+        response = self.client.get('/account/profile/%d' % self.admin_id)
+        self.app.logger.removeHandler(handler)
+        self.assertTrue(int(response.headers['X-SQL-Queries']) > 0)
+        self.assertTrue(float(response.headers['X-SQL-Time']) >= 0)
+        self.assertTrue('X-SQL-Repeated' in response.headers)
+        self.assertTrue(any('queries in' in m for m in handler.messages))
+        self.assertTrue(any(m.startswith('Slow query')
+                            for m in handler.messages))
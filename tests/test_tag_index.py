@@ -0,0 +1,164 @@
+import random
+import threading
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Tag
+from app.search import create_index, drop_index
+from app.tag_index import Bitmap, tag_index, page_of
+
+
+class BitmapTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        # A sparse set, and a set dense enough to use bit set chunks
+        self.sparse = set(rng.sample(range(300000), 3000))
+        self.dense = set(rng.sample(range(140000), 60000))
+
+    def test_membership_and_order(self):
+        for values in (self.sparse, self.dense):
+            bitmap = Bitmap(values)
+            self.assertEqual(len(bitmap), len(values))
+            self.assertEqual(list(bitmap), sorted(values))
+            for value in list(values)[:100]:
+                self.assertTrue(value in bitmap)
+            self.assertFalse(300001 in bitmap)
+
+    def test_set_operations(self):
+        a, b = Bitmap(self.sparse), Bitmap(self.dense)
+        self.assertEqual(list(a & b), sorted(self.sparse & self.dense))
+        self.assertEqual(list(b & b), sorted(self.dense))
+        self.assertEqual(list(a | b), sorted(self.sparse | self.dense))
+
+    def test_discard(self):
+        bitmap = Bitmap(self.dense)
+        removed = set(list(self.dense)[:50000])
+        for value in removed:
+            bitmap.discard(value)
+        self.assertEqual(list(bitmap), sorted(self.dense - removed))
+
+    def test_iter_from(self):
+        bitmap = Bitmap(self.dense)
+        expected = sorted(v for v in self.dense if v >= 70000)
+        self.assertEqual(list(bitmap.iter_from(70000)), expected)
+
+    def test_copy_is_independent(self):
+        bitmap = Bitmap([1, 2, 3])
+        copy = bitmap.copy()
+        copy.add(4)
+        union = bitmap | Bitmap([5])
+        union.add(6)
+        self.assertEqual(list(bitmap), [1, 2, 3])
+
+
+class TagIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        self.student = Tag(name='Student')
+        self.education = Tag(name='education')
+        self.health = Tag(name='health')
+        self.users = [User(email='u%d@example.com' % i) for i in range(4)]
+        self.users[0].tags = [self.student, self.education]
+        self.users[1].tags = [self.student, self.education, self.health]
+        self.users[2].tags = [self.student, self.health]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def ids(self, *users):
+        return [u.id for u in users]
+
+    def test_queries(self):
+        u = self.users
+        self.assertEqual(list(tag_index.members(self.student.id)),
+                         self.ids(u[0], u[1], u[2]))
+        self.assertEqual(list(tag_index.query(
+            all_of=[self.student.id, self.education.id])),
+            self.ids(u[0], u[1]))
+        self.assertEqual(list(tag_index.query(
+            any_of=[self.education.id, self.health.id])),
+            self.ids(u[0], u[1], u[2]))
+        self.assertEqual(list(tag_index.query(
+            all_of=[self.education.id],
+            any_of=[self.health.id])),
+            self.ids(u[1]))
+
+    def test_incremental_updates(self):
+        u = self.users
+        tag_index.members(self.health.id)  # build the index
+        u[3].tags.append(self.health)
+        u[1].tags.remove(self.health)
+        db.session.commit()
+        self.assertEqual(list(tag_index.members(self.health.id)),
+                         self.ids(u[2], u[3]))
+
+        db.session.delete(u[2])
+        db.session.commit()
+        self.assertEqual(list(tag_index.members(self.health.id)),
+                         self.ids(u[3]))
+
+        db.session.delete(self.health)
+        db.session.commit()
+        self.assertEqual(list(tag_index.members(self.health.id)), [])
+
+    def test_rolled_back_changes_are_ignored(self):
+        tag_index.members(self.health.id)
+        self.users[3].tags.append(self.health)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(len(tag_index.members(self.health.id)), 2)
+
+    def test_page_of(self):
+        members = tag_index.members(self.student.id)
+        ids, has_next = page_of(members, per_page=2)
+        self.assertEqual(ids, self.ids(*self.users[:2]))
+        self.assertTrue(has_next)
+        ids, has_next = page_of(members, after=ids[-1], per_page=2)
+        self.assertEqual(ids, self.ids(self.users[2]))
+        self.assertFalse(has_next)
+
+    def during_build(self, f):
+        """Run `f` once `tag_index.build` has read the association table."""
+        calls = []
+
+        def run(conn, cursor, statement, *args):
+            if 'FROM user_tag_association' in statement and not calls:
+                calls.append(f())
+        event.listen(db.engine, 'after_cursor_execute', run)
+        self.addCleanup(event.remove, db.engine, 'after_cursor_execute', run)
+
+    def test_changes_during_rebuild_are_kept(self):
+        u = self.users
+        tag_index.members(self.health.id)
+        tag_index._built_at -= tag_index.max_age + 1
+        available = []
+
+        def commit_meanwhile():
+            # Another thread can use the index while it is being rebuilt
+            thread = threading.Thread(target=lambda: available.append(
+                list(tag_index.members(self.health.id))))
+            thread.daemon = True
+            thread.start()
+            thread.join(5)
+            # A membership committed after the table was read
+            tag_index.apply(added=[(u[3].id, self.health.id)],
+                            removed=[(u[1].id, self.health.id)])
+        self.during_build(commit_meanwhile)
+        tag_index.members(self.student.id)
+        self.assertEqual(available, [self.ids(u[1], u[2])])
+        self.assertEqual(list(tag_index.members(self.health.id)),
+                         self.ids(u[2], u[3]))
+
+    def test_build_started_before_clear_is_discarded(self):
+        self.during_build(tag_index.clear)
+        tag_index.build()
+        self.assertIsNone(tag_index._bitmaps)
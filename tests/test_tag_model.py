@@ -0,0 +1,59 @@
+import unittest
+from app import create_app, db
+from app.models import User, Tag
+from app.search import create_index, drop_index
+
+
+class TagModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_user_counts(self):
+        t1 = Tag(name='education')
+        t2 = Tag(name='health')
+        t3 = Tag(name='unused')
+        u1 = User(email='u1@example.com', tags=[t1, t2])
+        u2 = User(email='u2@example.com', tags=[t1])
+        db.session.add_all([t1, t2, t3, u1, u2])
+        db.session.commit()
+        self.assertEqual(Tag.user_counts(), {t1.id: 2, t2.id: 1})
+        self.assertEqual(Tag.user_counts([t2.id, t3.id]), {t2.id: 1})
+        self.assertEqual(Tag.user_counts([]), {})
+        self.assertEqual(t1.count_users(), 2)
+        self.assertEqual(t3.count_users(), 0)
+
+    def test_upsert_many(self):
+        existing = Tag(name='education', description='Schools')
+        db.session.add(existing)
+        db.session.commit()
+        tags = Tag.upsert_many(['education', 'health', 'arts', 'health', ''],
+                               {'health': 'Clinics', 'education': 'New'})
+        self.assertEqual(sorted(tags), ['arts', 'education', 'health'])
+        self.assertIs(tags['education'], existing)
+        self.assertEqual(existing.description, 'Schools')
+        self.assertEqual(tags['health'].description, 'Clinics')
+        self.assertIsNotNone(tags['arts'].id)
+        db.session.commit()
+        self.assertEqual(Tag.query.count(), 3)
+        self.assertEqual(Tag.upsert_many([]), {})
+
+    def test_find_or_create(self):
+        tag = Tag.find_or_create('health', description='Clinics')
+        self.assertEqual(Tag.find_or_create('health'), tag)
+        self.assertEqual(Tag.query.count(), 1)
+
+    def test_find_or_create_empty_name(self):
+        tag = Tag.find_or_create('')
+        self.assertEqual(tag.name, '')
+        self.assertEqual(Tag.find_or_create(''), tag)
+        self.assertEqual(Tag.query.count(), 1)
@@ -0,0 +1,135 @@
+import json
+import unittest
+from io import BytesIO
+from app import create_app, db
+from app.importer import import_members
+from app.models import User, Role, Tag, UserType
+from app.search import create_index, drop_index
+from app.tag_suggestions import tag_suggestions
+
+
+class TagSuggestionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_index()
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.tags = dict((name, Tag(name=name)) for name in [
+            'Machine Learning', 'Mathematics', 'Math Circles', 'Music',
+            '<b>Marketing</b>'])
+        db.session.add_all(self.tags.values())
+        db.session.add_all([
+            User(email='a@example.com', tags=[self.tags['Math Circles']]),
+            User(email='b@example.com', tags=[self.tags['Math Circles'],
+                                              self.tags['Mathematics']])])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        drop_index()
+        db.drop_all()
+        self.app_context.pop()
+
+    def names(self, prefix, limit=10):
+        return [name for _, name in tag_suggestions.suggest(prefix, limit)]
+
+    def test_suggest(self):
+        self.assertEqual(self.names('ma'), ['Math Circles', 'Mathematics',
+                                            'Machine Learning'])
+        self.assertEqual(self.names('MA', limit=1), ['Math Circles'])
+        self.assertEqual(self.names('lea'), ['Machine Learning'])
+        self.assertEqual(self.names('math  c'), ['Math Circles'])
+        self.assertEqual(self.names('x'), [])
+        self.assertEqual(self.names(' '), [])
+
+    def test_kept_up_to_date(self):
+        self.assertEqual(self.names('ma'), ['Math Circles', 'Mathematics',
+                                            'Machine Learning'])
+        self.tags['Music'].name = 'Maps'
+        db.session.delete(self.tags['Machine Learning'])
+        db.session.add(User(email='c@example.com',
+                            tags=[Tag(name='Magic')]))
+        db.session.commit()
+        self.assertEqual(self.names('ma'), ['Math Circles', 'Magic',
+                                            'Mathematics', 'Maps'])
+        self.assertEqual(self.names('mu'), [])
+
+        self.tags['Music'].name = 'Marine Biology'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.names('mar'), [])
+
+        # Tags created by the importer with Core statements
+        import_members(BytesIO('email,tags\nd@example.com,Marine Biology\n'),
+                       invite=False)
+        db.session.commit()
+        self.assertEqual(self.names('mar'), ['Marine Biology'])
+
+    def test_endpoint(self):
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'ada@example.com',
+                                            'password': 'password'})
+        response = client.get('/account/tags/suggest?q=ma&limit=2')
+        results = json.loads(response.data)['results']
+        self.assertEqual(results, [
+            {'name': 'Math Circles', 'value': self.tags['Math Circles'].id},
+            {'name': 'Mathematics', 'value': self.tags['Mathematics'].id}])
+        results = json.loads(
+            client.get('/account/tags/suggest?q=<b').data)['results']
+        self.assertEqual(results[0]['name'], '&lt;b&gt;Marketing&lt;/b&gt;')
+
+    def test_edit_profile_form(self):
+        User.create_confirmed_admin('Ada', 'Lovelace', 'ada@example.com',
+                                    'password')
+        ada = User.query.filter_by(email='ada@example.com').one()
+        ada.tags = [self.tags['Music']]
+        db.session.commit()
+        client = self.app.test_client()
+        client.post('/account/login', data={'email': 'ada@example.com',
+                                            'password': 'password'})
+        page = client.get('/account/profile/edit').data
+        self.assertIn('Music', page)
+        self.assertNotIn('Mathematics', page)
+        self.assertIn('data-suggest-url="/account/tags/suggest"', page)
+
+        data = {'first_name': 'Ada', 'last_name': 'Lovelace',
+                'tags': [self.tags['Mathematics'].id,
+                         self.tags['Machine Learning'].id]}
+        response = client.post('/account/profile/edit', data=data)
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual(sorted(t.name for t in User.query.get(ada.id).tags),
+                         ['Machine Learning', 'Mathematics'])
+
+        data['tags'] = [self.tags['Music'].id, 0]
+        response = client.post('/account/profile/edit', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Not a valid choice', response.data)
+
+        del data['tags']
+        client.post('/account/profile/edit', data=data)
+        db.session.expire_all()
+        self.assertEqual(User.query.get(ada.id).tags, [])
+
+    def test_deleted_members(self):
+        self.assertEqual(self.names('ma', limit=1), ['Math Circles'])
+        for user in User.query.all():
+            db.session.delete(user)
+        db.session.commit()
+        self.assertEqual(Tag.user_counts(), {})
+        self.assertEqual(self.names('ma'), ['Machine Learning',
+                                            'Math Circles', 'Mathematics'])
+
+    def test_tags_created_outside_the_importer(self):
+        self.assertEqual(self.names('ma'), ['Math Circles', 'Mathematics',
+                                            'Machine Learning'])
+        Tag.find_or_create('Mapping')
+        Tag.upsert_many(['Marine Biology'])
+        db.session.commit()
+        self.assertEqual(self.names('map'), ['Mapping'])
+        self.assertEqual(self.names('mar'), ['Marine Biology'])
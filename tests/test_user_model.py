@@ -1,7 +1,18 @@
 import unittest
 import time
+from flask import current_app
+from sqlalchemy import event
 from app import create_app, db
-from app.models import User, AnonymousUser, Permission, Role
+from app.models import (
+    User,
+    AnonymousUser,
+    Permission,
+    Role,
+    UserType,
+    role_registry,
+    user_type_registry
+)
+from app.search import create_index, drop_index
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -10,9 +21,11 @@ class UserModelTestCase(unittest.TestCase):
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
+        create_index()
 
     def tearDown(self):
         db.session.remove()
+        drop_index()
         db.drop_all()
         self.app_context.pop()
 
@@ -130,3 +143,37 @@ class UserModelTestCase(unittest.TestCase):
     def test_anonymous(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.GENERAL))
+
+    def test_admin_email_gets_administrator_role(self):
+        Role.insert_roles()
+        u = User(email=current_app.config['ADMIN_EMAIL'], password='password')
+        self.assertTrue(u.is_admin())
+        self.assertTrue(u.admin_check)
+
+    def test_creating_users_does_not_query_roles(self):
+        Role.insert_roles()
+        role_registry.all()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            users = [User(email='user%d@example.com' % i) for i in range(50)]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(statements, [])
+        default = Role.query.filter_by(default=True).first()
+        self.assertTrue(all(u.role_id == default.id for u in users))
+
+    def test_registries_reload_after_changes(self):
+        Role.insert_roles()
+        UserType.insert_user_types()
+        self.assertEqual(len(user_type_registry.all()), 5)
+        db.session.add(UserType(name='Partner'))
+        db.session.commit()
+        self.assertTrue(user_type_registry.find(name='Partner') is not None)
+        role = Role.query.filter_by(default=True).first()
+        role.permissions = 0
+        db.session.commit()
+        self.assertEqual(role_registry.get(role.id).permissions, 0)